@@ -0,0 +1,33 @@
+"""Provide the parsing of IGV batch files shared by the tools that render their snapshots."""
+import os
+
+
+def parse_locus(locus):
+    contig, _, interval = locus.rpartition(':')
+    start, end = interval.split('-')
+    return contig, int(start), int(end)
+
+
+def read_snapshot_jobs(batch_files, sessions=False):
+    """
+    Yield (contig, start, end, snapshot path) for every goto/snapshot pair of the given batch files, followed with
+    sessions by the session the batch loaded last, None before any load of the batch.
+    """
+    snapshots_dir = '.'
+    locus = None
+    for batch_file in batch_files:
+        # Every batch starts with the session IGV was launched with
+        session = None
+        with open(batch_file, 'r') as batch:
+            for line in batch:
+                command, _, argument = line.strip().partition(' ')
+                if command == 'snapshotDirectory':
+                    snapshots_dir = argument
+                elif command == 'load':
+                    session = argument
+                elif command == 'goto':
+                    locus = argument
+                elif command == 'snapshot' and locus is not None:
+                    job = parse_locus(locus) + (os.path.join(snapshots_dir, argument),)
+                    yield job + (session,) if sessions else job
+                    locus = None
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+"""Provide a command line tool to precompute the depth of a BAM file over a set of regions, for IGV to display."""
+import argparse
+import logging
+import sys
+
+import numpy as np
+import pysam
+
+from intervals import read_windows
+
+try:
+    import pyBigWig
+except ImportError:
+    pyBigWig = None
+
+logger = logging.getLogger()
+
+CHUNK_SIZE = 1000000
+
+
+class WindowCoverage:
+    """
+    Depth of the sorted, non overlapping windows of one contig, accumulated in a single array.
+
+    The windows are laid end to end in the array, each followed by one spare position, and every aligned block adds
+    +1 where it enters a window and -1 where it leaves it. A cumulative sum then gives the depth of every window, the
+    changes of a window summing to zero before the next one starts.
+    """
+
+    def __init__(self, windows):
+        self.starts = np.array([start for start, _ in windows], dtype=np.int64)
+        self.ends = np.array([end for _, end in windows], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.ends - self.starts + 1)))
+        self.changes = np.zeros(self.offsets[-1], dtype=np.int64)
+
+    def add(self, block_starts, block_ends):
+        """Add aligned blocks, given as arrays of 0-based starts and ends, to the windows they overlap."""
+        block_starts = np.asarray(block_starts, dtype=np.int64)
+        block_ends = np.asarray(block_ends, dtype=np.int64)
+        first = np.searchsorted(self.ends, block_starts, side='right')
+        last = np.searchsorted(self.starts, block_ends, side='left')
+        counts = np.maximum(last - first, 0)
+
+        # A block spanning several windows is repeated once per window
+        blocks = np.repeat(np.arange(len(block_starts)), counts)
+        windows = np.repeat(first, counts) + np.arange(len(blocks)) - np.repeat(np.cumsum(counts) - counts, counts)
+        window_starts = self.starts[windows]
+        entries = self.offsets[windows] + np.maximum(block_starts[blocks], window_starts) - window_starts
+        exits = self.offsets[windows] + np.minimum(block_ends[blocks], self.ends[windows]) - window_starts
+        self.changes += np.bincount(entries, minlength=len(self.changes))
+        self.changes -= np.bincount(exits, minlength=len(self.changes))
+
+    def depths(self):
+        """Yield the start and the per base depth array of every window."""
+        depth = np.cumsum(self.changes)
+        for window, start in enumerate(self.starts.tolist()):
+            yield start, depth[self.offsets[window]:self.offsets[window + 1] - 1]
+
+
+def runs(start, depth, bin_size=1):
+    """Yield (start, end, value) runs of equal, non zero depth, averaged over bins of bin_size bases."""
+    if bin_size > 1:
+        bins = -(-len(depth) // bin_size)
+        sums = np.add.reduceat(depth, np.arange(0, len(depth), bin_size)) if len(depth) else np.zeros(0)
+        widths = np.minimum(bin_size, len(depth) - np.arange(bins) * bin_size)
+        values = sums / widths
+        bounds = np.minimum(np.arange(bins + 1) * bin_size, len(depth))
+        for bin_number in np.flatnonzero(values).tolist():
+            yield start + int(bounds[bin_number]), start + int(bounds[bin_number + 1]), float(values[bin_number])
+        return
+
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(depth)) + 1, [len(depth)]))
+    for run_start, run_end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        value = int(depth[run_start])
+        if value:
+            yield start + run_start, start + run_end, value
+
+
+def write_bedgraph(contig, start, depth, output, bin_size=1):
+    """Write the non zero depth of consecutive positions from start as bedGraph runs."""
+    for run_start, run_end, value in runs(start, depth, bin_size):
+        output.write(f"{contig}\t{run_start}\t{run_end}\t{value:g}\n")
+
+
+def index_bedgraph(path):
+    """Compress a sorted bedGraph with bgzip and index it with tabix, returning the compressed path."""
+    return pysam.tabix_index(path, seq_col=0, start_col=1, end_col=2, zerobased=True, force=True)
+
+
+def is_counted(read):
+    """Tell whether a read adds to the depth IGV shows, which leaves out duplicates, secondary and QC failed reads."""
+    return not (read.is_unmapped or read.is_duplicate or read.is_secondary or read.is_qcfail)
+
+
+class CoverageBuilder:
+    """
+    Compute the depth of a BAM file over the windows of a BED file in a single pass over its reads, and write it
+    as bgzipped, tabix indexed bedGraph, or as bigWig when pyBigWig is installed and requested.
+
+    The reads of the windows are read in order through the index, then their aligned blocks are accumulated a
+    chunk at a time, so deletions and introns are not counted, as in the IGV coverage track.
+    """
+
+    FORMATS = ("bedgraph", "bigwig")
+
+    def __init__(self, bam_path, regions_path, output_prefix, index_path=None, bin_size=1, output_format="bedgraph"):
+        self.bam_path = bam_path
+        self.regions_path = regions_path
+        self.output_prefix = output_prefix
+        self.index_path = index_path
+        self.bin_size = bin_size
+        self.output_format = output_format
+
+    def _contig_coverage(self, bam, contig, windows):
+        coverage = WindowCoverage(windows)
+        starts, ends = [], []
+        previous_end = -1
+        for start, end in windows:
+            for read in bam.fetch(contig, start, end):
+                # Reads spanning several windows are fetched again for every window but only counted once
+                if read.reference_start < previous_end or not is_counted(read):
+                    continue
+                for block_start, block_end in read.get_blocks():
+                    starts.append(block_start)
+                    ends.append(block_end)
+                if len(starts) >= CHUNK_SIZE:
+                    coverage.add(starts, ends)
+                    starts, ends = [], []
+            previous_end = end
+        coverage.add(starts, ends)
+        return coverage
+
+    def _coverages(self):
+        windows = read_windows(self.regions_path)
+        with pysam.AlignmentFile(self.bam_path, 'rb', index_filename=self.index_path) as bam:
+            lengths = dict(zip(bam.references, bam.lengths))
+            for contig in bam.references:
+                if contig in windows:
+                    yield contig, lengths[contig], self._contig_coverage(bam, contig, windows[contig])
+
+    def _write_bedgraph(self):
+        path = f"{self.output_prefix}.bedgraph"
+        with open(path, 'w') as bedgraph:
+            for contig, _, coverage in self._coverages():
+                for start, depth in coverage.depths():
+                    write_bedgraph(contig, start, depth, bedgraph, self.bin_size)
+        return index_bedgraph(path)
+
+    def _write_bigwig(self):
+        path = f"{self.output_prefix}.bw"
+        coverages = list(self._coverages())
+        bigwig = pyBigWig.open(path, 'w')
+        try:
+            bigwig.addHeader([(contig, length) for contig, length, _ in coverages])
+            for contig, _, coverage in coverages:
+                for start, depth in coverage.depths():
+                    entries = list(runs(start, depth, self.bin_size))
+                    if entries:
+                        bigwig.addEntries([contig] * len(entries), [entry[0] for entry in entries],
+                                          ends=[entry[1] for entry in entries],
+                                          values=[float(entry[2]) for entry in entries])
+        finally:
+            bigwig.close()
+        return path
+
+    def build(self):
+        if self.output_format == "bigwig" and pyBigWig is None:
+            logger.warning("pyBigWig is not installed, writing bedGraph instead of bigWig")
+            self.output_format = "bedgraph"
+        path = self._write_bigwig() if self.output_format == "bigwig" else self._write_bedgraph()
+        logger.info(f"Coverage of {self.bam_path} written to {path}")
+        return path
+
+
+def parse_args(argv=None):
+    """Define and immediately parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Compute the depth of a BAM file over the given regions as an indexed coverage track",
+        epilog="Example: python coverage.py --bam sample.bam --regions regions.bed --output sample.coverage",
+    )
+    parser.add_argument(
+        "--bam",
+        type=str,
+        help="Input BAM file, coordinate sorted and indexed"
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        help="Index of the input BAM file (.bai/.csi). Looked up next to the BAM file when not given"
+    )
+    parser.add_argument(
+        "--regions",
+        type=str,
+        help="Regions where the depth is computed (bed or bed.gz)"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Output prefix, extended with .bedgraph.gz (and .tbi) or .bw"
+    )
+    parser.add_argument(
+        "--bin_size",
+        type=int,
+        default=1,
+        help="Report the mean depth of bins of this many bases instead of the depth of every base"
+    )
+    parser.add_argument(
+        "--format",
+        choices=CoverageBuilder.FORMATS,
+        default="bedgraph",
+        help="Output format, bigWig needing pyBigWig"
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Coordinate argument parsing and program execution."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    CoverageBuilder(args.bam, args.regions, args.output, args.index, args.bin_size, args.format).build()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
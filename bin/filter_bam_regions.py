@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+
+"""Provide a command line tool to extract the reads of a BAM file overlapping a set of regions."""
+import argparse
+import heapq
+import logging
+import math
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import pysam
+
+from coverage import CHUNK_SIZE
+from coverage import WindowCoverage
+from coverage import index_bedgraph
+from coverage import is_counted
+from coverage import write_bedgraph
+from intervals import read_windows
+
+logger = logging.getLogger()
+
+BAI_MAX_CONTIG_LENGTH = 2 ** 29
+# Same sampling window as IGV
+SAMPLING_WINDOW = 50
+
+
+def find_index(bam_path):
+    """Return the .bai/.csi index next to a BAM file, if any."""
+    base, _ = os.path.splitext(bam_path)
+    for candidate in (f"{bam_path}.bai", f"{bam_path}.csi", f"{base}.bai", f"{base}.csi"):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def name_hash(name):
+    """Return a hash of a read name that is the same for both mates, in every process and on every run."""
+    return zlib.crc32(name.encode())
+
+
+class ReadSampler:
+    """
+    Deterministic downsampling of coordinate sorted reads to a depth of about max_depth.
+
+    Reads are grouped by start in buckets of `window` bp. Every bucket keeps the reads whose names hash lowest (a
+    bottom-k reservoir), k being chosen from the aligned length of its first read so the bucket adds about max_depth
+    to the depth. The same reads are kept on every run, and pairs stay together: a mate in the same bucket is
+    attached to the candidate of its first read, and a mate found in a later bucket follows the recorded decision.
+
+    Kept mates count against the capacity of their bucket, candidates hashing highest being dropped with their
+    attached mates to make room, so a bucket only holds more than k reads when the mates of earlier buckets alone
+    exceed it.
+    """
+
+    def __init__(self, max_depth, window=SAMPLING_WINDOW):
+        self.max_depth = max_depth
+        self.window = window
+        self.bucket = None
+        self.capacity = 0
+        self.candidates = []
+        self.pending = {}
+        self.attached = 0
+        self.mates = []
+        self.read_number = 0
+        self.decisions = {}
+        self.expiries = []
+        self.dropped = 0
+
+    def _remember(self, read, keep):
+        """Record the decision for the mate of the read, when it comes later on the same contig."""
+        if read.is_paired and not read.mate_is_unmapped and read.next_reference_id == read.reference_id \
+                and read.next_reference_start > read.reference_start:
+            self.decisions[read.query_name] = keep
+            heapq.heappush(self.expiries, (read.next_reference_start, read.query_name))
+
+    def _trim(self):
+        """Drop the candidates hashing highest, with their attached mates, until the bucket fits its capacity."""
+        while self.candidates and len(self.candidates) + self.attached + len(self.mates) > self.capacity:
+            read = heapq.heappop(self.candidates)[2]
+            mates = self.pending.pop(read.query_name)
+            if not mates:
+                self._remember(read, False)
+            self.attached -= len(mates)
+            self.dropped += 1 + len(mates)
+
+    def _flush(self):
+        kept = self.mates
+        for _, number, read in self.candidates:
+            mates = self.pending[read.query_name]
+            if not mates:
+                self._remember(read, True)
+            kept += [(number, read)] + mates
+        self.candidates = []
+        self.pending = {}
+        self.attached = 0
+        self.mates = []
+        return [read for _, read in sorted(kept, key=lambda entry: entry[0])]
+
+    def add(self, read):
+        """Add the next read, returning the reads of the buckets it completes, in their original order."""
+        ready = []
+        bucket = read.reference_start // self.window
+        if bucket != self.bucket:
+            ready = self._flush()
+            self.bucket = bucket
+            self.capacity = max(1, math.ceil(self.max_depth * self.window / max(1, read.reference_length or 1)))
+            # Mates starting before this bucket were not in the windows, their decisions are no longer needed
+            while self.expiries and self.expiries[0][0] < read.reference_start:
+                self.decisions.pop(heapq.heappop(self.expiries)[1], None)
+
+        self.read_number += 1
+        keep = self.decisions.pop(read.query_name, None)
+        if keep is not None:
+            if keep:
+                self.mates.append((self.read_number, read))
+                self._trim()
+            else:
+                self.dropped += 1
+            return ready
+
+        if read.query_name in self.pending:
+            # The first read of the pair is still a candidate of this bucket, the mate shares its fate
+            self.pending[read.query_name].append((self.read_number, read))
+            self.attached += 1
+        else:
+            # Negated hashes make the heap drop the highest hash first
+            heapq.heappush(self.candidates, (-name_hash(read.query_name), self.read_number, read))
+            self.pending[read.query_name] = []
+        self._trim()
+        return ready
+
+    def flush(self):
+        """Return the reads of the last bucket."""
+        return self._flush()
+
+
+def extract_contig(bam_path, index_path, contig, windows, output_path, max_depth=None, coverage_path=None):
+    """
+    Write to output_path the reads of one contig overlapping the given sorted, non overlapping windows.
+
+    The index is used to seek every window. A read spanning several windows is only written for the first one, so
+    the output stays coordinate sorted and free of duplicates.
+
+    With max_depth, reads are downsampled by a ReadSampler and the depth of all the reads in the windows, as IGV
+    would show it before downsampling, is written to coverage_path as bedGraph. Returns the number of reads
+    written and dropped.
+    """
+    written = 0
+    sampler = ReadSampler(max_depth) if max_depth else None
+    coverage = WindowCoverage(windows) if sampler else None
+    block_starts, block_ends = [], []
+    with pysam.AlignmentFile(bam_path, 'rb', index_filename=index_path) as bam, \
+            pysam.AlignmentFile(output_path, 'wb', template=bam) as output:
+        previous_end = -1
+        for start, end in windows:
+            for read in bam.fetch(contig, start, end):
+                if read.reference_start < previous_end:
+                    continue
+                if coverage and is_counted(read):
+                    for block_start, block_end in read.get_blocks():
+                        block_starts.append(block_start)
+                        block_ends.append(block_end)
+                    if len(block_starts) >= CHUNK_SIZE:
+                        coverage.add(block_starts, block_ends)
+                        block_starts, block_ends = [], []
+                for ready in sampler.add(read) if sampler else (read,):
+                    output.write(ready)
+                    written += 1
+            previous_end = end
+        for ready in sampler.flush() if sampler else ():
+            output.write(ready)
+            written += 1
+
+    if coverage:
+        coverage.add(block_starts, block_ends)
+        with open(coverage_path, 'w') as bedgraph:
+            for start, depth in coverage.depths():
+                write_bedgraph(contig, start, depth, bedgraph)
+    return written, sampler.dropped if sampler else 0
+
+
+class BamRegionsExtractor:
+    """
+    Extract the reads of a BAM in a set of regions, one contig per worker process, and index the result.
+
+    This is not a single pass: every worker writes the part of its contig, the parts are concatenated in header
+    order (pysam.cat copies their compressed blocks) and the merged BAM is then read again to write its index.
+
+    With max_depth, reads are downsampled to about that depth and the full depth is written next to the output as
+    indexed bedGraph, so the filtered BAM grows with the depth cap rather than with the depth of the regions.
+    """
+
+    def __init__(self, bam_path, regions_path, output_path, index_path=None, threads=1, max_depth=None):
+        self.bam_path = bam_path
+        self.regions_path = regions_path
+        self.output_path = output_path
+        self.index_path = index_path
+        self.threads = threads
+        self.max_depth = max_depth
+
+    @property
+    def coverage_path(self):
+        base = self.output_path[:-len(".bam")] if self.output_path.endswith(".bam") else self.output_path
+        return base + ".coverage.bedgraph.gz"
+
+    def _check_index(self):
+        self.index_path = self.index_path or find_index(self.bam_path)
+        if not self.index_path:
+            logger.warning(f"No index found for {self.bam_path}, indexing it before extracting regions")
+            pysam.index(self.bam_path)
+            self.index_path = find_index(self.bam_path)
+
+    def _index_output(self, contig_lengths):
+        if any(length > BAI_MAX_CONTIG_LENGTH for length in contig_lengths):
+            pysam.index("-c", self.output_path)
+            return f"{self.output_path}.csi"
+        pysam.index(self.output_path)
+        return f"{self.output_path}.bai"
+
+    def build(self):
+        self._check_index()
+        windows = read_windows(self.regions_path)
+
+        with pysam.AlignmentFile(self.bam_path, 'rb', index_filename=self.index_path) as bam:
+            contigs = [contig for contig in bam.references if contig in windows]
+            contig_lengths = bam.lengths
+            missing = set(windows).difference(bam.references)
+        if missing:
+            logger.warning(f"Regions in contigs not present in {self.bam_path}: {', '.join(sorted(missing))}")
+
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(self.output_path))) as parts_dir:
+            parts = [os.path.join(parts_dir, f"{number}.bam") for number in range(len(contigs))]
+            coverage_parts = [os.path.join(parts_dir, f"{number}.bedgraph") for number in range(len(contigs))]
+            with ProcessPoolExecutor(max_workers=self.threads) as executor:
+                counts = list(executor.map(extract_contig,
+                                           [self.bam_path] * len(contigs),
+                                           [self.index_path] * len(contigs),
+                                           contigs,
+                                           [windows[contig] for contig in contigs],
+                                           parts,
+                                           [self.max_depth] * len(contigs),
+                                           coverage_parts))
+
+            if self.max_depth:
+                bedgraph_path = self.coverage_path[:-len(".gz")]
+                with open(bedgraph_path, 'w') as coverage:
+                    for coverage_part in coverage_parts:
+                        with open(coverage_part, 'r') as part:
+                            shutil.copyfileobj(part, coverage)
+                index_bedgraph(bedgraph_path)
+
+            # Parts follow the header order of the contigs, so their concatenation is coordinate sorted. It is
+            # indexed afterwards, in a pass of its own
+            if parts:
+                pysam.cat("-o", self.output_path, *parts)
+            else:
+                with pysam.AlignmentFile(self.bam_path, 'rb', index_filename=self.index_path) as bam, \
+                        pysam.AlignmentFile(self.output_path, 'wb', template=bam):
+                    pass
+
+        index = self._index_output(contig_lengths)
+        written = sum(count for count, _ in counts)
+        logger.info(f"{written} reads from {len(contigs)} contigs written to {self.output_path} ({index})")
+        if self.max_depth:
+            logger.info(f"{sum(dropped for _, dropped in counts)} reads dropped to a depth of {self.max_depth}, "
+                        f"full depth written to {self.coverage_path}")
+        return index
+
+
+def parse_args(argv=None):
+    """Define and immediately parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Extract and index the reads of a BAM file overlapping the given regions",
+        epilog="Example: python filter_bam_regions.py --bam sample.bam --regions regions.bed "
+               "--output sample.filtered.bam",
+    )
+    parser.add_argument(
+        "--bam",
+        type=str,
+        help="Input BAM file, coordinate sorted"
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        help="Index of the input BAM file (.bai/.csi). Looked up next to the BAM file when not given"
+    )
+    parser.add_argument(
+        "--regions",
+        type=str,
+        help="Regions to extract (bed or bed.gz)"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Output BAM file, indexed next to it"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of contigs processed in parallel"
+    )
+    parser.add_argument(
+        "--max_depth",
+        type=int,
+        help="Downsample the reads to about this depth, deterministically and keeping pairs together. "
+             "The full depth is written next to the output as <name>.coverage.bedgraph.gz"
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Coordinate argument parsing and program execution."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    BamRegionsExtractor(args.bam, args.regions, args.output, args.index, args.threads, args.max_depth).build()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""Provide a command line tool to keep the records of a VCF file overlapping a set of regions."""
+import argparse
+import logging
+import os
+import sys
+
+import pysam
+
+from intervals import open_text
+from intervals import read_windows
+
+logger = logging.getLogger()
+
+
+def find_tabix_index(vcf_path):
+    """Return the .tbi/.csi index next to a compressed VCF file, if any."""
+    for candidate in (f"{vcf_path}.tbi", f"{vcf_path}.csi"):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def record_span(fields):
+    """Return the 0-based, half open span of a VCF record, using INFO/END for symbolic alleles."""
+    start = int(fields[1]) - 1
+    end = start + len(fields[3])
+    if fields[4].startswith('<'):
+        for entry in fields[7].split(';'):
+            if entry.startswith('END='):
+                end = max(end, int(entry[4:]))
+                break
+    return start, end
+
+
+class VcfRegionsFilter:
+    """
+    Keep the records of a VCF overlapping a set of windows.
+
+    Indexed, compressed VCFs are read through tabix one window at a time. Other VCFs are streamed once, with a
+    pointer per contig sweeping the sorted windows, so each record costs a comparison instead of a lookup.
+    """
+
+    def __init__(self, vcf_path, regions_path, output_path, index_path=None):
+        self.vcf_path = vcf_path
+        self.regions_path = regions_path
+        self.output_path = output_path
+        self.index_path = index_path
+
+    def _sweep(self, windows):
+        """Yield the header and the overlapping records of a sorted VCF, read sequentially."""
+        pointers = dict.fromkeys(windows, 0)
+        with open_text(self.vcf_path) as vcf_file:
+            for line in vcf_file:
+                if line.startswith('#'):
+                    yield line
+                    continue
+                fields = line.split('\t', 8)
+                contig_windows = windows.get(fields[0])
+                if not contig_windows:
+                    continue
+                start, end = record_span(fields)
+                pointer = pointers[fields[0]]
+                while pointer < len(contig_windows) and contig_windows[pointer][1] <= start:
+                    pointer += 1
+                pointers[fields[0]] = pointer
+                if pointer < len(contig_windows) and contig_windows[pointer][0] < end:
+                    yield line
+
+    def _fetch(self, windows):
+        """Yield the header and the overlapping records of an indexed VCF, seeking every window."""
+        with pysam.TabixFile(self.vcf_path, index=self.index_path) as vcf_file:
+            for line in vcf_file.header:
+                yield f'{line}\n'
+            for contig in vcf_file.contigs:
+                previous_end = -1
+                for window_start, window_end in windows.get(contig, []):
+                    for line in vcf_file.fetch(contig, window_start, window_end):
+                        # Records spanning several windows were already written with the first one
+                        if int(line.split('\t', 2)[1]) - 1 < previous_end:
+                            continue
+                        yield f'{line}\n'
+                    previous_end = window_end
+
+    def _first_record(self):
+        with open_text(self.vcf_path) as vcf_file:
+            for line in vcf_file:
+                if not line.startswith('#'):
+                    return line
+        return None
+
+    def build(self):
+        windows = read_windows(self.regions_path)
+        self.index_path = self.index_path or (find_tabix_index(self.vcf_path)
+                                              if self.vcf_path.endswith('.gz') else None)
+        lines = self._fetch(windows) if self.index_path else self._sweep(windows)
+
+        records = 0
+        with pysam.BGZFile(self.output_path, 'wb') as output:
+            for line in lines:
+                if not line.startswith('#'):
+                    records += 1
+                output.write(line.encode())
+            # IGV needs at least one variant to load the track, keep the first one when nothing overlaps
+            if not records:
+                first_record = self._first_record()
+                if first_record:
+                    output.write(first_record.encode())
+
+        pysam.tabix_index(self.output_path, preset='vcf', force=True)
+        logger.info(f"{records} records written to {self.output_path}")
+        return records
+
+
+def parse_args(argv=None):
+    """Define and immediately parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Keep the records of a VCF file overlapping the given regions, as a bgzipped and indexed VCF",
+        epilog="Example: python filter_vcf_regions.py --vcf calls.vcf.gz --regions regions.bed "
+               "--output calls.filtered.vcf.gz",
+    )
+    parser.add_argument(
+        "--vcf",
+        type=str,
+        help="Input VCF file (vcf or vcf.gz), sorted"
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        help="Tabix index of the input VCF file. Looked up next to a compressed VCF file when not given"
+    )
+    parser.add_argument(
+        "--regions",
+        type=str,
+        help="Regions to keep (bed or bed.gz)"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Output VCF file (vcf.gz), indexed next to it"
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Coordinate argument parsing and program execution."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    VcfRegionsFilter(args.vcf, args.regions, args.output, args.index).build()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+"""Provide a command line tool to render IGV batch files with a warm pool of IGV instances driven over their ports."""
+import argparse
+import asyncio
+import logging
+import os
+import shlex
+import sys
+import time
+
+from batch_io import read_snapshot_jobs
+
+logger = logging.getLogger()
+
+
+class IGVCommandError(Exception):
+    """Raised when IGV answers a batch command with an error."""
+
+
+class IGVWorker:
+    """
+    One IGV instance listening on a batch port. The session is loaded once when the worker starts, then every
+    snapshot only costs a goto and a snapshot command, unless it comes from another session (rendering profile)
+    of the batch, which the worker loads first.
+
+    Without a launch command the worker connects to an IGV already listening on the port, and restarting it only
+    reconnects and reloads the session.
+    """
+
+    CONNECT_INTERVAL = 0.5
+
+    def __init__(self, port, session, command=None, host='127.0.0.1', startup_timeout=120, log_dir=None):
+        self.port = port
+        self.session = session
+        self.command = command
+        self.host = host
+        self.startup_timeout = startup_timeout
+        self.log_dir = log_dir
+        self.process = None
+        self.reader = None
+        self.writer = None
+        self.snapshots_dir = None
+        self.loaded = None
+
+    def __str__(self):
+        return f"IGV worker on port {self.port}"
+
+    async def _launch(self):
+        args = [argument.format(port=self.port) for argument in shlex.split(self.command)]
+        log = open(os.path.join(self.log_dir, f"igv_{self.port}.log"), 'ab') if self.log_dir else None
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *args, stdin=asyncio.subprocess.DEVNULL,
+                stdout=log or asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.STDOUT)
+        finally:
+            if log:
+                log.close()
+
+    async def _connect(self):
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if self.process and self.process.returncode is not None:
+                raise ConnectionError(f"{self} exited with code {self.process.returncode} before accepting commands")
+            try:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise ConnectionError(f"{self} did not accept connections within {self.startup_timeout}s")
+                await asyncio.sleep(self.CONNECT_INTERVAL)
+
+    async def start(self):
+        if self.command:
+            await self._launch()
+        await self._connect()
+        self.snapshots_dir = None
+        await self.send(f"load {self.session}", self.startup_timeout)
+        self.loaded = self.session
+
+    async def stop(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = self.reader = None
+        if self.process and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+        self.process = None
+
+    async def restart(self):
+        await self.stop()
+        await self.start()
+
+    async def send(self, command, timeout):
+        """Send one batch command and wait for its reply, IGV answering every command with a single line."""
+        self.writer.write(f"{command}\n".encode())
+        await asyncio.wait_for(self.writer.drain(), timeout)
+        reply = await asyncio.wait_for(self.reader.readline(), timeout)
+        if not reply:
+            raise ConnectionError(f"{self} closed the connection on '{command}'")
+        reply = reply.decode().strip()
+        if reply.lower().startswith('error'):
+            raise IGVCommandError(f"{self} failed on '{command}': {reply}")
+        return reply
+
+    async def snapshot(self, job, timeout):
+        contig, start, end, snapshot_path, session = job
+        if session and session != self.loaded:
+            await self.send(f"load {session}", self.startup_timeout)
+            self.loaded = session
+        snapshots_dir, snapshot_name = os.path.split(snapshot_path)
+        if snapshots_dir != self.snapshots_dir:
+            await self.send(f"snapshotDirectory {snapshots_dir}", timeout)
+            self.snapshots_dir = snapshots_dir
+        await self.send(f"goto {contig}:{start}-{end}", timeout)
+        await self.send(f"snapshot {snapshot_name}", timeout)
+
+
+class SnapshotDispatcher:
+    """
+    Stream the snapshots of IGV batch files to a pool of IGV workers.
+
+    Jobs go through a bounded queue, so reading the batch files never runs more than queue_size snapshots ahead of
+    the workers. A command failing, timing out or losing its connection restarts the worker, which retries the same
+    snapshot up to `retries` times before recording it as failed.
+    """
+
+    def __init__(self, session, batch_files, ports, command=None, command_timeout=60, retries=2, queue_size=64,
+                 startup_timeout=120, log_dir=None):
+        self.batch_files = batch_files
+        self.command_timeout = command_timeout
+        self.retries = retries
+        self.queue_size = max(queue_size, len(ports))
+        self.workers = [IGVWorker(port, session, command, startup_timeout=startup_timeout, log_dir=log_dir)
+                        for port in ports]
+        self.queued = 0
+        self.read_all = False
+        self.rendered = 0
+        self.failed = []
+
+    async def _produce(self, queue):
+        for job in read_snapshot_jobs(self.batch_files, sessions=True):
+            os.makedirs(os.path.dirname(job[3]) or '.', exist_ok=True)
+            await queue.put(job)
+            self.queued += 1
+        self.read_all = True
+        for _ in self.workers:
+            await queue.put(None)
+
+    async def _consume(self, worker, queue):
+        try:
+            try:
+                await worker.start()
+            except (OSError, asyncio.TimeoutError, IGVCommandError) as error:
+                logger.error(f"{worker} could not start: {error}")
+                return
+
+            while True:
+                job = await queue.get()
+                if job is None:
+                    return
+                for attempt in range(self.retries + 1):
+                    try:
+                        await worker.snapshot(job, self.command_timeout)
+                        self.rendered += 1
+                        break
+                    except (OSError, asyncio.TimeoutError, IGVCommandError) as error:
+                        logger.warning(f"Snapshot {job[3]} failed (attempt {attempt + 1}): {error or 'timeout'}")
+                        if attempt == self.retries:
+                            self.failed.append(job[3])
+                        try:
+                            await worker.restart()
+                        except (OSError, asyncio.TimeoutError, IGVCommandError) as restart_error:
+                            logger.error(f"{worker} could not restart: {restart_error}")
+                            if attempt < self.retries:
+                                self.failed.append(job[3])
+                            return
+        finally:
+            await worker.stop()
+
+    async def run(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        producer = asyncio.ensure_future(self._produce(queue))
+        started = time.perf_counter()
+        await asyncio.gather(*(self._consume(worker, queue) for worker in self.workers))
+
+        producer.cancel()
+
+        # Every worker is gone, jobs still queued or unread can no longer be rendered
+        if not self.read_all or self.queued > self.rendered + len(self.failed):
+            raise RuntimeError(f"All IGV workers stopped with snapshots left to render "
+                               f"({self.rendered} rendered, {len(self.failed)} failed)")
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"{self.rendered} snapshots rendered with {len(self.workers)} IGV workers "
+                    f"({self.rendered / elapsed if elapsed else 0:.1f} snapshots/sec)")
+        if self.failed:
+            logger.error(f"{len(self.failed)} snapshots failed: {', '.join(self.failed)}")
+        return self.rendered
+
+    def build(self):
+        return asyncio.run(self.run())
+
+
+def parse_args(argv=None):
+    """Define and immediately parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Render the snapshots of IGV batch files with a pool of IGV instances listening on batch ports",
+        epilog="Example: python igv_dispatcher.py --session igv_session.xml --batch snapshots.txt --workers 4 "
+               "--igv_command 'igv.sh -p {port} -o prefs.properties'",
+    )
+    parser.add_argument(
+        "--session",
+        type=str,
+        help="IGV session loaded once by every worker"
+    )
+    parser.add_argument(
+        "--batch",
+        nargs='+',
+        help="IGV batch files with the goto/snapshot commands to render"
+    )
+    parser.add_argument(
+        "--igv_command",
+        type=str,
+        help="Command starting one IGV instance, '{port}' being replaced by its batch port. "
+             "Workers connect to already running instances when not given"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of IGV instances"
+    )
+    parser.add_argument(
+        "--base_port",
+        type=int,
+        default=60151,
+        help="Batch port of the first IGV instance, the next ones listening on the following ports"
+    )
+    parser.add_argument(
+        "--command_timeout",
+        type=float,
+        default=60,
+        help="Seconds to wait for IGV to answer a goto or snapshot command"
+    )
+    parser.add_argument(
+        "--startup_timeout",
+        type=float,
+        default=120,
+        help="Seconds to wait for an IGV instance to accept connections and load the session"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="Number of times a failed snapshot is retried on a restarted worker"
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=64,
+        help="Maximum number of snapshots read ahead of the workers"
+    )
+    parser.add_argument(
+        "--log_dir",
+        type=str,
+        help="Directory where the output of every IGV instance is written (igv_<port>.log)"
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Coordinate argument parsing and program execution."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    ports = range(args.base_port, args.base_port + args.workers)
+    dispatcher = SnapshotDispatcher(args.session, args.batch, ports, args.igv_command, args.command_timeout,
+                                    args.retries, args.queue_size, args.startup_timeout, args.log_dir)
+    dispatcher.build()
+    return 1 if dispatcher.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
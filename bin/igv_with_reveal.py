@@ -1,19 +1,41 @@
 #!/usr/bin/env python
 
 import argparse
+import hashlib
+import json
 import logging
+import os
+import shutil
 import sys
 import csv
-import random
-import string
+import math
+import time
+from collections import Counter
+from itertools import chain
+from pathlib import Path
+
+import numpy as np
+import pysam
+from pysam import bcftools
+from pysam.utils import SamtoolsError
+
+from intervals import BED_HEADERS
+from intervals import open_text
+from intervals import read_bed
+from intervals import read_fai
+from intervals import read_windows
+from input_parser import write_igv_preferences
+from metrics import Metrics
+from region_table import RegionTable
 
 logger = logging.getLogger()
 
 
 class Track:
-    def __init__(self, label, path):
+    def __init__(self, label, path, index=None):
         self._label = label
         self._path = path
+        self._index = index or None
 
     @property
     def label(self):
@@ -23,120 +45,889 @@ class Track:
     def path(self):
         return self._path
 
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def is_alignment(self):
+        return self._path.endswith(".bam")
+
+    @property
+    def is_variant(self):
+        return self._path.endswith((".vcf", ".vcf.gz"))
+
+    @property
+    def is_coverage(self):
+        return self._path.endswith((".bedgraph", ".bedgraph.gz", ".bw", ".bigwig"))
+
+
+def estimate_reloads(windows):
+    """
+    Count the windows IGV has to load to visit the given (contig, start, end) windows in order, assuming it keeps
+    the last loaded window and only reloads when a goto leaves it.
+    """
+    reloads = 0
+    loaded = None
+    for contig, start, end in windows:
+        if loaded is None or contig != loaded[0] or start < loaded[1] or end > loaded[2]:
+            loaded = (contig, start, end)
+            reloads += 1
+    return reloads
+
 
 class IGVSessionBuilder:
-    def __init__(self, local_reference_name, local_tracks_with_labels):
+    """
+    Build the IGV session of a run, in one of three rendering profiles: `full` shows every read, `squished` packs
+    them in thin rows and `coverage` only shows the depth. A coverage session leaves out the alignments that have a
+    precomputed coverage, so IGV never reads them, and hides the other ones, so their reads are not laid out.
+    """
+
+    BAM_FACTOR = 20
+    VCF_FACTOR = 4
+    CONTIGS_FACTOR = 6
+    SEQUENCE_FACTOR = 2
+    OTHER_FACTOR = 5
+
+    FULL = "full"
+    SQUISHED = "squished"
+    COVERAGE = "coverage"
+    PROFILES = (FULL, SQUISHED, COVERAGE)
+
+    def __init__(self, local_reference_name, local_tracks_with_labels, profile=FULL):
+        if profile not in self.PROFILES:
+            raise ValueError(f"Unknown rendering profile {profile}, expected one of {', '.join(self.PROFILES)}")
         self.reference = local_reference_name
         self.tracks_with_labels = local_tracks_with_labels
+        self.profile = profile
         self.tracks = []
+        self.coverages = {}
+
+    @staticmethod
+    def variant_name(session_name, profile):
+        """Name the session of a profile after the full one: igv.session.xml gives igv.session.<profile>.xml."""
+        if profile == IGVSessionBuilder.FULL:
+            return session_name
+        root, extension = os.path.splitext(session_name)
+        return f"{root}.{profile}{extension}"
 
     def _check_tracks(self):
+        self.tracks = []
         for track_with_label in self.tracks_with_labels:
-            label, path = track_with_label.split(":")
-            self.tracks.append(Track(label, path))
+            # label:path, or label:path:index for tracks with an index IGV should not look for
+            self.tracks.append(Track(*track_with_label.split(":")))
 
-    def build(self):
+        # A coverage track labelled as an alignment replaces the coverage IGV would compute from its reads
+        alignments = {track.label for track in self.tracks if track.is_alignment}
+        self.coverages = {track.label: track for track in self.tracks
+                          if track.is_coverage and track.label in alignments}
+
+    def _is_feature(self, track):
+        return not track.is_alignment and not track.is_variant and self.coverages.get(track.label) is not track
+
+    def _is_loaded(self, track):
+        """Tell whether the session loads the track, alignments with a precomputed coverage not being shown."""
+        return not (self.profile == self.COVERAGE and track.is_alignment and track.label in self.coverages)
+
+    def panel_layout(self):
+        """
+        Return (tracks, top, bottom) for every panel in display order, top and bottom being fractions of the height.
+
+        The first panel holds the reference sequence and the variant tracks, then each alignment gets its own panel
+        and the last one holds the remaining feature tracks.
+        """
+        self._check_tracks()
+        variants = [track for track in self.tracks if track.is_variant]
+        features = [track for track in self.tracks if self._is_feature(track)]
+
+        panels = [(variants, self.SEQUENCE_FACTOR + self.VCF_FACTOR * len(variants))]
+        for track in self.tracks:
+            if track.is_alignment:
+                panels.append(([track], self.CONTIGS_FACTOR if "contigs" in track.label.lower() else self.BAM_FACTOR))
+        panels.append((features, self.OTHER_FACTOR * len(features)))
+
+        total = sum(factor for _, factor in panels)
+        layout = []
+        position = 0
+        for tracks, factor in panels:
+            layout.append((tracks, position / total, (position + factor) / total))
+            position += factor
+        return layout
+
+    def lines(self):
+        """Yield the session XML, a few lines at a time."""
         self._check_tracks()
-        xml_data = '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n' \
-                   f'<Session genome="{self.reference}" hasGeneTrack="false" hasSequenceTrack="true" version="8">\n' \
-                   '\t<Resources>\n'
+        yield '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n' \
+              f'<Session genome="{self.reference}" hasGeneTrack="false" hasSequenceTrack="true" version="8">\n' \
+              '\t<Resources>\n'
         for track in self.tracks:
-            xml_data += f'\t\t<Resource path="{track.path}"/>\n'
-        xml_data += '\t</Resources>\n'
+            if not self._is_loaded(track):
+                continue
+            index = f' index="{track.index}"' if track.index else ''
+            yield f'\t\t<Resource path="{track.path}"{index}/>\n'
+        yield '\t</Resources>\n'
 
         panel_num = 1
-        panel_factors = [0]
-
-        bam_factor = 20
-        vcf_factor = 4
-        contigs_factor = 6
-        sequence_factor = 2
-        other_factor = 5
-
-        xml_data += f'\t<Panel name="Panel_{panel_num}">\n'
-        xml_data += f'\t\t<Track attributeKey="Reference sequence" clazz="org.broad.igv.track.SequenceTrack" ' \
-                    f'fontSize="10" id="Reference sequence" name="Reference sequence" sequenceTranslationStrandValue="POSITIVE" ' \
-                    f'shouldShowTranslation="true" visible="true"/>\n'
-        factor = sequence_factor
+
+        yield f'\t<Panel name="Panel_{panel_num}">\n'
+        yield f'\t\t<Track attributeKey="Reference sequence" clazz="org.broad.igv.track.SequenceTrack" ' \
+              f'fontSize="10" id="Reference sequence" name="Reference sequence" sequenceTranslationStrandValue="POSITIVE" ' \
+              f'shouldShowTranslation="true" visible="true"/>\n'
         for track in self.tracks:
-            if track.path.endswith(".vcf"):
-                xml_data += f'\t\t<Track attributeKey="{track.label}" clazz="org.broad.igv.variant.VariantTrack" colorScale="ContinuousColorScale;0.0;0.0;255,255,255;0,0,178" ' \
-                            f'displayMode="EXPANDED" fontSize="10" groupByStrand="false" id="{track.path}" name="{track.label}" ' \
-                            f'siteColorMode="ALLELE_FREQUENCY" squishedHeight="1" visible="true"/>\n'
+            if track.is_variant:
+                yield f'\t\t<Track attributeKey="{track.label}" clazz="org.broad.igv.variant.VariantTrack" colorScale="ContinuousColorScale;0.0;0.0;255,255,255;0,0,178" ' \
+                      f'displayMode="EXPANDED" fontSize="10" groupByStrand="false" id="{track.path}" name="{track.label}" ' \
+                      f'siteColorMode="ALLELE_FREQUENCY" squishedHeight="1" visible="true"/>\n'
 
                 panel_num += 1
-                factor += vcf_factor
-        panel_factors.append(panel_factors[-1] + factor)
 
-        xml_data += f'\t</Panel>\n'
+        yield f'\t</Panel>\n'
 
         for track in self.tracks:
-            if track.path.endswith(".bam"):
-                xml_data += f'\t<Panel name="Panel_{panel_num}">\n' \
-                            f'\t\t<Track attributeKey="{track.label} Coverage" autoScale="true" clazz="org.broad.igv.sam.CoverageTrack" color="175,175,175" ' \
-                            f'colorScale="ContinuousColorScale;0.0;60.0;255,255,255;175,175,175" fontSize="10" id="{track.path}_coverage" name="{track.label} Coverage" ' \
-                            f'snpThreshold="0.2" visible="true">\n' \
-                            f'\t\t\t<DataRange baseline="0.0" drawBaseline="true" flipAxis="false" maximum="13.0" minimum="0.0" type="LINEAR"/>\n' \
-                            f'\t\t</Track>\n' \
-                            f'\t\t<Track attributeKey="{track.label}" clazz="org.broad.igv.sam.AlignmentTrack" displayMode="COLLAPSED" ' \
-                            f'experimentType="THIRD_GEN" fontSize="10" id="{track.path}" name="{track.label}" visible="true">\n' \
-                            f'\t\t\t<RenderOptions/>\n' \
-                            f'\t\t</Track>\n' \
-                            f'\t</Panel>\n'
-                panel_num += 1
-                if "contigs" in track.label.lower():
-                    panel_factors.append(panel_factors[-1] + contigs_factor)
+            if track.is_alignment:
+                coverage = self.coverages.get(track.label)
+                if coverage:
+                    coverage_track = f'\t\t<Track attributeKey="{track.label} Coverage" autoScale="true" clazz="org.broad.igv.track.DataSourceTrack" color="175,175,175" ' \
+                                     f'fontSize="10" id="{coverage.path}" name="{track.label} Coverage" renderer="BAR_CHART" visible="true">\n'
                 else:
-                    panel_factors.append(panel_factors[-1] + bam_factor)
+                    coverage_track = f'\t\t<Track attributeKey="{track.label} Coverage" autoScale="true" clazz="org.broad.igv.sam.CoverageTrack" color="175,175,175" ' \
+                                     f'colorScale="ContinuousColorScale;0.0;60.0;255,255,255;175,175,175" fontSize="10" id="{track.path}_coverage" name="{track.label} Coverage" ' \
+                                     f'snpThreshold="0.2" visible="true">\n'
+                yield f'\t<Panel name="Panel_{panel_num}">\n' \
+                      f'{coverage_track}' \
+                      f'\t\t\t<DataRange baseline="0.0" drawBaseline="true" flipAxis="false" maximum="13.0" minimum="0.0" type="LINEAR"/>\n' \
+                      f'\t\t</Track>\n'
+                if self._is_loaded(track):
+                    display_mode = "SQUISHED" if self.profile == self.SQUISHED else "COLLAPSED"
+                    visible = "false" if self.profile == self.COVERAGE else "true"
+                    yield f'\t\t<Track attributeKey="{track.label}" clazz="org.broad.igv.sam.AlignmentTrack" displayMode="{display_mode}" ' \
+                          f'experimentType="THIRD_GEN" fontSize="10" id="{track.path}" name="{track.label}" visible="{visible}">\n' \
+                          f'\t\t\t<RenderOptions/>\n' \
+                          f'\t\t</Track>\n'
+                yield f'\t</Panel>\n'
+                panel_num += 1
 
-        xml_data += f'\t<Panel name="Panel_{panel_num}">\n'
+        yield f'\t<Panel name="Panel_{panel_num}">\n'
 
-        factor = 0
         for track in self.tracks:
-            if not track.path.endswith(".bam") and not track.path.endswith(".vcf"):
-                xml_data += f'\t\t<Track attributeKey="{track.label}" clazz="org.broad.igv.track.FeatureTrack" colorScale="ContinuousColorScale;0.0;0.0;255,255,255;0,0,178" ' \
-                            f'fontSize="10" groupByStrand="false" id="{track.path}" name="{track.label}" visible="true"/>\n'
+            if track.is_coverage and self._is_feature(track):
+                yield f'\t\t<Track attributeKey="{track.label}" autoScale="true" clazz="org.broad.igv.track.DataSourceTrack" color="175,175,175" ' \
+                      f'fontSize="10" id="{track.path}" name="{track.label}" renderer="BAR_CHART" visible="true"/>\n'
+            elif self._is_feature(track):
+                yield f'\t\t<Track attributeKey="{track.label}" clazz="org.broad.igv.track.FeatureTrack" colorScale="ContinuousColorScale;0.0;0.0;255,255,255;0,0,178" ' \
+                      f'fontSize="10" groupByStrand="false" id="{track.path}" name="{track.label}" visible="true"/>\n'
                 panel_num += 1
-                factor += other_factor
-        panel_factors.append(panel_factors[-1] + factor)
 
-        factors_values = ','.join([str(factor / panel_factors[-1]) for factor in panel_factors])
-        xml_data += f'\t</Panel>\n' \
-                    f'<PanelLayout dividerFractions="{factors_values}"/>\n' \
-                    f'</Session>\n'
+        layout = self.panel_layout()
+        factors_values = ','.join([str(layout[0][1])] + [str(bottom) for _, _, bottom in layout])
+        yield f'\t</Panel>\n' \
+              f'<PanelLayout dividerFractions="{factors_values}"/>\n' \
+              f'</Session>\n'
+
+    def write(self, output):
+        """Write the session XML to a file-like object."""
+        output.writelines(self.lines())
+
+    def build(self, output=None):
+        """Write the session XML to output, by default printing it to the standard output."""
+        if output is None:
+            print(''.join(self.lines()))
+        else:
+            self.write(output)
+
+
+class RegionDelta:
+    """
+    Byte offset and checksum of the rows already processed of every region file, kept in a JSON state file, so a
+    file that only grew is read from where the last run stopped.
+
+    The checksum covers the CHECK_BYTES before the offset, so an append is recognised without reading the file
+    again. A file shorter than its offset or whose checksum changed is read again from the start. Gzip compressed
+    files can not be read from an offset and are always read whole.
+    """
+
+    CHECK_BYTES = 64 * 1024
+
+    def __init__(self, state=None):
+        self.state = {}
+        if state and os.path.isfile(state):
+            with open(state, 'r') as state_file:
+                self.state = json.load(state_file)
+        self.starts = {}
+
+    @classmethod
+    def _checksum(cls, bed_file, offset):
+        start = max(0, offset - cls.CHECK_BYTES)
+        bed_file.seek(start)
+        return hashlib.sha256(bed_file.read(offset - start)).hexdigest()
+
+    def offset(self, key, path):
+        """Return the offset path is read from, the same for every read of a run."""
+        if key not in self.starts:
+            entry = self.state.get(key)
+            offset = 0
+            if entry:
+                with open(path, 'rb') as bed_file:
+                    if os.fstat(bed_file.fileno()).st_size >= entry["offset"] and \
+                            self._checksum(bed_file, entry["offset"]) == entry["checksum"]:
+                        offset = entry["offset"]
+                    else:
+                        logger.warning(f"{path} changed before its last processed row, reading it from the start")
+            self.starts[key] = offset
+        return self.starts[key]
+
+    def lines(self, key, path):
+        """Yield the complete lines of path after its offset, then record the end of the last one under key."""
+        if str(path).endswith(".gz"):
+            with open_text(path) as bed_file:
+                yield from bed_file
+            return
+        offset = self.offset(key, path)
+        with open(path, 'rb') as bed_file:
+            bed_file.seek(offset)
+            for line in bed_file:
+                if not line.endswith(b'\n'):
+                    # A row still being written is left for the next run
+                    break
+                offset += len(line)
+                yield line.decode()
+            self.state[key] = {"offset": offset, "checksum": self._checksum(bed_file, offset)}
 
-        print(xml_data)
+    def label(self, key, path):
+        """
+        Name the batch of an unprefixed region file after its path and the rows processed before this run, instead
+        of its content, so appending rows does not make every run read the whole file.
+        """
+        entry = self.state.get(key) or {}
+        content = hashlib.sha256(f"{path}\0{entry.get('offset', 0)}\0{entry.get('checksum', '')}".encode())
+        return content.hexdigest()[:12]
+
+    def save(self, output):
+        with open(output, 'w') as state_file:
+            json.dump(self.state, state_file, indent=2, sort_keys=True)
+
+    def write_appended(self, prefixed_bed_files, output_dir):
+        """
+        Write the region rows appended to every prefix:path file to a file of the same name in output_dir,
+        returning the number of rows of each.
+        """
+        counts = {}
+        for prefixed_bed_file in prefixed_bed_files:
+            path = prefixed_bed_file.split(":")[1]
+            counts[prefixed_bed_file] = 0
+            with open(os.path.join(output_dir, os.path.basename(path)), 'w') as output:
+                for line in self.lines(prefixed_bed_file, path):
+                    if line.strip() and not line.startswith(BED_HEADERS):
+                        output.write(line)
+                        counts[prefixed_bed_file] += 1
+        return counts
 
 
 class SnapshotsCommandBuilder:
 
-    def __init__(self, prefixed_bed_files, slops, out_dir):
+    SHARDS_MANIFEST = "shards_manifest.csv"
+    SCHEDULED_BATCH = "snapshots_scheduled.txt"
+    WRITE_BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, prefixed_bed_files, slops, out_dir, shards=None, max_snapshots_per_shard=None,
+                 fai=None, schedule=False, metrics=None, groups=None, output_dir='.', profiles=None, delta=None):
         self.prefixed_bed_files = prefixed_bed_files
         self.regions = []
         self.slops = slops
         self.out_dir = out_dir
+        self.shards = shards
+        self.max_snapshots_per_shard = max_snapshots_per_shard
+        self.contig_lengths = read_fai(fai) if fai else None
+        self.schedule = schedule
+        self.contigs = {}
+        self.labels = {}
+        self.metrics = metrics or Metrics()
+        self.groups = groups
+        self.output_dir = output_dir
+        # (smallest window, session) of every rendering profile, the first one being loaded before the batch
+        self.profiles = sorted(profiles) if profiles else None
+        # RegionDelta: only the rows appended to the region files since its state are read
+        self.delta = delta
+        self.batches = []
 
     def _check_regions(self):
         for prefixed_bed_file in self.prefixed_bed_files:
             prefix, path = prefixed_bed_file.split(":")
             self.regions.append(Track(prefix, path))
 
+    def _read_tables(self, track):
+        if self.delta:
+            return RegionTable.read_lines(self.delta.lines(f"{track.label}:{track.path}", track.path), track.label,
+                                          self.contigs, self.labels)
+        return RegionTable.read_bed(track.path, track.label, self.contigs, self.labels)
+
+    def _read_all(self):
+        """Return the regions of every prefix in a single table, sorted by genomic position."""
+        tables = []
+        for track in self.regions:
+            with self.metrics.stage(f"read {track.path}") as counts:
+                track_tables = list(self._read_tables(track))
+                counts["regions"] = sum(len(table) for table in track_tables)
+            tables.extend(track_tables)
+        with self.metrics.stage("sort regions") as counts:
+            regions = RegionTable.concatenate(tables, self.contigs, self.labels).sorted()
+            counts["regions"] = len(regions)
+        return regions
+
+    def _profile_ids(self, table):
+        """Return the rendering profile of every region (rows) and slop (columns), from the width of its window."""
+        window_starts, window_ends = table.windows(self.slops, self.contig_lengths)
+        smallest_windows = np.array([window for window, _ in self.profiles], dtype=np.int64)
+        # A profile applies to the windows wider than its smallest window, the first one to any narrower window
+        profile_ids = np.searchsorted(smallest_windows, window_ends - window_starts, side='left') - 1
+        return np.maximum(profile_ids, 0)
+
+    def _table_commands(self, table, loaded):
+        """
+        Return the commands of a region table and the profile loaded after them, given the one loaded before.
+
+        With rendering profiles, the snapshots of a table are grouped by profile, starting with the loaded one, and
+        each group is preceded by the load of its session, so IGV switches sessions at most once per profile.
+        """
+        if not self.profiles:
+            return table.batch_commands(self.slops, self.contig_lengths, self.schedule), loaded
+        profile_ids = self._profile_ids(table)
+        commands = []
+        for profile in [loaded] + [profile for profile in range(len(self.profiles)) if profile != loaded]:
+            selected = profile_ids == profile
+            if not selected.any():
+                continue
+            if profile != loaded:
+                commands.append(f'load {self.profiles[profile][1]}\n')
+                loaded = profile
+            commands.append(table.batch_commands(self.slops, self.contig_lengths, self.schedule, selected))
+        return ''.join(commands), loaded
+
+    def commands(self, snapshots_dir, tables):
+        """
+        Yield the commands of a batch saving its snapshots to snapshots_dir, a region table at a time.
+
+        A batch starts with the full session loaded and reloads it at the end when it switched profiles, as the
+        batches of a run are concatenated and the next one expects it.
+        """
+        yield f'snapshotDirectory {snapshots_dir}\n'
+        loaded = 0
+        for table in tables:
+            table_commands, loaded = self._table_commands(table, loaded)
+            yield table_commands
+        if loaded:
+            yield f'load {self.profiles[0][1]}\n'
+
+    def write_batch(self, output, snapshots_dir, tables):
+        """Stream the commands of the given region tables to a file-like object, returning the regions written."""
+        written = 0
+
+        def counted():
+            nonlocal written
+            for table in tables:
+                written += len(table)
+                yield table
+
+        for chunk in self.commands(snapshots_dir, counted()):
+            output.write(chunk)
+        return written
+
+    def _write_batch(self, batch_name, snapshots_dir, tables, stage=None):
+        """Stream the commands of the given region tables to a batch file, returning the number of regions written."""
+        started = time.perf_counter()
+        path = os.path.join(self.output_dir, batch_name)
+        with self.metrics.stage(stage or f"write {batch_name}") as counts, \
+                open(path, 'w', buffering=self.WRITE_BUFFER_SIZE) as batch_file:
+            written = self.write_batch(batch_file, snapshots_dir, tables)
+            counts.update(regions=written, snapshots=written * len(self.slops))
+        self.batches.append(path)
+        elapsed = time.perf_counter() - started
+        logger.info(f"{batch_name}: {written} regions, {written * len(self.slops)} snapshots "
+                    f"({written / elapsed if elapsed else 0:.0f} regions/sec)")
+        return written
+
+    def _reloads(self, tables, scheduled):
+        windows = (table.job_windows(self.slops, self.contig_lengths, scheduled) for table in tables)
+        return estimate_reloads(chain.from_iterable(zip(contig_ids.tolist(), starts.tolist(), ends.tolist())
+                                                    for contig_ids, starts, ends in windows))
+
+    def _log_reloads(self, scheduled_tables):
+        """Log the window reloads estimated for the input order and for the scheduled one."""
+        with self.metrics.stage("estimate reloads") as counts:
+            before = self._reloads(chain.from_iterable(self._read_tables(track) for track in self.regions), False)
+            after = self._reloads(scheduled_tables, True)
+            counts.update(input_order=before, scheduled=after)
+        logger.info(f"Estimated IGV window reloads: {before} in input order, {after} scheduled")
+        return before, after
+
+    def _shard_count(self, total_regions):
+        shard_count = self.shards or 1
+        if self.max_snapshots_per_shard:
+            # All the slops of a region go to the same shard, so the limit is applied on whole regions
+            regions_per_shard = max(1, self.max_snapshots_per_shard // max(1, len(self.slops)))
+            shard_count = max(shard_count, math.ceil(total_regions / regions_per_shard))
+        return shard_count
+
+    def _write_shards(self, named_shards):
+        """Write a batch and a snapshots directory per (name, table) shard, listed in the shards manifest."""
+        weight = len(self.slops)
+        with open(os.path.join(self.output_dir, self.SHARDS_MANIFEST), 'w') as manifest:
+            manifest.write("shard,batch,snapshots_dir,regions,snapshots,first_region,last_region\n")
+            for name, shard in named_shards:
+                snapshots_dir = f'{self.out_dir}/{name}'
+                batch_name = f'snapshots_{name}.txt'
+                written = self._write_batch(batch_name, snapshots_dir, shard.chunks())
+                first_region = '{0}:{1}-{2}'.format(*shard.region(0)) if len(shard) else ''
+                last_region = '{0}:{1}-{2}'.format(*shard.region(-1)) if len(shard) else ''
+                manifest.write(f"{name},{batch_name},{snapshots_dir},{written},{written * weight},"
+                               f"{first_region},{last_region}\n")
+
+    def _build_shards(self):
+        # Genomic order keeps neighbouring regions in the same shard, so each IGV instance loads compact windows.
+        regions = self._read_all()
+
+        # Every region costs one snapshot per slop, so balancing regions balances snapshots
+        shard_count = min(self._shard_count(len(regions)), len(regions)) or 1
+        bounds = [-(-number * len(regions) // shard_count) for number in range(shard_count + 1)]
+        shards = [regions.take(slice(start, end)) for start, end in zip(bounds, bounds[1:])]
+        self._write_shards((f'shard_{number:0{len(str(shard_count))}d}', shard)
+                           for number, shard in enumerate(shards, start=1))
+
+        if self.schedule:
+            self._log_reloads(chain.from_iterable(shard.chunks() for shard in shards))
+
+    def _group_ids(self, regions):
+        """Return the index in self.groups of the group whose windows hold every region, -1 for none."""
+        group_starts = {}
+        for group_id, path in enumerate(self.groups):
+            for contig, windows in read_windows(path).items():
+                group_starts.setdefault(contig, []).extend((start, group_id) for start, _ in windows)
+
+        group_ids = np.full(len(regions), -1, dtype=np.int64)
+        for contig, contig_id in regions.contigs.items():
+            if contig not in group_starts:
+                continue
+            windows = np.array(sorted(group_starts[contig]), dtype=np.int64)
+            rows = np.flatnonzero(regions.contig_ids == contig_id)
+            # Windows are the merged regions expanded by the largest slop, so they hold the start of their regions
+            window = np.searchsorted(windows[:, 0], regions.starts[rows], side='right') - 1
+            group_ids[rows[window >= 0]] = windows[window[window >= 0], 1]
+        return group_ids
+
+    def _build_groups(self):
+        """Write a batch per region group, so each render task only needs the tracks sliced to its group."""
+        regions = self._read_all()
+        group_ids = self._group_ids(regions)
+        if (group_ids < 0).any():
+            logger.warning(f"{int((group_ids < 0).sum())} regions outside every group are not rendered")
+        self._write_shards((os.path.basename(path).rsplit('.bed', 1)[0], regions.take(group_ids == group_id))
+                           for group_id, path in enumerate(self.groups))
+
+    @staticmethod
+    def batch_label(path):
+        """Name the batch of an unprefixed region file after its content, so the same regions give the same batch."""
+        content = hashlib.sha256()
+        with open(path, 'rb') as bed_file:
+            for block in iter(lambda: bed_file.read(1024 * 1024), b''):
+                content.update(block)
+        return content.hexdigest()[:12]
+
     def build(self):
+        """Write the batch files (and the shards manifest when sharded) to output_dir, returning their paths."""
         self._check_regions()
+        self.batches = []
 
-        for track in self.regions:
-            batch_command = f'snapshotDirectory {self.out_dir}\n'
-            with open(track.path, 'r') as regions_file:
-                for region in csv.reader(regions_file, delimiter='\t'):
-                    for value in self.slops:
-                        batch_command += f'goto {region[0]}:{int(region[1])-value}-{int(region[2])+value}\n' \
-                                         f'snapshot {track.label}{region[0]}_{region[1]}_{region[2]}_slop{value}.png\n'
+        if self.groups:
+            self._build_groups()
+        elif self.shards or self.max_snapshots_per_shard:
+            self._build_shards()
+        elif self.schedule:
+            # Regions of every prefix are interleaved, so they all go to a single batch
+            regions = self._read_all()
+            self._write_batch(self.SCHEDULED_BATCH, self.out_dir, regions.chunks())
+            self._log_reloads(regions.chunks())
+        else:
+            for track in self.regions:
+                if track.label:
+                    batch_label = track.label
+                elif self.delta:
+                    batch_label = self.delta.label(f"{track.label}:{track.path}", track.path)
+                else:
+                    batch_label = self.batch_label(track.path)
+                self._write_batch('snapshots_' + batch_label + '.txt', self.out_dir, self._read_tables(track),
+                                  stage=f"bed {track.path}")
+        return self.batches
+
+
+def zoom_profiles(smallest_windows, session_name="igv.session.xml"):
+    """
+    Return the (smallest window, session) of the full profile and of every profile given with the smallest window
+    it applies to, as taken by SnapshotsCommandBuilder.
+    """
+    profiles = [(0, session_name)]
+    for profile, window in smallest_windows.items():
+        profiles.append((int(window), IGVSessionBuilder.variant_name(session_name, profile)))
+    return profiles
+
+
+def generate_all(reference, tracks_with_labels, prefixed_bed_files, slops, snapshots_dir, output_dir='.',
+                 igv_options=None, session_name="igv.session.xml", preferences_name="prefs.properties",
+                 metrics=None, zoom_windows=None, **batch_options):
+    """
+    Write the session, the batch files and, when IGV options are given, the preferences of a run to output_dir
+    in one go, returning their paths. batch_options are passed on to SnapshotsCommandBuilder.
+
+    zoom_windows maps rendering profiles (squished, coverage) to the smallest window they are used for: a session
+    is written for each of them and the batches load it before their wider snapshots.
+    """
+    metrics = metrics or Metrics()
+    paths = {"session": os.path.join(output_dir, session_name), "sessions": {}}
+    for profile in [IGVSessionBuilder.FULL] + list(zoom_windows or {}):
+        path = os.path.join(output_dir, IGVSessionBuilder.variant_name(session_name, profile))
+        with metrics.stage(f"build-session {profile}", tracks=len(tracks_with_labels)), open(path, 'w') as session:
+            IGVSessionBuilder(reference, tracks_with_labels, profile).write(session)
+        paths["sessions"][profile] = path
+    if zoom_windows:
+        batch_options["profiles"] = zoom_profiles(zoom_windows, session_name)
+    paths["batches"] = SnapshotsCommandBuilder(prefixed_bed_files, slops, snapshots_dir, metrics=metrics,
+                                               output_dir=output_dir, **batch_options).build()
+    if igv_options:
+        paths["preferences"] = os.path.join(output_dir, preferences_name)
+        with open(paths["preferences"], 'w') as preferences:
+            write_igv_preferences(igv_options, preferences)
+    return paths
+
+
+class ResourcePlanner:
+    """
+    Estimate the resources IGV needs to render the snapshots of a set of regions, before rendering them.
+
+    Track densities come from the index statistics of the alignments (mapped reads per contig) and of the indexed
+    VCF files (records per contig), the other tracks being counted, so the plan is made on the tracks before they
+    are filtered to the regions. Multiplied by the window of every region and slop, they give the reads and
+    features loaded per snapshot, from which the JVM heap, the runtime and the number of render tasks are derived.
+    The constants are rough figures for IGV 2.12 and only meant to size the tasks, not to predict exact values.
+    """
+
+    PLAN = "snapshots_plan.json"
+
+    BASE_HEAP_MB = 1024
+    JVM_OVERHEAD_MB = 1024
+    HEAP_HEADROOM = 1.5
+    HEAP_STEP_MB = 512
+    BYTES_PER_READ = 1000
+    BYTES_PER_FEATURE = 200
+    # IGV keeps at most 100 reads per 50 bp sampling window
+    DOWNSAMPLED_READS_PER_BP = 2.0
+    # Compressed size of a read, to guess the reads of a BAM without index statistics
+    BAM_BYTES_PER_READ = 60
+    STARTUP_SECONDS = 60
+    SECONDS_PER_SNAPSHOT = 0.5
+    SECONDS_PER_READ = 1e-5
+
+    def __init__(self, tracks_with_labels, prefixed_bed_files, slops, fai=None, max_heap_mb=32000,
+                 task_seconds=3600, max_shards=None, metrics=None):
+        self.metrics = metrics or Metrics()
+        self.session = IGVSessionBuilder(None, tracks_with_labels)
+        self.batches = SnapshotsCommandBuilder(prefixed_bed_files, slops, None, fai=fai, metrics=self.metrics)
+        self.slops = slops
+        self.max_heap_mb = max_heap_mb
+        self.task_seconds = task_seconds
+        self.max_shards = max_shards
+
+    @classmethod
+    def _alignment_density(cls, track):
+        """Return the mapped reads per bp of every contig of a BAM file, as far as IGV keeps them after sampling."""
+        with pysam.AlignmentFile(track.path, 'rb', index_filename=track.index) as bam:
+            lengths = dict(zip(bam.references, bam.lengths))
+            try:
+                reads = {stats.contig: stats.mapped for stats in bam.get_index_statistics()}
+            except ValueError:
+                logger.warning(f"No index statistics for {track.path}, guessing its reads from its size")
+                total_reads = os.path.getsize(track.path) / cls.BAM_BYTES_PER_READ
+                genome_length = max(1, sum(lengths.values()))
+                reads = {contig: total_reads * length / genome_length for contig, length in lengths.items()}
+        return {contig: min(count / max(1, lengths[contig]), cls.DOWNSAMPLED_READS_PER_BP)
+                for contig, count in reads.items()}
+
+    @staticmethod
+    def _variant_index_counts(track):
+        """Return the records and the header length of every contig of a VCF file from its index, None without one."""
+        indexed = track.index or any(os.path.exists(f"{track.path}{suffix}") for suffix in (".tbi", ".csi"))
+        if not (track.path.endswith(".gz") and indexed):
+            return None
+        try:
+            stats = bcftools.index("--stats", f"{track.path}##idx##{track.index}" if track.index else track.path)
+        except SamtoolsError:
+            logger.warning(f"No index statistics for {track.path}, counting its records")
+            return None
+        counts = Counter()
+        extents = {}
+        for line in stats.splitlines():
+            contig, length, records = line.split('\t')
+            counts[contig] = int(records)
+            if length != '.':
+                extents[contig] = int(length)
+        return counts, extents
+
+    @classmethod
+    def _feature_density(cls, track, lengths=None):
+        """Return the features per bp of every contig of a VCF or BED file."""
+        indexed = cls._variant_index_counts(track) if track.is_variant else None
+        if indexed:
+            counts, extents = indexed
+        elif track.is_variant:
+            with pysam.VariantFile(track.path) as variants:
+                counts = Counter(record.contig for record in variants)
+                extents = {contig: variants.header.contigs[contig].length
+                           for contig in counts if contig in variants.header.contigs}
+        else:
+            counts = Counter()
+            extents = {}
+            for contig, _, end in read_bed(track.path):
+                counts[contig] += 1
+                extents[contig] = max(end, extents.get(contig, 0))
+        lengths = {**extents, **(lengths or {})}
+        return {contig: count / max(1, lengths.get(contig) or 1) for contig, count in counts.items()}
+
+    def _densities(self, contigs, tracks, density):
+        """Sum the per contig densities of the given tracks into an array indexed by contig id."""
+        total = np.zeros(len(contigs))
+        for track in tracks:
+            with self.metrics.stage(f"density {track.path}"):
+                track_density = density(track)
+            total += [track_density.get(contig) or 0 for contig in contigs]
+        return total
+
+    def plan(self):
+        self.session._check_tracks()
+        self.batches._check_regions()
+        regions = self.batches._read_all()
+        contigs = list(regions.contigs)
+        lengths = self.batches.contig_lengths
+
+        alignments = [track for track in self.session.tracks if track.is_alignment]
+        features = [track for track in self.session.tracks if not track.is_alignment]
+        read_density = self._densities(contigs, alignments, self._alignment_density)
+        feature_density = self._densities(contigs, features, lambda track: self._feature_density(track, lengths))
+
+        with self.metrics.stage("estimate") as counts:
+            window_starts, window_ends = regions.windows(self.slops, lengths)
+            window_lengths = window_ends - window_starts
+            reads = read_density[regions.contig_ids][:, None] * window_lengths
+            loaded_features = feature_density[regions.contig_ids][:, None] * window_lengths
+            snapshots = reads.size
+            counts.update(regions=len(regions), snapshots=snapshots)
+
+        max_reads = float(reads.max()) if snapshots else 0.0
+        max_features = float(loaded_features.max()) if snapshots else 0.0
+        heap_mb = (self.BASE_HEAP_MB + (max_reads * self.BYTES_PER_READ + max_features * self.BYTES_PER_FEATURE)
+                   / 2 ** 20) * self.HEAP_HEADROOM
+        heap_mb = min(self.max_heap_mb, math.ceil(heap_mb / self.HEAP_STEP_MB) * self.HEAP_STEP_MB)
+        if heap_mb == self.max_heap_mb:
+            logger.warning(f"The densest snapshot ({max_reads:.0f} reads) may not fit in {self.max_heap_mb} MB")
+
+        render_seconds = snapshots * self.SECONDS_PER_SNAPSHOT + float(reads.sum()) * self.SECONDS_PER_READ
+        shards = max(1, min(math.ceil(render_seconds / self.task_seconds), len(regions) or 1,
+                            self.max_shards or len(regions) or 1))
+        return {
+            "regions": len(regions),
+            "snapshots": snapshots,
+            "alignment_tracks": len(alignments),
+            "feature_tracks": len(features),
+            "reads_per_snapshot": {"mean": float(reads.mean()) if snapshots else 0.0, "max": max_reads},
+            "features_per_snapshot": {"mean": float(loaded_features.mean()) if snapshots else 0.0,
+                                      "max": max_features},
+            "heap_mb": heap_mb,
+            "memory_mb": heap_mb + self.JVM_OVERHEAD_MB,
+            "runtime_seconds": self.STARTUP_SECONDS + render_seconds,
+            "shards": shards,
+            "task_seconds": self.STARTUP_SECONDS + render_seconds / shards,
+        }
+
+    def build(self, output=PLAN):
+        plan = self.plan()
+        with open(output, 'w') as plan_file:
+            json.dump(plan, plan_file, indent=2)
+        logger.info(f"{plan['snapshots']} snapshots, up to {plan['reads_per_snapshot']['max']:.0f} reads each: "
+                    f"{plan['heap_mb']} MB heap, {plan['runtime_seconds']:.0f}s in {plan['shards']} shards")
+        return plan
+
+
+class SnapshotCache:
+    """
+    Content addressed store of rendered snapshots.
+
+    A snapshot is fully determined by its locus, the files that configure IGV (session and preferences), the IGV
+    version and the data it shows, so those are hashed together into the fingerprint used as the image name in the
+    cache. The session names the tracks by their staged file names only, so the data is identified apart: by the
+    keys of the tracks (input_parser.py hashes their content and windows) and by the real path, size and
+    modification time of the data files, a FASTA file bringing its index.
+    """
+
+    def __init__(self, cache_dir, context_files, igv_version, track_keys=(), data_files=()):
+        self.cache_dir = Path(cache_dir)
+        context = hashlib.sha256(igv_version.encode())
+        for context_file in context_files:
+            with open(context_file, 'rb') as content:
+                context.update(hashlib.sha256(content.read()).digest())
+        for track_key in sorted(track_keys):
+            context.update(f'{track_key}\0'.encode())
+        for data_file in sorted(data_files):
+            context.update(self.identity(data_file).encode())
+            if data_file.endswith((".fa", ".fasta", ".fna")):
+                context.update(self.identity(os.path.realpath(data_file) + ".fai").encode())
+        self.context = context.digest()
+
+    @staticmethod
+    def identity(path):
+        real_path = os.path.realpath(path)
+        if not os.path.exists(real_path):
+            return f'{real_path}\0'
+        stat = os.stat(real_path)
+        return f'{real_path}\0{stat.st_size}\0{stat.st_mtime_ns}\0'
+
+    def fingerprint(self, locus, session=None):
+        # Snapshots rendered from a session loaded by the batch depend on it as well
+        if session:
+            locus = f'{os.path.basename(session)}\t{locus}'
+        return hashlib.sha256(self.context + locus.encode()).hexdigest()
+
+    def cached_path(self, fingerprint):
+        return self.cache_dir / fingerprint[:2] / f'{fingerprint}.png'
+
+    @staticmethod
+    def _link(source, target):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temporary = target.with_name(f'.{target.name}.tmp')
+        try:
+            os.link(source, temporary)
+        except OSError:
+            shutil.copyfile(source, temporary)
+        os.replace(temporary, target)
+
+    def restore(self, fingerprint, target):
+        cached = self.cached_path(fingerprint)
+        if not cached.is_file():
+            return False
+        self._link(cached, Path(target))
+        return True
+
+    def store(self, fingerprint, source):
+        source = Path(source)
+        if not source.is_file() or source.stat().st_size == 0:
+            return False
+        cached = self.cached_path(fingerprint)
+        if not cached.is_file():
+            self._link(source, cached)
+        return True
+
+
+class CachedBatchFilter:
+    """
+    Drop from a batch the snapshots that already exist, either in their snapshot directory (left by a previous,
+    partially failed run) or in the snapshots cache, and record the fingerprints of the ones still to render.
+    """
+
+    def __init__(self, batch_files, cache, output, fingerprints):
+        self.batch_files = batch_files
+        self.cache = cache
+        self.output = output
+        self.fingerprints = fingerprints
+
+    def build(self):
+        snapshots_dir = '.'
+        locus = None
+        pending = restored = rendered = 0
+        with open(self.output, 'w') as output, open(self.fingerprints, 'w') as fingerprints:
+            for batch_file in self.batch_files:
+                # Every batch starts with the session IGV was launched with
+                session = None
+                with open(batch_file, 'r') as batch:
+                    for line in batch:
+                        command, _, argument = line.strip().partition(' ')
+                        if command == 'goto':
+                            locus = argument
+                            continue
+                        if command == 'snapshot' and locus is not None:
+                            target = Path(snapshots_dir) / argument
+                            fingerprint = self.cache.fingerprint(locus, session)
+                            if target.is_file() and target.stat().st_size > 0:
+                                rendered += 1
+                            elif self.cache.restore(fingerprint, target):
+                                restored += 1
+                            else:
+                                output.write(f'goto {locus}\n{line}')
+                                fingerprints.write(f'{target}\t{fingerprint}\n')
+                                pending += 1
+                            locus = None
+                            continue
+                        if command == 'snapshotDirectory':
+                            snapshots_dir = argument
+                        elif command == 'load':
+                            session = argument
+                        output.write(line)
+        logger.info(f"{pending} snapshots to render, {restored} restored from cache, {rendered} already rendered")
+        return pending
 
-            if not track.label:
-                track.label = ''.join(random.choice(string.ascii_lowercase) for i in range(6))
 
-            with open('snapshots_' + track.label + '.txt', 'w') as batch_file:
-                batch_file.write(batch_command)
+def add_batch_arguments(parser):
+    """Add the arguments of the batch files, shared by build-batch and generate-all."""
+    parser.add_argument(
+        "--regions_with_prefixes",
+        nargs='+',
+        help="Regions files (bed-3), space separated"
+    )
+    parser.add_argument(
+        "--slops",
+        type=int,
+        nargs='+',
+        help="Slops"
+    )
+    parser.add_argument(
+        "--snapshots_dir",
+        type=str,
+        help="Output directory for snapshots"
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        help="Split the batch into this many shards, each with its own snapshots directory"
+    )
+    parser.add_argument(
+        "--max_snapshots_per_shard", "--max-snapshots-per-shard",
+        type=int,
+        help="Maximum number of snapshots per shard"
+    )
+    parser.add_argument(
+        "--fai",
+        type=str,
+        help="FASTA index used to keep the snapshot windows inside the contigs"
+    )
+    parser.add_argument(
+        "--groups",
+        nargs='+',
+        help="Windows of the region groups (intervals.py group), one batch being written per group"
+    )
+    parser.add_argument(
+        "--schedule",
+        action='store_true',
+        help="Order the snapshots of every prefix by genomic position, largest slop first, so IGV reloads fewer "
+             "windows. Writes a single batch unless sharded"
+    )
+    parser.add_argument(
+        "--delta_state",
+        type=str,
+        help="JSON file with the offset and checksum of the rows already processed of every regions file: only "
+             "the rows appended since are read, and the file is updated"
+    )
+    parser.add_argument(
+        "--zoom_windows",
+        nargs='*',
+        default=[],
+        help="Rendering profiles as PROFILE=WINDOW, squished or coverage, used for the snapshots wider than WINDOW "
+             "bp: the batches load the session of the profile (igv.session.<profile>.xml) before them"
+    )
 
 
 def parse_args(argv=None):
@@ -146,6 +937,11 @@ def parse_args(argv=None):
         epilog="Example: python input_parser.py samplesheet.yaml",
     )
 
+    parser.add_argument(
+        "--metrics-out", "--metrics_out",
+        dest="metrics_out",
+        help="JSON file receiving the wall time, CPU time, peak RSS and counts of every stage",
+    )
     parser.add_argument(
         "-l",
         "--log-level",
@@ -165,25 +961,170 @@ def parse_args(argv=None):
     session_parser.add_argument(
         "--tracks_with_labels",
         nargs='+',
-        help="Track files, space separated"
+        help="Track files as label:path, or label:path:index, space separated"
+    )
+    session_parser.add_argument(
+        "--profile",
+        choices=IGVSessionBuilder.PROFILES,
+        default=IGVSessionBuilder.FULL,
+        help="Rendering profile: every read, squished reads or the coverage only"
     )
 
     batch_parser = subparsers.add_parser("build-batch")
-    batch_parser.add_argument(
+    add_batch_arguments(batch_parser)
+
+    all_parser = subparsers.add_parser("generate-all")
+    all_parser.add_argument(
+        "--reference",
+        type=str,
+        help="Reference file"
+    )
+    all_parser.add_argument(
+        "--tracks_with_labels",
+        nargs='+',
+        help="Track files as label:path, or label:path:index, space separated"
+    )
+    add_batch_arguments(all_parser)
+    all_parser.add_argument(
+        "--igv_options",
+        nargs='*',
+        default=[],
+        help="IGV preferences as OPTION=VALUE, written to the preferences file when given"
+    )
+    all_parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=".",
+        help="Directory receiving the session, batch and preferences files"
+    )
+
+    plan_parser = subparsers.add_parser("plan")
+    plan_parser.add_argument(
+        "--tracks_with_labels",
+        nargs='+',
+        help="Track files as label:path, or label:path:index, space separated"
+    )
+    plan_parser.add_argument(
         "--regions_with_prefixes",
         nargs='+',
         help="Regions files (bed-3), space separated"
     )
-    batch_parser.add_argument(
+    plan_parser.add_argument(
         "--slops",
         type=int,
         nargs='+',
         help="Slops"
     )
-    batch_parser.add_argument(
-        "--snapshots_dir",
+    plan_parser.add_argument(
+        "--fai",
         type=str,
-        help="Output directory for snapshots"
+        help="FASTA index used to keep the snapshot windows inside the contigs"
+    )
+    plan_parser.add_argument(
+        "--max_heap_mb",
+        type=int,
+        default=32000,
+        help="Largest JVM heap to plan for, in MB"
+    )
+    plan_parser.add_argument(
+        "--task_seconds",
+        type=int,
+        default=3600,
+        help="Target runtime of a render task, used to choose the number of shards"
+    )
+    plan_parser.add_argument(
+        "--max_shards",
+        type=int,
+        help="Maximum number of render tasks"
+    )
+    plan_parser.add_argument(
+        "--output",
+        type=str,
+        default=ResourcePlanner.PLAN,
+        help="JSON file receiving the resource hint"
+    )
+
+    delta_parser = subparsers.add_parser("delta")
+    delta_parser.add_argument(
+        "--regions_with_prefixes",
+        nargs='+',
+        help="Regions files (bed-3), space separated"
+    )
+    delta_parser.add_argument(
+        "--state",
+        type=str,
+        default="reveal_delta.json",
+        help="JSON file with the offset and checksum of the rows already processed of every regions file, "
+             "missing on the first run"
+    )
+    delta_parser.add_argument(
+        "--state_out",
+        type=str,
+        help="Updated state, by default written over --state"
+    )
+    delta_parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="delta",
+        help="Directory receiving the rows appended to every regions file, in a file of the same name"
+    )
+
+    filter_parser = subparsers.add_parser("filter-cached")
+    filter_parser.add_argument(
+        "--batch",
+        nargs='+',
+        help="Batch files to filter"
+    )
+    filter_parser.add_argument(
+        "--cache_dir",
+        type=str,
+        help="Directory of the snapshots cache"
+    )
+    filter_parser.add_argument(
+        "--context_files",
+        nargs='+',
+        help="Files that define how snapshots are rendered (session, preferences), space separated"
+    )
+    filter_parser.add_argument(
+        "--track_keys",
+        nargs='*',
+        default=[],
+        help="Keys of the tracks shown by the snapshots (reveal_params.csv), space separated"
+    )
+    filter_parser.add_argument(
+        "--data_files",
+        nargs='*',
+        default=[],
+        help="Data files identified by real path, size and modification time (reference), space separated"
+    )
+    filter_parser.add_argument(
+        "--igv_version",
+        type=str,
+        help="Version of IGV used to render the snapshots"
+    )
+    filter_parser.add_argument(
+        "--output",
+        type=str,
+        help="Filtered batch file with the snapshots still to render"
+    )
+    filter_parser.add_argument(
+        "--fingerprints",
+        type=str,
+        default="snapshots_fingerprints.tsv",
+        help="Output table with the fingerprint of every snapshot still to render"
+    )
+
+    store_parser = subparsers.add_parser("store-cache")
+    store_parser.add_argument(
+        "--cache_dir",
+        type=str,
+        help="Directory of the snapshots cache"
+    )
+    store_parser.add_argument(
+        "--fingerprints",
+        type=str,
+        default="snapshots_fingerprints.tsv",
+        help="Fingerprints table written by filter-cached"
     )
 
     return parser.parse_args(argv)
@@ -194,11 +1135,71 @@ def main(argv=None):
     args = parse_args(argv)
     logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
 
+    metrics = Metrics(f"igv_with_reveal.py {args.command}")
+    try:
+        run(args, metrics)
+    finally:
+        if args.metrics_out:
+            metrics.write(args.metrics_out)
+
+
+def run(args, metrics):
+    """Execute the parsed command, recording its stages."""
     if args.command == "build-session":
-        IGVSessionBuilder(args.reference, args.tracks_with_labels).build()
+        with metrics.stage("build-session", tracks=len(args.tracks_with_labels)):
+            IGVSessionBuilder(args.reference, args.tracks_with_labels, args.profile).build()
+
+    if args.command in ("build-batch", "generate-all"):
+        zoom_windows = dict(option.split("=", 1) for option in args.zoom_windows)
+        unknown = set(zoom_windows) - set(IGVSessionBuilder.PROFILES[1:])
+        if unknown:
+            raise ValueError(f"Unknown rendering profiles {', '.join(sorted(unknown))} in --zoom_windows")
+
+        delta = RegionDelta(args.delta_state) if args.delta_state else None
 
     if args.command == "build-batch":
-        SnapshotsCommandBuilder(args.regions_with_prefixes, args.slops, args.snapshots_dir).build()
+        SnapshotsCommandBuilder(args.regions_with_prefixes, args.slops, args.snapshots_dir, args.shards,
+                                args.max_snapshots_per_shard, args.fai, args.schedule, metrics, args.groups,
+                                profiles=zoom_profiles(zoom_windows) if zoom_windows else None, delta=delta).build()
+
+    if args.command == "generate-all":
+        igv_options = [dict([option.split("=", 1)]) for option in args.igv_options]
+        generate_all(args.reference, args.tracks_with_labels, args.regions_with_prefixes, args.slops,
+                     args.snapshots_dir, args.output_dir, igv_options, metrics=metrics, zoom_windows=zoom_windows,
+                     shards=args.shards, max_snapshots_per_shard=args.max_snapshots_per_shard, fai=args.fai,
+                     schedule=args.schedule, groups=args.groups, delta=delta)
+
+    if args.command in ("build-batch", "generate-all") and delta:
+        delta.save(args.delta_state)
+
+    if args.command == "delta":
+        with metrics.stage("delta") as counts:
+            os.makedirs(args.output_dir, exist_ok=True)
+            delta = RegionDelta(args.state)
+            appended = delta.write_appended(args.regions_with_prefixes, args.output_dir)
+            delta.save(args.state_out or args.state)
+            counts["regions"] = sum(appended.values())
+        for prefixed_bed_file, rows in appended.items():
+            logger.info(f"{prefixed_bed_file}: {rows} new regions")
+
+    if args.command == "plan":
+        ResourcePlanner(args.tracks_with_labels, args.regions_with_prefixes, args.slops, args.fai, args.max_heap_mb,
+                        args.task_seconds, args.max_shards, metrics).build(args.output)
+
+    if args.command == "filter-cached":
+        with metrics.stage("filter-cached") as counts:
+            cache = SnapshotCache(args.cache_dir, args.context_files, args.igv_version, args.track_keys,
+                                  args.data_files)
+            counts["pending"] = CachedBatchFilter(args.batch, cache, args.output, args.fingerprints).build()
+
+    if args.command == "store-cache":
+        with metrics.stage("store-cache") as counts:
+            cache = SnapshotCache(args.cache_dir, [], '')
+            with open(args.fingerprints, 'r') as fingerprints:
+                stored = sum(cache.store(fingerprint, target)
+                             for target, fingerprint in csv.reader(fingerprints, delimiter='\t'))
+            counts["stored"] = stored
+        logger.info(f"{stored} snapshots stored in {args.cache_dir}")
 
 
 if __name__ == "__main__":
@@ -3,26 +3,45 @@
 
 """Provide a command line tool to validate and transform yml samplesheets."""
 import argparse
+import hashlib
 import json
 import logging
+import os
 import sys
-from os import path
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 import yaml
-from jsonschema import validate
+from jsonschema.validators import validator_for
+
+from intervals import IntervalSet
+from metrics import Metrics
 
 logger = logging.getLogger()
 
 
-def validate_schema(json_input, json_schema):
-    try:
-        validate(instance=json_input, schema=json_schema)
-        return True, ""
-    except Exception as error:
-        message = error.schema['errorMessage'] if 'errorMessage' in error.schema else str(
-            error.path) + " " + error.message
-        return False, message
+def compile_schema(json_schema):
+    """Check a JSON schema and return a validator for it, to be reused for every input."""
+    validator_class = validator_for(json_schema)
+    validator_class.check_schema(json_schema)
+    return validator_class(json_schema)
+
+
+@lru_cache(maxsize=None)
+def load_validator(schema_path):
+    with open(schema_path, 'r') as schema_file:
+        return compile_schema(json.load(schema_file))
+
+
+def validate_schema(json_input, json_schema, validator=None):
+    """Validate an input against a schema, returning whether it is valid and the messages of all its errors."""
+    validator = validator or compile_schema(json_schema)
+    messages = [error.schema['errorMessage'] if 'errorMessage' in error.schema else
+                str(error.path) + " " + error.message for error in validator.iter_errors(json_input)]
+    return not messages, "\n".join(messages)
 
 
 def validate_format(filename, valid_formats):
@@ -34,55 +53,196 @@ def validate_format(filename, valid_formats):
         )
 
 
+class StatCache:
+    """Remember the stat of every path, so each file is looked up once even when checked from several threads."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def stat(self, filename):
+        """Return the os.stat_result of a file, None when it does not exist."""
+        with self._lock:
+            if filename in self._stats:
+                return self._stats[filename]
+        try:
+            result = os.stat(filename)
+        except OSError:
+            result = None
+        with self._lock:
+            self._stats[filename] = result
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+stat_cache = StatCache()
+
+INDEX_EXTENSIONS = {
+    ".bam": (".bam.bai", ".bam.csi", ".bai", ".csi"),
+    ".vcf.gz": (".vcf.gz.tbi", ".vcf.gz.csi"),
+}
+
+
+def find_index(filename):
+    """Return the index next to a BAM or compressed VCF file, None when missing or not indexable."""
+    for extension, index_extensions in INDEX_EXTENSIONS.items():
+        if filename.endswith(extension):
+            base = filename[:-len(extension)]
+            for index_extension in index_extensions:
+                if stat_cache.stat(base + index_extension):
+                    return base + index_extension
+    return None
+
+
+def find_current_index(filename):
+    """
+    Return the index next to a BAM or compressed VCF file when it is at least as recent as the file, None otherwise.
+    An older index may describe a previous version of the file, so the pipeline indexes the file again.
+    """
+    index = find_index(filename)
+    if index and stat_cache.stat(index).st_mtime < stat_cache.stat(filename).st_mtime:
+        logger.warning(f"The index {index} is older than {filename}, it will be indexed by the pipeline")
+        return None
+    return index
+
+
 def check_file_exists(filename):
-    if not path.exists(filename):
+    if not stat_cache.stat(filename):
         raise AssertionError(f"The input file doesn't exist: {filename}")
 
 
+def check_file(filename, valid_formats):
+    """Return the errors of one input file: its extension, then its existence. Empty or unindexed files are logged."""
+    try:
+        validate_format(filename, valid_formats)
+        check_file_exists(filename)
+    except AssertionError as error:
+        return [str(error)]
+
+    if not stat_cache.stat(filename).st_size:
+        logger.warning(f"The input file is empty: {filename}")
+    if any(filename.endswith(extension) for extension in INDEX_EXTENSIONS) and not find_index(filename):
+        logger.warning(f"No index found for {filename}, it will be indexed by the pipeline")
+    return []
+
+
+def check_files(filenames, valid_formats, threads=16):
+    """Check input files concurrently, returning all their errors in the order of the files."""
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(filenames)))) as executor:
+        return [error for errors in executor.map(lambda filename: check_file(filename, valid_formats), filenames)
+                for error in errors]
+
+
+def raise_errors(errors):
+    if errors:
+        raise AssertionError("\n".join(errors))
+
+
+def write_igv_preferences(igv_options, output):
+    """Write IGV options, given as {option: value} mappings, as a preferences file to a file-like object."""
+    for igv_option in igv_options:
+        for option, value in igv_option.items():
+            output.write(f"{option}={value}\n")
+
+
+def track_identity(filename):
+    """Identify the content of a track file by its real path, size and modification time."""
+    stat = stat_cache.stat(filename)
+    return f"{os.path.realpath(filename)}\0{stat.st_size}\0{stat.st_mtime_ns}" if stat else os.path.realpath(filename)
+
+
+def windows_digest(capture_regions, slops):
+    """
+    Hash the windows kept from the tracks of a job: its regions expanded by the largest slop and merged, as
+    intervals.py expand writes them. Jobs with the same windows get the same digest, whatever their region files.
+    """
+    regions = IntervalSet()
+    for region in capture_regions:
+        regions.add_bed(region['path'])
+    digest = hashlib.sha256()
+    for contig, start, end, _ in regions.expand(max(slops, default=0)).merged():
+        digest.update(f"{contig}\t{start}\t{end}\n".encode())
+    return digest.hexdigest()
+
+
 class InputParser:
     """
     Define a service that can validate and transform the input yaml containing tracks, regions, and options.
 
+    The samplesheet holds one job, or a list of jobs each with its own tracks, regions and options. Filtering a
+    track only depends on the track and on the windows of its job, so the (track, windows) pairs are keyed by a
+    hash of both and every distinct key is filtered once for all the jobs sharing it.
     """
 
     INPUT_SCHEMA = "../assets/schema_input.json"
     IGENOMES_CONFIG = "../conf/igenomes.config"
+    DEFAULT_JOB = "reveal"
+    WORK_GRAPH = "reveal_work_graph.csv"
 
-    VALID_TRACKS = (".bed", ".vcf", ".bam")
-    VALID_REGIONS = ".bed"
+    VALID_TRACKS = (".bed", ".vcf", ".vcf.gz", ".bam")
+    VALID_REGIONS = (".bed", ".bed.gz")
     VALID_REFERENCE = (".fq.gz", ".fastq.gz", ".fa", ".fa.gz")
 
-    def __init__(self, params_file, reference):
+    def __init__(self, params_file, reference, metrics=None, output_dir='.'):
         self.params_file = params_file
         self.reference = reference
+        self.metrics = metrics or Metrics()
+        self.output_dir = output_dir
+        self.jobs = []
         self.tracks = []
         self.capture_regions = []
-        self.slops = []
-        self.igv_options = []
-
-    def _load_data(self):
-        validated_json = self._check_schema()
-
-        for tracks_entry in validated_json['reveal']['tracks']:
-            self.tracks.append({"name": tracks_entry.get('name'), "path": tracks_entry['path']})
 
-        for region_entry in validated_json['reveal']['capture']['regions']:
-            self.capture_regions.append({"prefix": region_entry.get('prefix', ''), "path": region_entry['path']})
-
-        for option_slop in validated_json['reveal']['capture']['slops']:
-            self.slops.append(option_slop)
-
-        for option_entry in validated_json['reveal']['capture']['igvOptions']:
-            self.igv_options.append({option_entry['option']: option_entry['value']})
+    def _load_job(self, job_entry, name):
+        job = {"name": job_entry.get('name', name), "tracks": [], "capture_regions": [], "slops": [],
+               "igv_options": []}
+
+        for tracks_entry in job_entry['tracks']:
+            job["tracks"].append({"name": tracks_entry.get('name'), "path": tracks_entry['path']})
+
+        for region_entry in job_entry['capture']['regions']:
+            job["capture_regions"].append({"prefix": region_entry.get('prefix', ''), "path": region_entry['path']})
+
+        for option_slop in job_entry['capture']['slops']:
+            job["slops"].append(option_slop)
+
+        for option_entry in job_entry['capture'].get('igvOptions', []):
+            job["igv_options"].append({option_entry['option']: option_entry['value']})
+        return job
+
+    def _load_data(self, validated_json=None):
+        validated_json = validated_json or self._check_schema()
+
+        job_entries = validated_json['reveal']
+        if isinstance(job_entries, dict):
+            self.jobs = [self._load_job(job_entries, self.DEFAULT_JOB)]
+        else:
+            self.jobs = [self._load_job(job_entry, f"job_{number}")
+                         for number, job_entry in enumerate(job_entries, start=1)]
+        duplicated = [name for name, count in Counter(job["name"] for job in self.jobs).items() if count > 1]
+        if duplicated:
+            raise AssertionError(f"Job names must be unique: {', '.join(duplicated)}")
+
+        # Files shared by several jobs are checked once
+        tracks, regions = {}, {}
+        for job in self.jobs:
+            for track in job["tracks"]:
+                tracks.setdefault(track['path'], {"name": track['name'], "path": track['path']})
+            for region in job["capture_regions"]:
+                regions.setdefault(region['path'], region)
+        self.tracks = list(tracks.values())
+        self.capture_regions = list(regions.values())
 
     def _check_schema(self):
         base_path = Path(__file__).parent
         schema_path = (base_path / self.INPUT_SCHEMA).resolve()
 
-        with open(self.params_file, 'r') as params_file, open(schema_path, 'r') as schema_file:
+        validator = load_validator(str(schema_path))
+        with open(self.params_file, 'r') as params_file:
             json_input = yaml.safe_load(params_file)
-            json_schema = json.load(schema_file)
-            validation, message = validate_schema(json_input, json_schema)
+            validation, message = validate_schema(json_input, validator.schema, validator)
 
         if not validation:
             raise AssertionError(message)
@@ -94,48 +254,99 @@ class InputParser:
             check_file_exists(self.reference)
 
     def _check_regions(self):
-        for region in self.capture_regions:
-            validate_format(region['path'], self.VALID_REGIONS)
-            check_file_exists(region['path'])
+        raise_errors(check_files([region['path'] for region in self.capture_regions], self.VALID_REGIONS))
 
     def _check_tracks(self):
+        raise_errors(check_files([track['path'] for track in self.tracks], self.VALID_TRACKS))
         for track in self.tracks:
-            validate_format(track['path'], self.VALID_TRACKS)
-            check_file_exists(track['path'])
-
-    def _generate_file_pointers(self, preferences_path, slops_path):
-        with open("reveal_params.csv", "w") as pointer:
-            pointer.write("type,value,label\n")
+            track['index'] = find_current_index(track['path'])
+
+    def _build_work_graph(self):
+        """Key every track of every job by its content and the windows of the job, returning the distinct keys."""
+        indexes = {track['path']: track.get('index') for track in self.tracks}
+        work_graph = {}
+        for job in self.jobs:
+            digest = windows_digest(job["capture_regions"], job["slops"])
+            for track in job["tracks"]:
+                track['index'] = indexes.get(track['path'])
+                track['key'] = hashlib.sha256(f"{track_identity(track['path'])}\0{digest}".encode()).hexdigest()[:16]
+                node = work_graph.setdefault(track['key'], {"path": track['path'], "index": track['index'],
+                                                            "windows": digest[:16], "jobs": []})
+                node["jobs"].append(job["name"])
+
+        uses = sum(len(job["tracks"]) for job in self.jobs)
+        logger.info(f"{len(work_graph)} distinct track filters for {uses} tracks in {len(self.jobs)} jobs")
+        return work_graph
+
+    def _generate_work_graph(self, work_graph):
+        with open(os.path.join(self.output_dir, self.WORK_GRAPH), "w") as graph:
+            graph.write("key,track,index,windows,jobs\n")
+            for key, node in work_graph.items():
+                graph.write(f"{key},{node['path']},{node['index'] or ''},{node['windows']},{' '.join(node['jobs'])}\n")
+        return os.path.realpath(graph.name)
+
+    def _generate_file_pointers(self, job_files):
+        with open(os.path.join(self.output_dir, "reveal_params.csv"), "w") as pointer:
+            pointer.write("type,value,label,index,job,key\n")
             pointer.write(f"reference,{self.reference}\n")
-            for track in self.tracks:
-                pointer.write(f"track,{track['path']},{track['name']}\n")
-            for region in self.capture_regions:
-                pointer.write(f"region,{region['path']},{region['prefix']}\n")
-            pointer.write(f"slops,{slops_path}\n")
-            pointer.write(f"preferences,{preferences_path}\n")
-
-    def _generate_slops_file(self):
-        with open("slops.txt", "w") as slops_file:
-            for slop in self.slops:
+            for job in self.jobs:
+                name = job["name"]
+                for track in job["tracks"]:
+                    pointer.write(f"track,{track['path']},{track['name']},{track.get('index') or ''},{name},"
+                                  f"{track['key']}\n")
+                for region in job["capture_regions"]:
+                    pointer.write(f"region,{region['path']},{region['prefix']},,{name}\n")
+                pointer.write(f"slops,{job_files[name]['slops']},,,{name}\n")
+                pointer.write(f"preferences,{job_files[name]['preferences']},,,{name}\n")
+        return os.path.realpath(pointer.name)
+
+    def _generate_slops_file(self, job):
+        with open(os.path.join(self.output_dir, f"{job['name']}.slops.txt"), "w") as slops_file:
+            for slop in job["slops"]:
                 slops_file.write(f"{slop}\n")
-        return path.realpath(slops_file.name)
+        return os.path.realpath(slops_file.name)
 
-    def _generate_igv_preferences_file(self):
-        with open("prefs.properties", "w") as properties:
-            for option in self.igv_options:
-                option, value = next(iter(option.items()))
-                properties.write(f"{option}={value}\n")
-        return path.realpath(properties.name)
+    def write_preferences(self, job, output):
+        """Write the IGV options of a job as a preferences file to a file-like object."""
+        write_igv_preferences(job["igv_options"], output)
+
+    def _generate_igv_preferences_file(self, job):
+        with open(os.path.join(self.output_dir, f"{job['name']}.prefs.properties"), "w") as properties:
+            self.write_preferences(job, properties)
+        return os.path.realpath(properties.name)
 
     def build(self):
-        self._load_data()
-        self._check_schema()
-        self._check_reference()
-        self._check_regions()
-        self._check_tracks()
-        preferences_path = self._generate_igv_preferences_file()
-        slops_path = self._generate_slops_file()
-        self._generate_file_pointers(preferences_path, slops_path)
+        """Check the samplesheet and its files, then write the files of every job, returning their paths."""
+        with self.metrics.stage("_check_schema"):
+            validated_json = self._check_schema()
+        with self.metrics.stage("_load_data") as counts:
+            self._load_data(validated_json)
+            counts.update(jobs=len(self.jobs), tracks=len(self.tracks), regions=len(self.capture_regions))
+
+        # Every file is checked before failing, so all the errors are reported at once
+        stat_cache.clear()
+        errors = []
+        for stage, check, counts in (("_check_reference", self._check_reference, {}),
+                                     ("_check_regions", self._check_regions, {"regions": len(self.capture_regions)}),
+                                     ("_check_tracks", self._check_tracks, {"tracks": len(self.tracks)})):
+            with self.metrics.stage(stage, **counts):
+                try:
+                    check()
+                except AssertionError as error:
+                    errors.append(str(error))
+        raise_errors(errors)
+
+        with self.metrics.stage("_build_work_graph") as counts:
+            work_graph = self._build_work_graph()
+            counts.update(filters=len(work_graph))
+
+        with self.metrics.stage("_generate_files"):
+            job_files = {job["name"]: {"preferences": self._generate_igv_preferences_file(job),
+                                       "slops": self._generate_slops_file(job)} for job in self.jobs}
+            params_path = self._generate_file_pointers(job_files)
+            work_graph_path = self._generate_work_graph(work_graph)
+        return {"params": params_path, "work_graph": work_graph_path, "jobs": job_files}
+
 
 def parse_args(argv=None):
     """Define and immediately parse command line arguments."""
@@ -152,6 +363,11 @@ def parse_args(argv=None):
         "--reference",
         help="Reference file (fasta or igenomes).",
     )
+    parser.add_argument(
+        "--metrics-out", "--metrics_out",
+        dest="metrics_out",
+        help="JSON file receiving the wall time, CPU time, peak RSS and counts of every stage",
+    )
     parser.add_argument(
         "-l",
         "--log-level",
@@ -169,7 +385,12 @@ def main(argv=None):
     if not args.file_in.is_file():
         logger.error(f"The given input file {args.file_in} was not found!")
         sys.exit(2)
-    InputParser(args.file_in, args.reference).build()
+    metrics = Metrics("input_parser.py")
+    try:
+        InputParser(args.file_in, args.reference, metrics).build()
+    finally:
+        if args.metrics_out:
+            metrics.write(args.metrics_out)
 
 
 if __name__ == "__main__":
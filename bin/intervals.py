@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+"""Provide a command line tool and helpers to read, expand, clamp and merge genomic intervals."""
+import argparse
+import gzip
+import logging
+import sys
+from array import array
+
+logger = logging.getLogger()
+
+BED_HEADERS = ("#", "track", "browser")
+
+
+def open_text(path):
+    """Open a plain or gzip compressed text file for reading."""
+    if str(path).endswith(".gz"):
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+
+def read_bed(path):
+    """Yield (contig, start, end) from a BED file, skipping header lines and any extra columns."""
+    with open_text(path) as bed_file:
+        for line in bed_file:
+            if not line.strip() or line.startswith(BED_HEADERS):
+                continue
+            fields = line.split('\t', 3)
+            yield fields[0], int(fields[1]), int(fields[2])
+
+
+def read_fai(path):
+    """Return the length of every contig in a FASTA index."""
+    lengths = {}
+    with open(path, 'r') as fai_file:
+        for line in fai_file:
+            fields = line.split('\t', 2)
+            lengths[fields[0]] = int(fields[1])
+    return lengths
+
+
+def clamp(contig, start, end, lengths=None):
+    """Keep an interval inside its contig, [0, length) when the length is known."""
+    start = max(0, start)
+    if lengths and contig in lengths:
+        end = min(end, lengths[contig])
+    return start, end
+
+
+class IntervalSet:
+    """
+    Intervals stored per contig in parallel arrays of starts, ends and label ids, so millions of them can be
+    expanded and merged with a sort and a single sweep.
+    """
+
+    def __init__(self):
+        self.starts = {}
+        self.ends = {}
+        self.label_ids = {}
+        self.labels = []
+        self._label_index = {}
+
+    def __len__(self):
+        return sum(len(starts) for starts in self.starts.values())
+
+    def _label_id(self, label):
+        if label not in self._label_index:
+            self._label_index[label] = len(self.labels)
+            self.labels.append(label)
+        return self._label_index[label]
+
+    def add(self, contig, start, end, label=''):
+        if contig not in self.starts:
+            self.starts[contig] = array('q')
+            self.ends[contig] = array('q')
+            self.label_ids[contig] = array('l')
+        self.starts[contig].append(start)
+        self.ends[contig].append(end)
+        self.label_ids[contig].append(self._label_id(label))
+
+    def add_bed(self, path, label=''):
+        for contig, start, end in read_bed(path):
+            self.add(contig, start, end, label)
+        return self
+
+    def expand(self, slop, lengths=None):
+        """Return a new set with every interval widened by slop on both sides and clamped to its contig."""
+        expanded = IntervalSet()
+        expanded.labels = list(self.labels)
+        expanded._label_index = dict(self._label_index)
+        for contig, starts in self.starts.items():
+            ends = self.ends[contig]
+            length = lengths.get(contig) if lengths else None
+            expanded.starts[contig] = array('q', (max(0, start - slop) for start in starts))
+            if length is None:
+                expanded.ends[contig] = array('q', (end + slop for end in ends))
+            else:
+                expanded.ends[contig] = array('q', (min(length, end + slop) for end in ends))
+            expanded.label_ids[contig] = array('l', self.label_ids[contig])
+        return expanded
+
+    def merged(self):
+        """Yield (contig, start, end, labels) for the union of the intervals, labels being those merged into it."""
+        for contig in sorted(self.starts):
+            starts = self.starts[contig]
+            ends = self.ends[contig]
+            label_ids = self.label_ids[contig]
+
+            order = sorted(range(len(starts)), key=starts.__getitem__)
+            current_start = current_end = None
+            current_labels = set()
+            for index in order:
+                start, end = starts[index], ends[index]
+                if current_end is not None and start <= current_end:
+                    current_end = max(current_end, end)
+                    current_labels.add(label_ids[index])
+                    continue
+                if current_end is not None:
+                    yield contig, current_start, current_end, self._label_names(current_labels)
+                current_start, current_end = start, end
+                current_labels = {label_ids[index]}
+            if current_end is not None:
+                yield contig, current_start, current_end, self._label_names(current_labels)
+
+    def _label_names(self, label_ids):
+        return [self.labels[label_id] for label_id in sorted(label_ids)]
+
+
+def read_windows(path):
+    """Return the merged windows of a BED file as sorted (start, end) lists grouped by contig."""
+    windows = {}
+    for contig, start, end, _ in IntervalSet().add_bed(path).merged():
+        windows.setdefault(contig, []).append((start, end))
+    return windows
+
+
+def partition(intervals, groups):
+    """
+    Split sorted intervals into at most `groups` runs of consecutive intervals covering about the same number of
+    bases, returned as lists.
+    """
+    intervals = list(intervals)
+    total = sum(end - start for _, start, end, _ in intervals) or 1
+    runs = []
+    covered = 0
+    previous = None
+    for interval in intervals:
+        group = min(groups - 1, covered * groups // total)
+        if group != previous:
+            runs.append([])
+            previous = group
+        runs[-1].append(interval)
+        covered += interval[2] - interval[1]
+    return runs
+
+
+def write_bed(intervals, output):
+    """Write merged intervals as BED-4, the name column holding the comma separated labels ('.' when unlabeled)."""
+    written = 0
+    for contig, start, end, labels in intervals:
+        name = ','.join(label for label in labels if label) or '.'
+        output.write(f'{contig}\t{start}\t{end}\t{name}\n')
+        written += 1
+    return written
+
+
+def parse_args(argv=None):
+    """Define and immediately parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Expand capture regions by the largest slop and merge them into the windows to keep from tracks, "
+                    "or split those windows into contiguous groups rendered by separate tasks",
+        epilog="Example: python intervals.py expand --regions_with_prefixes P1_:a.bed P2_:b.bed.gz --slops 50 500",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+
+    subparsers = parser.add_subparsers(help='Command to execute', dest='command')
+
+    expand_parser = subparsers.add_parser("expand")
+    expand_parser.add_argument(
+        "--regions_with_prefixes",
+        nargs='+',
+        help="Regions files (bed or bed.gz), space separated"
+    )
+    expand_parser.add_argument(
+        "--slops",
+        type=int,
+        nargs='+',
+        help="Slops"
+    )
+    expand_parser.add_argument(
+        "--fai",
+        type=str,
+        help="FASTA index used to clamp the expanded regions to the contig lengths"
+    )
+    expand_parser.add_argument(
+        "--output",
+        type=str,
+        help="Output BED file (default stdout)"
+    )
+
+    group_parser = subparsers.add_parser("group")
+    group_parser.add_argument(
+        "--windows",
+        type=str,
+        help="Windows to split, as written by expand"
+    )
+    group_parser.add_argument(
+        "--groups",
+        type=int,
+        help="Maximum number of groups"
+    )
+    group_parser.add_argument(
+        "--output_prefix",
+        type=str,
+        default="group",
+        help="Prefix of the BED file of every group, numbered from 1"
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Coordinate argument parsing and program execution."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+
+    if args.command == "expand":
+        regions = IntervalSet()
+        for prefixed_bed_file in args.regions_with_prefixes:
+            prefix, path = prefixed_bed_file.split(":")
+            regions.add_bed(path, prefix)
+
+        # The windows of smaller slops are contained in the one of the largest slop
+        lengths = read_fai(args.fai) if args.fai else None
+        expanded = regions.expand(max(args.slops), lengths)
+
+        output = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            written = write_bed(expanded.merged(), output)
+        finally:
+            if args.output:
+                output.close()
+        logger.info(f"{len(regions)} regions merged into {written} windows")
+
+    if args.command == "group":
+        windows = IntervalSet().add_bed(args.windows).merged()
+        groups = partition(windows, args.groups)
+        for number, group in enumerate(groups, start=1):
+            with open(f"{args.output_prefix}_{number:0{len(str(len(groups)))}d}.bed", 'w') as output:
+                write_bed(group, output)
+        logger.info(f"Windows split into {len(groups)} groups")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""Provide per-stage metrics shared by the bin/ tools and a command line tool to time snapshots from IGV batch logs."""
+import argparse
+import json
+import logging
+import re
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger()
+
+
+def peak_rss():
+    """Return the peak resident set size of this process, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Metrics:
+    """
+    Record the wall time, CPU time, peak RSS and item counts of the stages of a run, and write them as JSON.
+
+    Stages are listed in the order they start, nested stages after the stage containing them. The peak RSS of a
+    stage is the peak of the process when the stage ends.
+    """
+
+    def __init__(self, tool=None):
+        self.tool = tool
+        self.stages = []
+        self.started = time.perf_counter()
+        self.started_cpu = time.process_time()
+
+    @contextmanager
+    def stage(self, name, **counts):
+        """Time the enclosed block, yielding its counts so they can be filled in as items are processed."""
+        record = {"name": name, "counts": dict(counts)}
+        self.stages.append(record)
+        started, started_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record["counts"]
+        finally:
+            record["wall_seconds"] = time.perf_counter() - started
+            record["cpu_seconds"] = time.process_time() - started_cpu
+            record["peak_rss_bytes"] = peak_rss()
+
+    def to_dict(self):
+        return {
+            "tool": self.tool,
+            "wall_seconds": time.perf_counter() - self.started,
+            "cpu_seconds": time.process_time() - self.started_cpu,
+            "peak_rss_bytes": peak_rss(),
+            "stages": self.stages,
+        }
+
+    def write(self, path):
+        with open(path, 'w') as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2)
+
+
+IGV_LOG_LINE = re.compile(r'\[?(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[,.]\d+)?)\]?')
+IGV_COMMAND = re.compile(r'Execut\w*(?: batch)? command:?\s*(.+)$', re.IGNORECASE)
+
+
+def _parse_timestamp(text):
+    text = text.replace('T', ' ').replace(',', '.')
+    return datetime.strptime(text, '%Y-%m-%d %H:%M:%S.%f' if '.' in text else '%Y-%m-%d %H:%M:%S')
+
+
+def parse_igv_batch_log(lines):
+    """
+    Yield the latency of every snapshot of an IGV batch run from its log, as dictionaries with the locus, the
+    snapshot, and the seconds spent from the goto to the snapshot, from the snapshot to the next logged line, and
+    in total.
+
+    IGV logs the start of every batch command, so the snapshot of a locus is considered done when the next line is
+    logged. Snapshots without a following line are not reported.
+    """
+    goto = None
+    snapshot = None
+    for line in lines:
+        timestamp_match = IGV_LOG_LINE.search(line)
+        if not timestamp_match:
+            continue
+        timestamp = _parse_timestamp(timestamp_match.group(1))
+
+        if snapshot:
+            locus, goto_time, snapshot_name, snapshot_time = snapshot
+            yield {
+                "locus": locus,
+                "snapshot": snapshot_name,
+                "goto_seconds": (snapshot_time - goto_time).total_seconds(),
+                "snapshot_seconds": (timestamp - snapshot_time).total_seconds(),
+                "total_seconds": (timestamp - goto_time).total_seconds(),
+            }
+            snapshot = None
+
+        command_match = IGV_COMMAND.search(line)
+        if not command_match:
+            continue
+        command, _, argument = command_match.group(1).strip().partition(' ')
+        if command.lower() == 'goto':
+            goto = (argument, timestamp)
+        elif command.lower() == 'snapshot' and goto:
+            snapshot = goto + (argument, timestamp)
+            goto = None
+
+
+def summarize_latencies(latencies):
+    totals = sorted(latency["total_seconds"] for latency in latencies)
+    if not totals:
+        return {"snapshots": 0}
+    return {
+        "snapshots": len(totals),
+        "mean_seconds": sum(totals) / len(totals),
+        "median_seconds": totals[len(totals) // 2],
+        "p95_seconds": totals[min(len(totals) - 1, int(len(totals) * 0.95))],
+        "max_seconds": totals[-1],
+    }
+
+
+def parse_args(argv=None):
+    """Define and immediately parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Report the latency of every snapshot of an IGV batch run from its log",
+        epilog="Example: python metrics.py igv-log --log igv.log --output snapshot_latency.tsv",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+    parser.add_argument(
+        "--metrics-out", "--metrics_out",
+        dest="metrics_out",
+        help="JSON file receiving a summary of the latencies"
+    )
+
+    subparsers = parser.add_subparsers(help='Command to execute', dest='command')
+
+    log_parser = subparsers.add_parser("igv-log")
+    log_parser.add_argument(
+        "--log",
+        nargs='+',
+        help="Output of IGV running a batch file, one file per IGV instance"
+    )
+    log_parser.add_argument(
+        "--output",
+        type=str,
+        help="TSV file receiving the latency of every snapshot"
+    )
+    log_parser.add_argument(
+        "--slowest",
+        type=int,
+        default=10,
+        help="Number of slowest snapshots to log"
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Coordinate argument parsing and program execution."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+
+    if args.command == "igv-log":
+        metrics = Metrics("metrics.py igv-log")
+        latencies = []
+        for log_path in args.log:
+            with metrics.stage(f"parse {log_path}") as counts, open(log_path, 'r', errors='replace') as log:
+                log_latencies = list(parse_igv_batch_log(log))
+                counts["snapshots"] = len(log_latencies)
+            latencies.extend(log_latencies)
+
+        with open(args.output, 'w') as output:
+            output.write("locus\tsnapshot\tgoto_seconds\tsnapshot_seconds\ttotal_seconds\n")
+            for latency in latencies:
+                output.write(f"{latency['locus']}\t{latency['snapshot']}\t{latency['goto_seconds']:.3f}\t"
+                             f"{latency['snapshot_seconds']:.3f}\t{latency['total_seconds']:.3f}\n")
+
+        for latency in sorted(latencies, key=lambda entry: -entry["total_seconds"])[:args.slowest]:
+            logger.info(f"{latency['total_seconds']:.3f}s {latency['locus']} {latency['snapshot']}")
+
+        if args.metrics_out:
+            summary = metrics.to_dict()
+            summary["latency"] = summarize_latencies(latencies)
+            with open(args.metrics_out, 'w') as metrics_file:
+                json.dump(summary, metrics_file, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
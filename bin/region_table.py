@@ -0,0 +1,206 @@
+"""Provide a columnar table of regions, expanded by every slop at once and formatted into IGV batch commands."""
+from itertools import islice
+
+import numpy as np
+
+from intervals import BED_HEADERS
+from intervals import open_text
+
+
+class RegionTable:
+    """
+    Regions held as columns: contig ids, 0-based start and end int64 arrays and label (prefix) ids. Contig and label
+    names live in dictionaries shared by every table read with them, so tables of several files can be concatenated
+    and sorted together.
+
+    Slop windows are computed for all regions and slops at once by broadcasting, and batch commands are formatted a
+    table at a time, so the Python work per snapshot is reduced to filling a template.
+    """
+
+    CHUNK_SIZE = 100000
+
+    def __init__(self, contig_ids, starts, ends, label_ids, contigs, labels):
+        self.contig_ids = contig_ids
+        self.starts = starts
+        self.ends = ends
+        self.label_ids = label_ids
+        self.contigs = contigs
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def empty(cls, contigs, labels):
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                   np.empty(0, dtype=np.int64), contigs, labels)
+
+    @staticmethod
+    def _split_uniform(text):
+        """
+        Return the fields of every line and the number of columns when all the lines have the same number of
+        columns, None otherwise. A marker field after every line shows where lines end, so a single split does it.
+        """
+        if not text.endswith('\n'):
+            text += '\n'
+        lines = text.count('\n')
+        columns = text.partition('\n')[0].count('\t') + 1
+        fields = text.replace('\n', '\t\n\t').split('\t')
+        if columns < 3 or len(fields) != lines * (columns + 1) + 1 or \
+                fields[columns::columns + 1].count('\n') != lines:
+            return None, None
+        return fields[:-1], columns
+
+    @classmethod
+    def _parse(cls, text, label_id, contigs, labels):
+        fields, columns = None, None
+        if not text.startswith(BED_HEADERS + ('\n',)) and \
+                not any(f'\n{marker}' in text for marker in BED_HEADERS + ('\n',)):
+            fields, columns = cls._split_uniform(text)
+
+        if fields:
+            contig_names, starts, ends = fields[0::columns + 1], fields[1::columns + 1], fields[2::columns + 1]
+        else:
+            rows = [line.split('\t', 3) for line in text.splitlines()
+                    if line.strip() and not line.startswith(BED_HEADERS)]
+            contig_names = [row[0] for row in rows]
+            starts = [row[1] for row in rows]
+            ends = [row[2] for row in rows]
+        if not contig_names:
+            return cls.empty(contigs, labels)
+
+        for contig in sorted(set(contig_names).difference(contigs)):
+            contigs[contig] = len(contigs)
+        contig_ids = np.array(list(map(contigs.__getitem__, contig_names)), dtype=np.int64)
+        return cls(contig_ids, np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64),
+                   np.full(len(contig_ids), label_id, dtype=np.int64), contigs, labels)
+
+    @classmethod
+    def read_lines(cls, lines, label, contigs, labels, chunk_size=CHUNK_SIZE):
+        """Yield the regions of BED lines as tables of at most chunk_size rows, skipping headers and extra columns."""
+        label_id = labels.setdefault(label, len(labels))
+        lines = iter(lines)
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                return
+            table = cls._parse(''.join(chunk), label_id, contigs, labels)
+            if len(table):
+                yield table
+
+    @classmethod
+    def read_bed(cls, path, label, contigs, labels, chunk_size=CHUNK_SIZE):
+        """Yield the regions of a BED file as tables of at most chunk_size rows, skipping headers and extra columns."""
+        with open_text(path) as bed_file:
+            yield from cls.read_lines(bed_file, label, contigs, labels, chunk_size)
+
+    @classmethod
+    def concatenate(cls, tables, contigs, labels):
+        tables = list(tables)
+        if not tables:
+            return cls.empty(contigs, labels)
+        return cls(np.concatenate([table.contig_ids for table in tables]),
+                   np.concatenate([table.starts for table in tables]),
+                   np.concatenate([table.ends for table in tables]),
+                   np.concatenate([table.label_ids for table in tables]), contigs, labels)
+
+    def take(self, index):
+        return RegionTable(self.contig_ids[index], self.starts[index], self.ends[index], self.label_ids[index],
+                           self.contigs, self.labels)
+
+    def sorted(self):
+        """Return the table sorted by contig name, start, end and label."""
+        contig_ranks = np.argsort(np.argsort(np.array(list(self.contigs), dtype=object), kind='stable'))
+        order = np.lexsort((self.label_ids, self.ends, self.starts, contig_ranks[self.contig_ids]))
+        return self.take(order)
+
+    def region(self, row):
+        contig_names = list(self.contigs)
+        return contig_names[self.contig_ids[row]], int(self.starts[row]), int(self.ends[row])
+
+    def _same_as_previous(self):
+        """Flag the rows holding the same region as the row before them."""
+        same = np.zeros(len(self), dtype=bool)
+        same[1:] = ((self.contig_ids[1:] == self.contig_ids[:-1]) & (self.starts[1:] == self.starts[:-1])
+                    & (self.ends[1:] == self.ends[:-1]))
+        return same
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """Split the table in consecutive tables of about chunk_size rows, never splitting a repeated region."""
+        same = self._same_as_previous()
+        start = 0
+        while start < len(self):
+            end = min(start + chunk_size, len(self))
+            while end < len(self) and same[end]:
+                end += 1
+            yield self.take(slice(start, end))
+            start = end
+
+    def windows(self, slops, lengths=None):
+        """Return the window starts and ends of every region (rows) and slop (columns), clamped to the contigs."""
+        slops = np.asarray(slops, dtype=np.int64)
+        window_starts = np.maximum(self.starts[:, None] - slops[None, :], 0)
+        window_ends = self.ends[:, None] + slops[None, :]
+        if lengths:
+            no_limit = np.iinfo(np.int64).max
+            contig_lengths = np.array([lengths.get(contig, no_limit) for contig in self.contigs], dtype=np.int64)
+            window_ends = np.minimum(window_ends, contig_lengths[self.contig_ids][:, None])
+        return window_starts, window_ends
+
+    def jobs(self, slops, scheduled=False, selected=None):
+        """
+        Return the (row, slop column) of every snapshot in visiting order: by default regions as read and slops as
+        given. Scheduled, on a sorted table, the same region of several labels is visited together and the
+        largest slop first, so the data IGV loads for it already covers the smaller ones.
+
+        selected, a boolean array of regions (rows) and slops (columns), keeps only the snapshots it flags.
+        """
+        rows = np.repeat(np.arange(len(self)), len(slops))
+        columns = np.tile(np.arange(len(slops)), len(self))
+        if scheduled and len(self):
+            groups = np.cumsum(~self._same_as_previous())
+            slop_ranks = np.argsort(np.argsort(-np.asarray(slops), kind='stable'))
+            order = np.lexsort((rows, slop_ranks[columns], groups[rows]))
+            rows, columns = rows[order], columns[order]
+        if selected is not None:
+            kept = selected[rows, columns]
+            rows, columns = rows[kept], columns[kept]
+        return rows, columns
+
+    def job_windows(self, slops, lengths=None, scheduled=False):
+        """Return the contig ids, starts and ends of the windows visited by the snapshots, in visiting order."""
+        rows, columns = self.jobs(slops, scheduled)
+        window_starts, window_ends = self.windows(slops, lengths)
+        return self.contig_ids[rows], window_starts[rows, columns], window_ends[rows, columns]
+
+    def batch_commands(self, slops, lengths=None, scheduled=False, selected=None):
+        """Return the goto/snapshot commands of every region and slop (or of the selected ones) as one string."""
+        if not len(self):
+            return ''
+        contig_names = list(self.contigs)
+        label_names = list(self.labels)
+        rows, columns = self.jobs(slops, scheduled, selected)
+        window_starts, window_ends = self.windows(slops, lengths)
+
+        # Text shared by the snapshots of a region is built once per region, then once per contig
+        region_fields = np.empty((len(self), 4), dtype=object)
+        region_fields[:, 0] = np.array(label_names, dtype=object)[self.label_ids]
+        region_fields[:, 1] = np.array(contig_names, dtype=object)[self.contig_ids]
+        region_fields[:, 2] = self.starts
+        region_fields[:, 3] = self.ends
+        snapshot_names = np.array((('\nsnapshot %s%s_%d_%d_slop\0' * len(self)) %
+                                   tuple(region_fields.ravel().tolist())).split('\0')[:-1], dtype=object)
+        gotos = np.array([f'goto {contig}:' for contig in contig_names], dtype=object)
+        # The slop of every snapshot is fixed by its position, so it is written in the template, not filled in
+        templates = np.array([f'%s%d-%d%s{value}.png\n' for value in slops], dtype=object)
+
+        fields = np.empty((len(rows), 4), dtype=object)
+        fields[:, 0] = gotos[self.contig_ids[rows]]
+        if scheduled or selected is not None:
+            fields[:, 1] = window_starts[rows, columns]
+            fields[:, 2] = window_ends[rows, columns]
+        else:
+            fields[:, 1] = window_starts.ravel()
+            fields[:, 2] = window_ends.ravel()
+        fields[:, 3] = snapshot_names[rows]
+        return ''.join(templates[columns].tolist()) % tuple(fields.ravel().tolist())
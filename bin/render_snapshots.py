@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+
+"""Provide a command line tool to render the snapshots of IGV batch files without IGV, Xvfb or a JVM."""
+import argparse
+import logging
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pysam
+
+from batch_io import read_snapshot_jobs
+from coverage import is_counted
+from igv_with_reveal import IGVSessionBuilder
+from intervals import BED_HEADERS
+from intervals import open_text
+from intervals import read_bed
+
+try:
+    import pyBigWig
+except ImportError:
+    pyBigWig = None
+
+logger = logging.getLogger()
+
+BACKGROUND = (255, 255, 255)
+DIVIDER = (200, 200, 200)
+COVERAGE = (175, 175, 175)
+FORWARD_READ = (185, 185, 185)
+REVERSE_READ = (160, 160, 200)
+FEATURE = (0, 0, 178)
+BASES = {'A': (0, 150, 0), 'C': (0, 0, 255), 'G': (209, 113, 5), 'T': (255, 0, 0)}
+UNKNOWN_BASE = (130, 130, 130)
+
+COVERAGE_SHARE = 0.25
+READ_ROW_HEIGHT = 4
+
+
+def write_png(path, pixels, compression=6):
+    """Write an RGB image given as a (height, width, 3) uint8 array as a PNG file."""
+    height, width, _ = pixels.shape
+    rows = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    with open(path, 'wb') as png:
+        png.write(b'\x89PNG\r\n\x1a\n')
+        png.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        png.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), compression)))
+        png.write(chunk(b'IEND', b''))
+
+
+class SnapshotRenderer:
+    """
+    Draw one region as an image with the panel layout of the IGV session built from the same tracks: reference
+    sequence and variants on top, then coverage and alignments for each BAM, then the feature tracks.
+
+    As in the session, a coverage track labelled as an alignment is drawn instead of the depth of its reads, and
+    the other coverage tracks are drawn as bar charts with the features. bigWig tracks need pyBigWig and are left
+    blank without it.
+    """
+
+    def __init__(self, reference, tracks_with_labels, width, height):
+        self.reference = pysam.FastaFile(reference)
+        session = IGVSessionBuilder(os.path.basename(reference), tracks_with_labels)
+        self.layout = session.panel_layout()
+        self.coverages = session.coverages
+        self.width = width
+        self.height = height
+        self.handles = {}
+        self.features = {}
+        self.values = {}
+
+    def close(self):
+        self.reference.close()
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _alignments(self, track):
+        if track.path not in self.handles:
+            self.handles[track.path] = pysam.AlignmentFile(track.path, 'rb', index_filename=track.index)
+        return self.handles[track.path]
+
+    def _variants(self, track):
+        if track.path not in self.handles:
+            self.handles[track.path] = pysam.VariantFile(track.path, index_filename=track.index)
+        return self.handles[track.path]
+
+    def _feature_intervals(self, track):
+        if track.path not in self.features:
+            features = {}
+            for contig, start, end in read_bed(track.path):
+                features.setdefault(contig, []).append((start, end))
+            self.features[track.path] = {contig: sorted(intervals) for contig, intervals in features.items()}
+        return self.features[track.path]
+
+    def _bedgraph_values(self, track):
+        if track.path not in self.values:
+            values = {}
+            with open_text(track.path) as bedgraph:
+                for line in bedgraph:
+                    if not line.strip() or line.startswith(BED_HEADERS):
+                        continue
+                    contig, start, end, value = line.split()[:4]
+                    values.setdefault(contig, []).append((int(start), int(end), float(value)))
+            self.values[track.path] = {contig: sorted(intervals) for contig, intervals in values.items()}
+        return self.values[track.path]
+
+    def _coverage_intervals(self, track, contig, window):
+        """Return the (start, end, value) of a coverage track overlapping the window, None when it can't be read."""
+        if track.path.endswith((".bw", ".bigwig")):
+            if pyBigWig is None:
+                logger.warning(f"pyBigWig is not installed, {track.path} is not drawn")
+                return None
+            if track.path not in self.handles:
+                self.handles[track.path] = pyBigWig.open(track.path)
+            bigwig = self.handles[track.path]
+            return (bigwig.intervals(contig, *window) or []) if contig in bigwig.chroms() else []
+        indexed = track.index or any(os.path.exists(f"{track.path}{suffix}") for suffix in (".tbi", ".csi"))
+        if track.path.endswith(".gz") and indexed:
+            if track.path not in self.handles:
+                self.handles[track.path] = pysam.TabixFile(track.path, index=track.index)
+            tabix = self.handles[track.path]
+            if contig not in tabix.contigs:
+                return []
+            return [(int(fields[1]), int(fields[2]), float(fields[3]))
+                    for fields in (line.split('\t') for line in tabix.fetch(contig, *window))]
+        return [interval for interval in self._bedgraph_values(track).get(contig, [])
+                if interval[0] < window[1] and interval[1] > window[0]]
+
+    def _coverage_depth(self, track, contig, window):
+        window_start, window_end = window
+        intervals = self._coverage_intervals(track, contig, window)
+        if intervals is None:
+            return None
+        depth = np.zeros(max(1, window_end - window_start), dtype=np.float64)
+        for start, end, value in intervals:
+            depth[max(start, window_start) - window_start:min(end, window_end) - window_start] = value
+        return depth
+
+    def _columns(self, window, start, end):
+        """Return the pixel columns [x0, x1) covered by [start, end) in the window, at least one pixel wide."""
+        window_start, window_end = window
+        scale = self.width / max(1, window_end - window_start)
+        x0 = int((max(start, window_start) - window_start) * scale)
+        x1 = int((min(end, window_end) - window_start) * scale)
+        return min(x0, self.width - 1), min(max(x1, x0 + 1), self.width)
+
+    def _draw_sequence(self, pixels, top, bottom, contig, window):
+        window_start, window_end = window
+        if contig not in self.reference.references:
+            return
+        if window_end - window_start > self.width:
+            pixels[top + (bottom - top) // 2, :] = UNKNOWN_BASE
+            return
+        sequence = self.reference.fetch(contig, window_start, window_end).upper()
+        for offset, base in enumerate(sequence):
+            x0, x1 = self._columns(window, window_start + offset, window_start + offset + 1)
+            pixels[top:bottom, x0:x1] = BASES.get(base, UNKNOWN_BASE)
+
+    def _draw_variants(self, pixels, top, bottom, track, contig, window):
+        variants = self._variants(track)
+        if contig not in variants.header.contigs:
+            return
+        for record in variants.fetch(contig, *window):
+            x0, x1 = self._columns(window, record.start, record.stop)
+            pixels[top + 1:bottom - 1, x0:x1] = FEATURE
+
+    def _draw_features(self, pixels, top, bottom, track, contig, window):
+        for start, end in self._feature_intervals(track).get(contig, []):
+            if start >= window[1]:
+                break
+            if end > window[0]:
+                x0, x1 = self._columns(window, start, end)
+                pixels[top + 1:bottom - 1, x0:x1] = FEATURE
+
+    def _draw_alignments(self, pixels, top, bottom, track, contig, window):
+        window_start, window_end = window
+        alignments = self._alignments(track)
+        if contig not in alignments.references:
+            return
+
+        coverage_bottom = top + int((bottom - top) * COVERAGE_SHARE)
+        rows = max(1, (bottom - coverage_bottom) // READ_ROW_HEIGHT)
+        row_ends = []
+        block_starts = []
+        block_ends = []
+        for read in alignments.fetch(contig, window_start, window_end):
+            # Same reads as the coverage track and the default filters of IGV: no duplicates, no QC failed reads
+            if not is_counted(read):
+                continue
+            for block_start, block_end in read.get_blocks():
+                block_starts.append(block_start)
+                block_ends.append(block_end)
+
+            # Reads come sorted by start, so the first row free at the read start packs them like IGV does
+            for row, row_end in enumerate(row_ends):
+                if row_end < read.reference_start:
+                    break
+            else:
+                row = len(row_ends)
+                row_ends.append(0)
+            if row < rows:
+                row_ends[row] = read.reference_end
+                x0, x1 = self._columns(window, read.reference_start, read.reference_end)
+                y0 = coverage_bottom + row * READ_ROW_HEIGHT
+                pixels[y0:y0 + READ_ROW_HEIGHT - 1, x0:x1] = REVERSE_READ if read.is_reverse else FORWARD_READ
+            else:
+                row_ends.pop()
+
+        coverage = self.coverages.get(track.label)
+        depth = self._coverage_depth(coverage, contig, window) if coverage else None
+        if depth is None:
+            depth = self._read_depth(window, block_starts, block_ends)
+        self._draw_coverage(pixels, top, coverage_bottom, depth)
+
+    @staticmethod
+    def _read_depth(window, block_starts, block_ends):
+        window_start, window_end = window
+        length = max(1, window_end - window_start)
+        changes = np.zeros(length + 1, dtype=np.int64)
+        np.add.at(changes, np.clip(np.asarray(block_starts, dtype=np.int64) - window_start, 0, length), 1)
+        np.add.at(changes, np.clip(np.asarray(block_ends, dtype=np.int64) - window_start, 0, length), -1)
+        return np.cumsum(changes[:-1])
+
+    def _draw_values(self, pixels, top, bottom, track, contig, window):
+        depth = self._coverage_depth(track, contig, window)
+        if depth is not None:
+            self._draw_coverage(pixels, top + 1, bottom - 1, depth)
+
+    def _draw_coverage(self, pixels, top, bottom, depth):
+        length = len(depth)
+        if length >= self.width:
+            edges = (np.arange(self.width) * length) // self.width
+            column_depth = np.maximum.reduceat(depth, edges)
+        else:
+            column_depth = depth[(np.arange(self.width) * length) // self.width]
+
+        height = bottom - top - 1
+        bar_heights = (column_depth * height // max(10, column_depth.max(initial=0))).astype(np.int64)
+        filled = np.arange(height)[::-1, None] < bar_heights[None, :]
+        pixels[top:top + height][filled] = COVERAGE
+
+    def render(self, contig, start, end):
+        pixels = np.full((self.height, self.width, 3), BACKGROUND, dtype=np.uint8)
+        window = (start, end)
+
+        for number, (tracks, panel_top, panel_bottom) in enumerate(self.layout):
+            top, bottom = int(panel_top * self.height), int(panel_bottom * self.height)
+            if number == 0:
+                factors = [IGVSessionBuilder.SEQUENCE_FACTOR] + [IGVSessionBuilder.VCF_FACTOR] * len(tracks)
+                slots = [None] + tracks
+            else:
+                factors = [1] * len(tracks)
+                slots = tracks
+
+            position = top
+            for slot, factor in zip(slots, factors):
+                slot_bottom = position + (bottom - top) * factor // sum(factors)
+                if slot is None:
+                    self._draw_sequence(pixels, position, slot_bottom, contig, window)
+                elif slot.is_alignment:
+                    self._draw_alignments(pixels, position, slot_bottom, slot, contig, window)
+                elif slot.is_variant:
+                    self._draw_variants(pixels, position, slot_bottom, slot, contig, window)
+                elif slot.is_coverage:
+                    self._draw_values(pixels, position, slot_bottom, slot, contig, window)
+                else:
+                    self._draw_features(pixels, position, slot_bottom, slot, contig, window)
+                position = slot_bottom
+
+            # An empty feature panel starts at the bottom of the image
+            if 0 < top < self.height:
+                pixels[top, :] = DIVIDER
+        return pixels
+
+
+_renderer = None
+
+
+def _init_worker(reference, tracks_with_labels, width, height):
+    global _renderer
+    _renderer = SnapshotRenderer(reference, tracks_with_labels, width, height)
+
+
+def _render_job(job):
+    contig, start, end, snapshot_path = job
+    write_png(snapshot_path, _renderer.render(contig, start, end))
+    return snapshot_path
+
+
+class BatchRenderer:
+    """Render every snapshot of a set of IGV batch files, spreading the regions over a pool of processes."""
+
+    CHUNK_SIZE = 8
+
+    def __init__(self, reference, tracks_with_labels, batch_files, width=1920, height=1080, processes=1):
+        self.reference = reference
+        self.tracks_with_labels = tracks_with_labels
+        self.batch_files = batch_files
+        self.width = width
+        self.height = height
+        self.processes = processes
+
+    def build(self):
+        # Builds the FASTA index, when missing, before the workers open the reference concurrently
+        pysam.FastaFile(self.reference).close()
+
+        jobs = list(read_snapshot_jobs(self.batch_files))
+        for snapshots_dir in {os.path.dirname(job[3]) for job in jobs}:
+            os.makedirs(snapshots_dir or '.', exist_ok=True)
+
+        started = time.perf_counter()
+        initargs = (self.reference, self.tracks_with_labels, self.width, self.height)
+        with ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker, initargs=initargs) as executor:
+            rendered = sum(1 for _ in executor.map(_render_job, jobs, chunksize=self.CHUNK_SIZE))
+        elapsed = time.perf_counter() - started
+        logger.info(f"{rendered} snapshots rendered with {self.processes} processes "
+                    f"({rendered / elapsed if elapsed else 0:.1f} snapshots/sec)")
+        return rendered
+
+
+def parse_args(argv=None):
+    """Define and immediately parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Render the snapshots of IGV batch files directly from the indexed tracks",
+        epilog="Example: python render_snapshots.py --reference genome.fa --tracks_with_labels Reads:reads.bam "
+               "--batch snapshots.txt",
+    )
+    parser.add_argument(
+        "--reference",
+        type=str,
+        help="Reference FASTA file, indexed"
+    )
+    parser.add_argument(
+        "--tracks_with_labels",
+        nargs='+',
+        help="Track files as label:path, or label:path:index, space separated"
+    )
+    parser.add_argument(
+        "--batch",
+        nargs='+',
+        help="IGV batch files with the goto/snapshot commands to render"
+    )
+    parser.add_argument(
+        "--width",
+        type=int,
+        default=1920,
+        help="Width of the snapshots in pixels"
+    )
+    parser.add_argument(
+        "--height",
+        type=int,
+        default=1080,
+        help="Height of the snapshots in pixels"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of snapshots rendered in parallel"
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Coordinate argument parsing and program execution."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    BatchRenderer(args.reference, args.tracks_with_labels, args.batch, args.width, args.height,
+                  args.processes).build()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
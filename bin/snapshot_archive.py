@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+
+"""Provide a command line tool to pack snapshots into indexed archives, and to read them back one at a time."""
+import argparse
+import csv
+import io
+import logging
+import os
+import re
+import struct
+import sys
+import tarfile
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote
+
+from metrics import Metrics
+
+logger = logging.getLogger()
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+SNAPSHOT_NAME = re.compile(r'^(?P<stem>.+)_(?P<start>\d+)_(?P<end>\d+)_slop(?P<slop>\d+)\.png$')
+INDEX_FIELDS = ("name", "prefix", "locus", "slop", "archive", "offset", "length", "original_length")
+
+
+def png_chunks(data):
+    """Yield the (type, payload) chunks of a PNG image, raising ValueError when it is not one."""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("not a PNG image")
+    position = len(PNG_SIGNATURE)
+    while position + 8 <= len(data):
+        length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+        payload = data[position + 8:position + 8 + length]
+        if len(payload) != length:
+            raise ValueError("truncated PNG chunk")
+        yield chunk_type, payload
+        position += 12 + length
+        if chunk_type == b'IEND':
+            return
+    raise ValueError("PNG image without IEND")
+
+
+def _chunk(chunk_type, payload):
+    return struct.pack('>I', len(payload)) + chunk_type + payload + \
+        struct.pack('>I', zlib.crc32(chunk_type + payload) & 0xffffffff)
+
+
+def recompress_png(data, level=9):
+    """
+    Return the PNG image with its pixel data deflated again at the given level, in a single IDAT chunk, or the
+    image itself when that is not smaller. The inflated pixel data, and so the image, are left unchanged.
+    """
+    before, pixels, after = [], [], []
+    for chunk_type, payload in png_chunks(data):
+        if chunk_type == b'IDAT':
+            if after:
+                raise ValueError("PNG image with non consecutive IDAT chunks")
+            pixels.append(payload)
+        else:
+            (after if pixels else before).append(_chunk(chunk_type, payload))
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 9)
+    deflated = compressor.compress(zlib.decompress(b''.join(pixels))) + compressor.flush()
+    recompressed = PNG_SIGNATURE + b''.join(before) + _chunk(b'IDAT', deflated) + b''.join(after)
+    return recompressed if len(recompressed) < len(data) else data
+
+
+def split_snapshot_name(name, prefixes=()):
+    """
+    Return the prefix, locus and slop of a snapshot named by build-batch ({prefix}{contig}_{start}_{end}_slop{slop}
+    .png), or None for other names. The prefix is the longest of the given prefixes the name starts with.
+    """
+    match = SNAPSHOT_NAME.match(name)
+    if not match:
+        return None
+    stem = match.group('stem')
+    prefix = max((prefix for prefix in prefixes if stem.startswith(prefix)), key=len, default='')
+    return prefix, f"{stem[len(prefix):]}:{match.group('start')}-{match.group('end')}", int(match.group('slop'))
+
+
+class SnapshotPacker:
+    """
+    Stream the PNG images of a directory tree into uncompressed tar archives of about chunk_bytes each, and write
+    a CSV index giving the archive, offset and length of every image.
+
+    Images are read, recompressed and written one at a time, so memory does not grow with their number. The
+    archives are plain tar files, so they can also be unpacked with tar, and every image is stored contiguously,
+    so it is read back with a single seek.
+    """
+
+    INDEX = "snapshots_index.csv"
+    CHUNK_BYTES = 1 << 30
+
+    def __init__(self, captures_dir, output_prefix="snapshots", prefixes=(), chunk_bytes=CHUNK_BYTES, level=9,
+                 metrics=None):
+        self.captures_dir = Path(captures_dir)
+        self.output_prefix = output_prefix
+        self.prefixes = prefixes
+        self.chunk_bytes = chunk_bytes
+        self.level = level
+        self.metrics = metrics or Metrics()
+
+    def _images(self):
+        for directory, subdirectories, files in os.walk(self.captures_dir):
+            subdirectories.sort()
+            for file_name in sorted(files):
+                if file_name.endswith('.png'):
+                    yield Path(directory) / file_name
+
+    def _archive_name(self, number):
+        return f"{self.output_prefix}_{number:04d}.tar"
+
+    def build(self, index=INDEX):
+        archive = None
+        archive_number = 0
+        with self.metrics.stage("pack snapshots") as counts, open(index, 'w', newline='') as index_file:
+            counts.update(images=0, archives=0, original_bytes=0, packed_bytes=0)
+            writer = csv.writer(index_file)
+            writer.writerow(INDEX_FIELDS)
+            try:
+                for path in self._images():
+                    if archive is None or archive.fileobj.tell() >= self.chunk_bytes:
+                        if archive is not None:
+                            archive.close()
+                        archive_number += 1
+                        archive = tarfile.open(self._archive_name(archive_number), 'w', format=tarfile.PAX_FORMAT)
+                        counts["archives"] += 1
+
+                    original = path.read_bytes()
+                    try:
+                        packed = recompress_png(original, self.level)
+                    except (ValueError, zlib.error) as error:
+                        logger.warning(f"{path} stored as is: {error}")
+                        packed = original
+
+                    member = tarfile.TarInfo(path.relative_to(self.captures_dir).as_posix())
+                    member.size = len(packed)
+                    member.mtime = int(path.stat().st_mtime)
+                    archive.addfile(member, io.BytesIO(packed))
+                    # The data ends the member, padded to whole tar blocks
+                    offset = archive.fileobj.tell() - tarfile.BLOCKSIZE * -(-len(packed) // tarfile.BLOCKSIZE)
+
+                    prefix, locus, slop = split_snapshot_name(path.name, self.prefixes) or ('', '', '')
+                    writer.writerow((member.name, prefix, locus, slop, self._archive_name(archive_number),
+                                     offset, len(packed), len(original)))
+                    counts["images"] += 1
+                    counts["original_bytes"] += len(original)
+                    counts["packed_bytes"] += len(packed)
+            finally:
+                if archive is not None:
+                    archive.close()
+        logger.info(f"{counts['images']} snapshots packed in {counts['archives']} archives, "
+                    f"{counts['original_bytes']} bytes recompressed to {counts['packed_bytes']}")
+        return counts["images"]
+
+
+class SnapshotArchive:
+    """
+    Read single snapshots from the archives of a packed index, without unpacking the others.
+
+    Snapshots are looked up by their path in the captures directory, by their file name, or by prefix, locus and
+    slop. Archives are resolved next to the index and opened once, on their first read.
+    """
+
+    def __init__(self, index):
+        self.directory = Path(index).parent
+        self.entries = {}
+        self.names = {}
+        self.loci = {}
+        with open(index, 'r', newline='') as index_file:
+            for entry in csv.DictReader(index_file):
+                entry["offset"] = int(entry["offset"])
+                entry["length"] = int(entry["length"])
+                self.entries[entry["name"]] = entry
+                self.names.setdefault(os.path.basename(entry["name"]), entry)
+                if entry["locus"]:
+                    self.loci.setdefault((entry["prefix"], entry["locus"], int(entry["slop"])), entry)
+        self.archives = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries or name in self.names
+
+    def close(self):
+        for archive in self.archives.values():
+            archive.close()
+        self.archives = {}
+
+    def entry(self, name):
+        entry = self.entries.get(name) or self.names.get(name)
+        if entry is None:
+            raise KeyError(f"No snapshot {name} in the index")
+        return entry
+
+    def find(self, prefix, locus, slop):
+        """Return the name of the snapshot of a prefix, locus (contig:start-end) and slop."""
+        entry = self.loci.get((prefix, locus, int(slop)))
+        if entry is None:
+            raise KeyError(f"No snapshot of {prefix}{locus} with slop {slop} in the index")
+        return entry["name"]
+
+    def read(self, name):
+        """Return the PNG image of a snapshot as bytes."""
+        entry = self.entry(name)
+        with self.lock:
+            archive = self.archives.get(entry["archive"])
+            if archive is None:
+                archive = self.archives[entry["archive"]] = open(self.directory / entry["archive"], 'rb')
+            archive.seek(entry["offset"])
+            return archive.read(entry["length"])
+
+    def extract(self, name, output_dir):
+        """Write a snapshot below output_dir at its path in the captures directory, returning that path."""
+        target = Path(output_dir) / self.entry(name)["name"]
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(self.read(name))
+        return target
+
+
+def serve(archive, host, port):
+    """Serve the snapshots of an archive over HTTP, at /<name> and at /<prefix>/<locus>/<slop>."""
+
+    class SnapshotHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            path = unquote(self.path).lstrip('/')
+            try:
+                parts = path.split('/')
+                if path not in archive and len(parts) == 3 and parts[2].isdigit():
+                    path = archive.find(*parts)
+                image = archive.read(path)
+            except KeyError:
+                self.send_error(404, f"No snapshot {path}")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(image)))
+            self.end_headers()
+            self.wfile.write(image)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), SnapshotHandler)
+    logger.info(f"Serving {len(archive)} snapshots on http://{host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def parse_args(argv=None):
+    """Define and immediately parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Pack snapshots into indexed archives, and read them back one at a time",
+        epilog="Example: python snapshot_archive.py pack --captures captures --prefixes P1_ P2_",
+    )
+    parser.add_argument(
+        "--metrics-out", "--metrics_out",
+        dest="metrics_out",
+        help="JSON file receiving the wall time, CPU time, peak RSS and counts of every stage",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+
+    subparsers = parser.add_subparsers(help='Command to execute', dest='command')
+
+    pack_parser = subparsers.add_parser("pack")
+    pack_parser.add_argument(
+        "--captures",
+        type=str,
+        default="captures",
+        help="Directory holding the snapshots, searched recursively"
+    )
+    pack_parser.add_argument(
+        "--output_prefix",
+        type=str,
+        default="snapshots",
+        help="Prefix of the archives, numbered from 1"
+    )
+    pack_parser.add_argument(
+        "--index",
+        type=str,
+        default=SnapshotPacker.INDEX,
+        help="CSV file receiving the archive, offset and length of every snapshot"
+    )
+    pack_parser.add_argument(
+        "--prefixes",
+        nargs='*',
+        default=[],
+        help="Region prefixes, to record the prefix and locus of every snapshot in the index"
+    )
+    pack_parser.add_argument(
+        "--chunk_mb",
+        type=int,
+        default=SnapshotPacker.CHUNK_BYTES >> 20,
+        help="Size at which an archive is closed and the next one started, in MB"
+    )
+    pack_parser.add_argument(
+        "--level",
+        type=int,
+        choices=range(0, 10),
+        default=9,
+        help="Deflate level the PNG images are recompressed with"
+    )
+
+    list_parser = subparsers.add_parser("list")
+    list_parser.add_argument(
+        "--index",
+        type=str,
+        default=SnapshotPacker.INDEX,
+        help="Index written by pack"
+    )
+
+    extract_parser = subparsers.add_parser("extract")
+    extract_parser.add_argument(
+        "--index",
+        type=str,
+        default=SnapshotPacker.INDEX,
+        help="Index written by pack"
+    )
+    extract_parser.add_argument(
+        "--names",
+        nargs='*',
+        help="Snapshots to extract, by path or file name. All of them when not given"
+    )
+    extract_parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="captures",
+        help="Directory receiving the snapshots"
+    )
+
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument(
+        "--index",
+        type=str,
+        default=SnapshotPacker.INDEX,
+        help="Index written by pack"
+    )
+    serve_parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address to listen on"
+    )
+    serve_parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port to listen on, 0 for any free port"
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Coordinate argument parsing and program execution."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+
+    metrics = Metrics(f"snapshot_archive.py {args.command}")
+    try:
+        if args.command == "pack":
+            SnapshotPacker(args.captures, args.output_prefix, args.prefixes, args.chunk_mb << 20, args.level,
+                           metrics).build(args.index)
+
+        if args.command == "list":
+            with SnapshotArchive(args.index) as archive:
+                for name in archive:
+                    print(name)
+
+        if args.command == "extract":
+            with SnapshotArchive(args.index) as archive, metrics.stage("extract") as counts:
+                for name in args.names or list(archive):
+                    archive.extract(name, args.output_dir)
+                counts["images"] = len(args.names or archive)
+
+        if args.command == "serve":
+            with SnapshotArchive(args.index) as archive:
+                serve(archive, args.host, args.port)
+    finally:
+        if args.metrics_out:
+            metrics.write(args.metrics_out)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
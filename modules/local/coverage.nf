@@ -0,0 +1,34 @@
+process COMPUTE_COVERAGE {
+
+    tag "$key"
+
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
+        'docker.io/raphsoft/reveal:1.0' }"
+
+    input:
+    tuple val(key), val(group), file(bam_file), file(bam_index), file(regions)
+
+    output:
+    tuple val(key), val(group), file('*.coverage.bedgraph.gz'), file('*.coverage.bedgraph.gz.tbi'), emit: coverage
+    path "versions.yml", emit: versions
+
+    script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
+    prefix = bam_file.name.replaceAll(/\.bam$/, ".coverage")
+
+    """
+    coverage.py \\
+        --bam $bam_file \\
+        --index $bam_index \\
+        --regions $regions \\
+        --output $prefix
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+        pysam: \$(python -c "import pysam; print(pysam.__version__)")
+        numpy: \$(python -c "import numpy; print(numpy.__version__)")
+    END_VERSIONS
+    """
+}
@@ -0,0 +1,51 @@
+process DELTA_REGIONS {
+
+    tag "$job"
+
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
+        'docker.io/raphsoft/reveal:1.0' }"
+
+    input:
+    tuple val(job), val(regions_with_prefixes), path(regions) // String: [prefix1:path1, prefix2:path2]
+
+    output:
+    tuple val(job), path("delta/*")          , emit: regions
+    tuple val(job), path("${job}.delta.json"), emit: state
+    path '*.metrics.json'                    , emit: metrics
+    path "versions.yml"                      , emit: versions
+
+    script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
+    regions_param=regions_with_prefixes.toString().replace("[", "").replace("]", "").replace("," ,"")
+    """
+    # The state of the last successful run, missing on the first one
+    igv_with_reveal.py --metrics-out delta.metrics.json delta \\
+        --regions_with_prefixes $regions_param \\
+        --state ${params.delta_state}/${job}.delta.json \\
+        --state_out ${job}.delta.json \\
+        --output_dir delta
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+    END_VERSIONS
+    """
+}
+
+process SAVE_DELTA_STATE {
+
+    tag "$job"
+
+    input:
+    tuple val(job), path(state)
+    val snapshots // only used to wait for every snapshot to be rendered
+
+    script:
+    // Written once the snapshots exist, so the regions of a failed run are processed again by the next one
+    """
+    mkdir -p ${params.delta_state}
+    cp $state ${params.delta_state}/${job}.delta.json.tmp
+    mv ${params.delta_state}/${job}.delta.json.tmp ${params.delta_state}/${job}.delta.json
+    """
+}
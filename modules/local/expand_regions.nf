@@ -1,28 +1,63 @@
 process EXPAND_REGIONS {
 
-    tag "$samplesheet"
+    tag "$job"
 
-    conda (params.enable_conda ? "conda-forge::python=3.8.3" : null)
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
         'docker.io/raphsoft/reveal:1.0' }"
 
     input:
-    file regions
-    file slops
+    tuple val(job), val(regions_with_prefixes), path(regions), path(slops) // String: [prefix1:path1, prefix2:path2]
+    path fai
 
     output:
-    path "expanded_regions.bed", emit: expanded_regions
+    tuple val(job), path("expanded_regions.bed"), emit: expanded_regions
     path "versions.yml", emit: versions
 
-    script:
+    script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
+    regions_param=regions_with_prefixes.toString().replace("[", "").replace("]", "").replace("," ,"")
+    fai_param=fai ? "--fai $fai" : ""
     """
-    max_slop="\$(cat $slops | sort -rn | head -1)"
-    awk -v window=\$max_slop -F"\\t" 'BEGIN {OFS=FS}{print \$1,\$2-window,\$3+window}' $regions  | bedtools sort | bedtools merge > expanded_regions.bed
+    intervals.py expand \
+        --regions_with_prefixes $regions_param \
+        --slops \$(cat $slops | xargs) \
+        $fai_param \
+        --output expanded_regions.bed
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
-        bedtools: \$(bedtools --version | sed 's/bedtools //g')
+        python: \$(python --version | sed 's/Python //g')
+    END_VERSIONS
+    """
+}
+
+process GROUP_REGIONS {
+
+    tag "$job"
+
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
+        'docker.io/raphsoft/reveal:1.0' }"
+
+    input:
+    tuple val(job), path(expanded_regions)
+
+    output:
+    tuple val(job), path("group_*.bed"), emit: groups
+    path "versions.yml", emit: versions
+
+    script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
+    """
+    intervals.py group \
+        --windows $expanded_regions \
+        --groups ${params.region_groups} \
+        --output_prefix group
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
     END_VERSIONS
     """
 }
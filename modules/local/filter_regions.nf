@@ -1,64 +1,73 @@
 process FILTER_BAM_REGIONS {
 
-    tag "$samplesheet"
+    tag "$key"
+    label 'process_medium'
 
-    conda (params.enable_conda ? "conda-forge::python=3.8.3" : null)
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
         'docker.io/raphsoft/reveal:1.0' }"
 
     input:
-    tuple val(label), file(bam_file)
-    file regions
+    tuple val(key), val(group), file(bam_file), file(bam_index), file(regions)
 
     output:
-    tuple val(label), file('*.filtered.bam'), emit: filtered_bam
+    tuple val(key), val(group), file('*.filtered.bam'), file('*.filtered.bam.{bai,csi}'), emit: filtered_bam
+    tuple val(key), val(group), file('*.filtered.coverage.bedgraph.gz'), file('*.filtered.coverage.bedgraph.gz.tbi'), emit: coverage, optional: true
     path "versions.yml", emit: versions
 
-    script:
+    script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
     final_name = bam_file.name.replace(".bam", ".filtered.bam")
+    index_param = bam_index ? "--index $bam_index" : ""
+    depth_param = params.max_read_depth ? "--max_depth ${params.max_read_depth}" : ""
 
     """
-    samtools view -b -L $regions $bam_file > $final_name
+    filter_bam_regions.py \
+        --bam $bam_file \
+        $index_param \
+        --regions $regions \
+        --output $final_name \
+        --threads $task.cpus $depth_param
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
-        samtools: \$(samtools --version | sed 's/samtools //g' | head -1)
+        python: \$(python --version | sed 's/Python //g')
+        pysam: \$(python -c "import pysam; print(pysam.__version__)")
     END_VERSIONS
     """
 }
 
 process FILTER_VCF_REGIONS {
 
-    tag "$samplesheet"
+    tag "$key"
 
-    conda (params.enable_conda ? "conda-forge::python=3.8.3" : null)
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
         'docker.io/raphsoft/reveal:1.0' }"
 
     input:
-    tuple val(label), file(vcf_file)
-    file regions
+    tuple val(key), val(group), file(vcf_file), file(vcf_index), file(regions)
 
     output:
-    tuple val(label), file('*.filtered.vcf'), emit: filtered_vcf
+    tuple val(key), val(group), file('*.filtered.vcf.gz'), file('*.filtered.vcf.gz.tbi'), emit: filtered_vcf
     path "versions.yml", emit: versions
 
-    script:
-    final_name = vcf_file.name.replace(".vcf", ".filtered.vcf")
+    script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
+    final_name = vcf_file.name.replaceAll(/\.vcf(\.gz)?$/, ".filtered.vcf.gz")
+    index_param = vcf_index ? "--index $vcf_index" : ""
 
     """
-    bedtools intersect -a $vcf_file -b $regions -header > $final_name
-
-    # Get first variant from VCF if filtered file doesn't contain variants
-    if [ -s \$(bcftools view -H $final_name) ]; then
-        head -n \$((\$(bcftools view -h $final_name | wc -l) + 1)) $vcf_file > $final_name
-    fi
+    filter_vcf_regions.py \
+        --vcf $vcf_file \
+        $index_param \
+        --regions $regions \
+        --output $final_name
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
-        bedtools: \$(bedtools --version | sed 's/bedtools //g')
+        python: \$(python --version | sed 's/Python //g')
+        pysam: \$(python -c "import pysam; print(pysam.__version__)")
     END_VERSIONS
     """
 }
@@ -0,0 +1,34 @@
+process PACK_SNAPSHOTS {
+
+    tag "$job"
+
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
+        'docker.io/raphsoft/reveal:1.0' }"
+
+    input:
+    tuple val(job), path(captures, stageAs: 'captures/*'), val(prefixes) // snapshots of one render task, prefixes: [prefix1, prefix2]
+
+    output:
+    tuple val(job), path('snapshots_*.tar'), emit: archives
+    tuple val(job), path('*_index.csv')    , emit: index
+    path '*.metrics.json'     , emit: metrics
+    path "versions.yml"       , emit: versions
+
+    script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
+    prefixes_param=prefixes.toString().replace("[", "").replace("]", "").replace("," ,"")
+    """
+    snapshot_archive.py --metrics-out pack_${task.index}.metrics.json pack \\
+        --captures captures \\
+        --output_prefix snapshots_${job}_${task.index} \\
+        --index snapshots_${job}_${task.index}_index.csv \\
+        --chunk_mb ${params.snapshot_archive_mb} \\
+        --prefixes $prefixes_param
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+    END_VERSIONS
+    """
+}
@@ -0,0 +1,36 @@
+process RENDER_SNAPSHOTS {
+
+    tag "$job $group"
+    label 'process_medium'
+
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
+        'docker.io/raphsoft/reveal:1.0' }"
+
+    input:
+    path reference
+    path fai
+    tuple val(job), val(group), path(batch), path(tracks), val(tracks_with_labels) // String: [label1:path1:index1, label2:path2]
+
+    output:
+    tuple val(job), path("captures/**.png"), emit: captures
+    path "versions.yml" , emit: versions
+
+    script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
+    tracks_param=tracks_with_labels.toString().replace("[", "").replace("]", "").replace("," ,"")
+    """
+    render_snapshots.py \\
+        --reference $reference \\
+        --tracks_with_labels $tracks_param \\
+        --batch $batch \\
+        --processes $task.cpus
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+        pysam: \$(python -c "import pysam; print(pysam.__version__)")
+        numpy: \$(python -c "import numpy; print(numpy.__version__)")
+    END_VERSIONS
+    """
+}
@@ -2,7 +2,7 @@ process SAMPLESHEET_CHECK {
 
     tag "$samplesheet"
 
-    conda (params.enable_conda ? "conda-forge::python=3.8.3" : null)
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
         'docker.io/raphsoft/reveal:1.0' }"
@@ -11,12 +11,14 @@ process SAMPLESHEET_CHECK {
     path samplesheet
 
     output:
-    path '*.csv'       , emit: csv
+    path 'reveal_params.csv'    , emit: csv
+    path 'reveal_work_graph.csv', emit: work_graph
+    path '*.metrics.json'       , emit: metrics
     path "versions.yml", emit: versions
 
     script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
     """
-    input_parser.py --file_in=$samplesheet --reference=${params.fasta}
+    input_parser.py --metrics-out input_parser.metrics.json --file_in=$samplesheet --reference=${params.fasta}
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
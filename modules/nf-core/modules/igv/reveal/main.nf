@@ -1,35 +1,81 @@
+process PLAN_SNAPSHOTS {
+
+    tag "$job"
+
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
+        'docker.io/raphsoft/reveal:1.0' }"
+
+    input:
+    tuple val(job), path(tracks), val(tracks_with_labels), path(regions), val(regions_with_prefixes), path(slops) // tracks: track files and their indexes, tracks_with_labels: [label1:path1:index1, label2:path2]
+    path fai
+
+    output:
+    tuple val(job), path('snapshots_plan.json'), emit: plan
+    path '*.metrics.json'     , emit: metrics
+    path "versions.yml"       , emit: versions
+
+    script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
+    tracks_param=tracks_with_labels.toString().replace("[", "").replace("]", "").replace("," ,"")
+    regions_param=regions_with_prefixes.toString().replace("[", "").replace("]", "").replace("," ,"")
+    fai_param=fai ? "--fai $fai" : ""
+    """
+    igv_with_reveal.py --metrics-out plan.metrics.json plan \
+        --tracks_with_labels $tracks_param \
+        --regions_with_prefixes $regions_param \
+        --slops \$(cat $slops | xargs) \
+        --task_seconds ${params.plan_task_seconds} $fai_param
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+        pysam: \$(python -c "import pysam; print(pysam.__version__)")
+    END_VERSIONS
+    """
+}
+
 process GENERATE_IGV_FILES {
 
-    tag "$samplesheet"
+    tag "$job"
 
-    conda (params.enable_conda ? "conda-forge::python=3.8.3" : null)
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
         'docker.io/raphsoft/reveal:1.0' }"
 
     input:
-    val tracks_with_labels // String: [label1:path1, label2:path2]
-    val regions_with_prefixes
-    path actual_regions
-    path slops
+    // tracks_with_labels: [label1:path1:index1, label2:path2], plan: resource hint of PLAN_SNAPSHOTS, empty when
+    // not planned, group_windows: windows of the region groups, only used with params.region_groups
+    tuple val(job), val(tracks_with_labels), val(regions_with_prefixes), path(actual_regions), path(slops), val(plan), path(group_windows)
+    path fai
 
     output:
-    path 'igv.session.xml'    , emit: session
-    path 'snapshots_*.txt'    , emit: batch
+    tuple val(job), path('igv.session*.xml')   , emit: session   // the full session, then one per rendering profile
+    tuple val(job), path('snapshots_*.txt')    , emit: batch
+    tuple val(job), path('shards_manifest.csv'), emit: manifest, optional: true
+    path '*.metrics.json'     , emit: metrics
     path "versions.yml" , emit: versions
 
     script: // This script is bundled with the pipeline, in nf-core/reveal/bin/
     tracks_param=tracks_with_labels.toString().replace("[", "").replace("]", "").replace("," ,"")
     regions_param=regions_with_prefixes.toString().replace("[", "").replace("]", "").replace("," ,"")
+    shards_param=params.igv_shards ? "--shards ${params.igv_shards}" : ""
+    shards_param+=params.max_snapshots_per_shard ? " --max_snapshots_per_shard ${params.max_snapshots_per_shard}" : ""
+    shards_param=shards_param ?: (plan.shards ? "--shards ${plan.shards}" : "")
+    fai_param=fai ? "--fai $fai" : ""
+    schedule_param=params.schedule_snapshots ? "--schedule" : ""
+    groups_param=params.region_groups ? "--groups $group_windows" : ""
+    zoom_param=params.squished_window ? "squished=${params.squished_window}" : ""
+    zoom_param+=params.coverage_window ? " coverage=${params.coverage_window}" : ""
+    zoom_param=zoom_param ? "--zoom_windows $zoom_param" : ""
     """
-    igv_with_reveal.py build-session \
+    igv_with_reveal.py --metrics-out generate_all.metrics.json generate-all \
         --reference=${file(params.fasta).name} \
-        --tracks_with_labels $tracks_param > igv.session.xml
-
-    igv_with_reveal.py build-batch \
+        --tracks_with_labels $tracks_param \
         --regions_with_prefixes $regions_param \
         --slops \$(cat $slops | xargs) \
-        --snapshots_dir=captures
+        --snapshots_dir=captures/${job} $shards_param $fai_param $schedule_param $groups_param $zoom_param
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
@@ -40,38 +86,54 @@ process GENERATE_IGV_FILES {
 
 process IGV_SNAPSHOTS {
 
-    tag "$samplesheet"
+    tag "$job $group"
+
+    // Sized by the resource plan when there is one, each IGV worker getting the planned heap
+    memory { plan.memory_mb ? "${plan.memory_mb * (params.igv_workers ?: 1) * task.attempt} MB" : 6.GB * task.attempt }
+    time   { plan.task_seconds ? "${Math.ceil(plan.task_seconds * 2 * task.attempt) as long}s" : 4.h * task.attempt }
 
-    conda (params.enable_conda ? "conda-forge::python=3.8.3" : null)
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::pyyaml=6.0 conda-forge::jsonschema=2.6.0 bioconda::pysam=0.19.1 conda-forge::numpy=1.21.6" : null)
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
         'https://github.com/gariem/singularity-reveal/releases/download/22.11.14/gariem-singularity-reveal.latest.sif' :
         'docker.io/raphsoft/reveal:1.0' }"
 
-    stageInMode 'copy'
-
     input:
     file reference
-    file tracks
-    file igv_session
-    file igv_batch
-    file igv_preferences
-
+    tuple val(job), val(group), file(igv_batch), file(tracks), file(igv_sessions), file(igv_preferences), val(track_keys), val(plan) // igv_sessions: the full session and the ones the batch loads for its rendering profiles, track_keys: keys of the tracks of the job (reveal_params.csv), plan: resource hint of PLAN_SNAPSHOTS, empty when not planned
 
     output:
-    path "captures/*.png", emit: captures
+    tuple val(job), path("captures/**.png"), emit: captures
+    path "*.{tsv,metrics.json}", emit: metrics, optional: true
     path "versions.yml" , emit: versions
 
     script:
+    igv_version = '2.12.2'
+    sessions = [igv_sessions].flatten().sort { it.name }
+    igv_session = sessions.find { it.name == 'igv.session.xml' }
+    cache_filter = params.snapshot_cache ? "igv_with_reveal.py filter-cached --batch snapshots.txt --cache_dir ${params.snapshot_cache} --context_files ${sessions.join(' ')} $igv_preferences --track_keys ${track_keys.join(' ')} --data_files $reference --igv_version $igv_version --output snapshots.pending.txt && mv snapshots.pending.txt snapshots.txt" : ""
+    cache_store = params.snapshot_cache ? "trap 'igv_with_reveal.py store-cache --cache_dir ${params.snapshot_cache}' EXIT" : ""
+    igv_launch = "xvfb-run --auto-servernum -s \"-screen 0 1920x1080x24\" java -Xmx${plan.heap_mb ?: (params.igv_workers ? 32000.intdiv(params.igv_workers as int) : 32000)}m --module-path=/IGV_Linux_${igv_version}/lib --module=org.igv/org.broad.igv.ui.Main -o $igv_preferences"
     """
     echo "load $igv_session" > snapshots.txt
     cat $igv_batch >> snapshots.txt
     echo "exit" >> snapshots.txt
 
-    ls *.bam | xargs -n1 -P5 samtools index
-
-    xvfb-run --auto-servernum -s "-screen 0 1920x1080x24" java -Xmx32000m \
-        --module-path=/IGV_Linux_2.12.2/lib \
-        --module=org.igv/org.broad.igv.ui.Main -b snapshots.txt -o $igv_preferences
+    # Reuse snapshots rendered by previous runs and cache the new ones, even if IGV fails midway
+    $cache_filter
+    $cache_store
+
+    if [ "${params.igv_workers ?: 1}" -gt 1 ]; then
+        # Warm IGV instances load the session once, then receive the snapshots over their batch ports
+        igv_dispatcher.py --session $igv_session --batch snapshots.txt --workers ${params.igv_workers} \\
+            --igv_command '$igv_launch -p {port}' --log_dir .
+    else
+        set -o pipefail
+        $igv_launch -b snapshots.txt 2>&1 | tee igv_batch.log
+    fi
+
+    # Time every snapshot from the IGV logs, to find slow loci
+    metrics.py --metrics-out snapshots_${task.index}.metrics.json igv-log \\
+        --log igv*.log --output snapshot_latency_${task.index}.tsv || true
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
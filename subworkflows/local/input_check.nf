@@ -3,6 +3,7 @@
 //
 
 include { SAMPLESHEET_CHECK } from '../../modules/local/samplesheet_check'
+include { DELTA_REGIONS } from '../../modules/local/delta_regions'
 
 workflow INPUT_CHECK {
     take:
@@ -14,45 +15,86 @@ workflow INPUT_CHECK {
         .splitCsv ( header:true, sep:',' )
         .map { row -> create_meta_channel(row) }
         .collect()
-        .map { create_final_channel(it) }
-        .set { reveal }
+        .flatMap { create_job_channel(it) }
+        .set { jobs }
 
     emit:
-    reveal                                      // channel:  [reference:val, regions:val, slops:val, preferences:val, tracks:[label:val, file:val]]
-    versions = SAMPLESHEET_CHECK.out.versions   // channel: [ versions.yml ]
+    jobs                                        // channel:  [name:val, reference:val, regions:val, slops:val, preferences:val, tracks:[label:val, file:val, index:val, key:val]], one per job
+    work_graph = SAMPLESHEET_CHECK.out.work_graph   // file: reveal_work_graph.csv, one row per distinct track filter
+    versions = SAMPLESHEET_CHECK.out.versions       // channel: [ versions.yml ]
+}
+
+workflow DELTA_JOBS {
+    take:
+    jobs // [name: 'abc', regions: [[prefix: 'abc', file: file.(bed)]], tracks: [[key: 'abc', ...]], ...], one per job
+
+    main:
+    DELTA_REGIONS (
+        jobs.map { job -> tuple(job.name, job.regions.collect { entry -> entry.prefix + ":" + entry.file.name }, job.regions*.file) }
+    )
+
+    // Every job keeps the regions appended since the last run, the jobs without any are left out
+    jobs.map { job -> tuple(job.name, job) }
+        .join(DELTA_REGIONS.out.regions)
+        .map { name, job, delta_files ->
+            def appended = [delta_files].flatten().collectEntries { file -> [file.name, file] }
+            def regions = job.regions
+                .collect { entry -> [prefix: entry.prefix, file: appended[entry.file.name]] }
+                .findAll { entry -> entry.file.size() > 0 }
+            // The windows of the appended regions are particular to the job, so are the slices of its tracks
+            def tracks = job.tracks.collect { entry -> entry + [key: entry.key + "_" + job.name] }
+            return job + [regions: regions, tracks: tracks]
+        }
+        .filter { job -> job.regions }
+        .set { delta_jobs }
+
+    emit:
+    jobs = delta_jobs                       // channel: as the jobs taken, with the appended regions only
+    state = DELTA_REGIONS.out.state         // channel: [job, <job>.delta.json], to save once the snapshots exist
+    versions = DELTA_REGIONS.out.versions   // channel: [ versions.yml ]
 }
 
 def create_meta_channel(LinkedHashMap row) {
     def meta = [:]
     meta.type = row.type
+    meta.job = row.job
     if ( meta.type == "track" || meta.type == "region" ) {
         meta.label = row.label
     }
     meta.value = file(row.value)
+    if ( meta.type == "track" ) {
+        // Index next to the track and newer than it, found by the samplesheet check
+        meta.index = row.index ? file(row.index) : []
+        // Hash of the track and the windows of its job, shared by the jobs filtering the same data
+        meta.key = row.key
+    }
     return meta
 }
 
-def create_final_channel(collected_entries){
-    def meta = [:]
-    def tracks = []
-    def regions = []
+def create_job_channel(collected_entries){
+    def reference = collected_entries.find { entry -> entry.type == "reference" }.value
+    def jobs = [:]
     for (entry in collected_entries){
+        if (entry.type == "reference") {
+            continue
+        }
+        def meta = jobs.get(entry.job)
+        if (meta == null) {
+            meta = [name: entry.job, reference: reference, tracks: [], regions: []]
+            jobs[entry.job] = meta
+        }
         switch(entry.type){
-            case "reference": meta.reference = entry.value
-                break;
             case "region":
-                regions.add([prefix: entry.label, file: entry.value])
+                meta.regions.add([prefix: entry.label, file: entry.value])
                 break;
             case "slops": meta.slops = entry.value
                 break;
             case "preferences": meta.preferences = entry.value
                 break;
             case "track":
-                tracks.add([label: entry.label, file: entry.value])
+                meta.tracks.add([label: entry.label, file: entry.value, index: entry.index, key: entry.key])
                 break;
         }
     }
-    meta.tracks = tracks
-    meta.regions = regions
-    return meta
+    return jobs.values() as List
 }
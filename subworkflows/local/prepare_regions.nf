@@ -1,60 +1,123 @@
 include { EXPAND_REGIONS } from '../../modules/local/expand_regions'
+include { GROUP_REGIONS } from '../../modules/local/expand_regions'
 include { FILTER_BAM_REGIONS } from '../../modules/local/filter_regions'
 include { FILTER_VCF_REGIONS } from '../../modules/local/filter_regions'
+include { COMPUTE_COVERAGE } from '../../modules/local/coverage'
 
 workflow PREPARE_TRACKS {
 
     take:
-    tracks // [[label: 'abc', file: file.(bam|vcf|bed)]]
-    regions // [[prefix: 'abc', file: file.(bed)]]
-    slops // file: /path/to/slops.txt
+    jobs // [name: 'abc', tracks: [[label: 'abc', file: file.(bam|vcf|bed), index: file.(bai|csi|tbi) or [], key: 'abc']], regions: [[prefix: 'abc', file: file.(bed)]], slops: file], one per job
+    fai // file: /path/to/reference.fa.fai, or [] when the reference is not indexed
 
     main:
-    tracks.flatMap { entries ->
+    jobs.flatMap { job ->
         def labeled_tracks=[]
-        for (entry in entries) {
-            labeled_tracks.add(tuple(entry.label, entry.file))
+        for (entry in job.tracks) {
+            labeled_tracks.add(tuple(job.name, entry.label, entry.file, entry.index, entry.key))
         }
         return labeled_tracks
     }.branch {
-        bam: it[1].name.endsWith('.bam')
-        vcf: it[1].name.endsWith('.vcf')
-        other: !it[1].name.endsWith('.bam') && !it[1].name.endsWith('.vcf')
+        bam: it[2].name.endsWith('.bam')
+        vcf: it[2].name.endsWith('.vcf') || it[2].name.endsWith('.vcf.gz')
+        other: true
     }.set { track_files }
 
-    regions.map { entries ->
+    jobs.map { job ->
+        def prefixed_names=[]
         def region_files=[]
-        for (entry in entries) {
+        for (entry in job.regions) {
+            prefixed_names.add(entry.prefix + ":" + entry.file.name)
             region_files.add(entry.file)
         }
-        return region_files
+        return tuple(job.name, prefixed_names, region_files, job.slops)
     }
-    .set { region_files }
+    .set { job_regions }
 
-    EXPAND_REGIONS ( region_files, slops )
+    EXPAND_REGIONS ( job_regions, fai )
     .expanded_regions
     .set { expanded_regions }
 
-    FILTER_BAM_REGIONS (track_files.bam, expanded_regions)
+    // Tracks are sliced once per region group, so every render task only stages the data of its own regions.
+    // Without groups, the single group of a job is the whole set of its expanded regions.
+    if (params.region_groups) {
+        GROUP_REGIONS ( expanded_regions )
+        groups = GROUP_REGIONS.out.groups
+            .transpose()
+            .map { job, windows -> tuple(job, windows.baseName, windows) }
+        group_versions = GROUP_REGIONS.out.versions
+    } else {
+        groups = expanded_regions.map { job, windows -> tuple(job, windows.baseName, windows) }
+        group_versions = Channel.empty()
+    }
+
+    // The key of a track hashes its content and the windows of its job, so jobs sharing a key share the slices:
+    // every (key, group) is filtered once, then handed to all the jobs using the track.
+    track_files.bam
+        .combine(groups, by: 0)
+        .map { job, label, track, index, key, group, windows -> tuple(key, group, track, index, windows) }
+        .unique { entry -> entry[0..1] }
+        .set { bam_slices }
+
+    track_files.vcf
+        .combine(groups, by: 0)
+        .map { job, label, track, index, key, group, windows -> tuple(key, group, track, index, windows) }
+        .unique { entry -> entry[0..1] }
+        .set { vcf_slices }
+
+    FILTER_BAM_REGIONS (bam_slices)
     .filtered_bam
     .set { filtered_bam }
 
-    FILTER_VCF_REGIONS (track_files.vcf, expanded_regions)
+    FILTER_VCF_REGIONS (vcf_slices)
     .filtered_vcf
     .set { filtered_vcf }
 
-    regions.flatMap { entries ->
+    jobs.flatMap { job ->
         def prefixed_regions=[]
-        for (entry in entries) {
-            prefixed_regions.add(tuple(entry.prefix, entry.file))
+        for (entry in job.regions) {
+            prefixed_regions.add(tuple(job.name, entry.prefix, entry.file))
         }
         return prefixed_regions
     }.
     set {prefixed_regions}
 
+    // Coverage tracks share the label of their alignments, so IGV shows them instead of computing the coverage.
+    // Downsampled alignments get the full depth written by the filtering step.
+    if (params.precompute_coverage && !params.max_read_depth) {
+        COMPUTE_COVERAGE (
+            filtered_bam.join(bam_slices.map { key, group, track, index, windows -> tuple(key, group, windows) }, by: [0, 1])
+        )
+        bam_coverage = COMPUTE_COVERAGE.out.coverage
+        coverage_versions = COMPUTE_COVERAGE.out.versions
+    } else {
+        bam_coverage = FILTER_BAM_REGIONS.out.coverage
+        coverage_versions = Channel.empty()
+    }
+
+    // Every job gets the slices of its tracks under its own labels
+    track_files.bam
+        .map { job, label, track, index, key -> tuple(key, job, label) }
+        .combine(filtered_bam.mix(bam_coverage), by: 0)
+        .map { key, job, label, group, slice, index -> tuple(job, group, label, slice, index) }
+        .set { job_bam }
+
+    track_files.vcf
+        .map { job, label, track, index, key -> tuple(key, job, label) }
+        .combine(filtered_vcf, by: 0)
+        .map { key, job, label, group, slice, index -> tuple(job, group, label, slice, index) }
+        .set { job_vcf }
+
+    // Other tracks are small and not sliced, every group gets them whole
+    track_files.other
+        .combine(groups, by: 0)
+        .map { job, label, track, index, key, group, windows -> tuple(job, group, label, track) }
+        .set { other_tracks }
+
     emit:
-    tracks = filtered_vcf.concat(filtered_bam).concat(track_files.other)   // channel:  [alignment.filtered.(bam|vcf|bed)]
-    prefixed_regions = prefixed_regions
-    versions = EXPAND_REGIONS.out.versions.concat(FILTER_BAM_REGIONS.out.versions).concat(FILTER_VCF_REGIONS.out.versions)   // channel: [ versions.yml ]
+    tracks = job_vcf.concat(job_bam).concat(other_tracks)   // channel:  [job, group, label, alignment.filtered.(bam|vcf|bed), (index)]
+    groups = groups                     // channel: [job, group, windows.bed]
+    prefixed_regions = prefixed_regions // channel: [job, prefix, regions.bed]
+    versions = EXPAND_REGIONS.out.versions.concat(FILTER_BAM_REGIONS.out.versions).concat(FILTER_VCF_REGIONS.out.versions).concat(coverage_versions).concat(group_versions)   // channel: [ versions.yml ]
 
 }
@@ -1,42 +1,89 @@
+include { PLAN_SNAPSHOTS } from '../../modules/nf-core/modules/igv/reveal/main'
 include { GENERATE_IGV_FILES } from '../../modules/nf-core/modules/igv/reveal/main'
 include { IGV_SNAPSHOTS } from '../../modules/nf-core/modules/igv/reveal/main'
+include { RENDER_SNAPSHOTS } from '../../modules/local/render_snapshots'
+include { PACK_SNAPSHOTS } from '../../modules/local/pack_snapshots'
+
+workflow PLAN_RESOURCES {
+
+    take:
+    jobs // [name: 'abc', tracks: [[label: 'abc', file: file.(bam|vcf|bed), index: file.(bai|csi|tbi) or []]], regions: [[prefix: 'abc', file: file.(bed)]], slops: file], before filtering
+    fai // file: /path/to/reference.fa.fai, or [] when the reference is not indexed
+
+    main:
+    if (params.plan_resources) {
+        // Index statistics describe the whole tracks, so the plan is made before they are filtered
+        PLAN_SNAPSHOTS (
+            jobs.map { job -> tuple(
+                job.name,
+                job.tracks.collectMany { entry -> [entry.file, entry.index].findAll() },
+                job.tracks.collect { entry -> entry.label + ":" + [entry.file, entry.index].findAll()*.name.join(":") },
+                job.regions*.file,
+                job.regions.collect { entry -> entry.prefix + ":" + entry.file.name },
+                job.slops
+            ) },
+            fai
+        )
+        plan = PLAN_SNAPSHOTS.out.plan.map { job, plan_file -> tuple(job, new groovy.json.JsonSlurper().parse(plan_file)) }
+        versions = PLAN_SNAPSHOTS.out.versions
+    } else {
+        plan = jobs.map { job -> tuple(job.name, [:]) }
+        versions = Channel.empty()
+    }
+
+    emit:
+    plan = plan             // channel: [job, Map], the resource hint being empty when not planned
+    versions = versions     // channel: [ versions.yml ]
+}
 
 workflow PREPARE_IGV_FILES {
 
     take:
-    tracks // tuple: (label, file)
-    regions // tuple(prefix, file)
-    slops // file: /path/to/slops.txt
+    tracks // tuple: (job, group, label, file, (index))
+    regions // tuple(job, prefix, file)
+    jobs // [name: 'abc', slops: file, ...], one per job
+    fai // file: /path/to/reference.fa.fai, or [] when the reference is not indexed
+    plan // tuple(job, Map): resource hint of PLAN_RESOURCES
+    groups // tuple(job, group, windows.bed)
 
     main:
+    // Every group stages its slice of a track under the same name, so a single session serves all of them
     tracks.map{ entry ->
-        return entry[0] + ":" + entry[1].name
+        // The index is named explicitly, so IGV neither looks for it nor needs it next to the staged track
+        return tuple(entry[0], entry[2] + ":" + entry[3..-1]*.name.join(":"))
     }
-    .collect()
+    .unique()
+    .groupTuple()
     .set { local_labeled_files }
 
-    regions.map{ entry ->
-        return entry[0] + ":" + entry[1].name
+    regions.map{ job, prefix, file ->
+        return tuple(job, prefix + ":" + file.name, file)
     }
-    .collect()
+    .groupTuple()
     .set { local_prefixed_regions }
 
-    regions.map{ entry ->
-        return entry[1]
+    groups.map{ job, group, windows ->
+        return tuple(job, windows)
     }
-    .collect()
-    .set { all_region_files }
+    .groupTuple()
+    .set { group_windows }
+
+    local_labeled_files
+        .join(local_prefixed_regions)
+        .join(jobs.map { job -> tuple(job.name, job.slops) })
+        .join(plan)
+        .join(group_windows)
+        .set { job_files }
 
     GENERATE_IGV_FILES (
-        local_labeled_files,
-        local_prefixed_regions,
-        all_region_files,
-        slops
+        job_files,
+        fai
     )
 
     emit:
-    session = GENERATE_IGV_FILES.out.session
-    batch = GENERATE_IGV_FILES.out.batch
+    session = GENERATE_IGV_FILES.out.session    // channel: [job, igv.session*.xml], the full session and the rendering profiles
+    batch = GENERATE_IGV_FILES.out.batch        // channel: [job, snapshots_*.txt]
+    manifest = GENERATE_IGV_FILES.out.manifest
     versions = GENERATE_IGV_FILES.out.versions  // channel: [ versions.yml ]
 
 }
@@ -44,28 +91,90 @@ workflow PREPARE_IGV_FILES {
 workflow SNAPSHOTS {
 
     take:
-    tracks
-    igv_session
-    igv_batch
-    igv_preferences
+    tracks // tuple: (job, group, label, file, (index))
+    igv_session // tuple(job, igv.session*.xml): the full session and the ones of the rendering profiles
+    igv_batch // tuple(job, snapshots_*.txt)
+    jobs // [name: 'abc', preferences: file, ...], one per job
+    fai // file: /path/to/reference.fa.fai, or [] when the reference is not indexed
+    plan // tuple(job, Map): resource hint of PLAN_RESOURCES
+    regions // tuple(job, prefix, file)
 
     main:
 
     tracks.map{ track ->
-        return track[1]
+        // Track file followed by its index, when it has one
+        return tuple(track[0..1], track[3..-1])
+    }
+    .groupTuple()
+    .map { scope, files -> tuple(scope[0], scope[1], files.flatten()) }
+    .set { group_tracks }
+
+    // Each group, or else each shard, is rendered by its own task, otherwise all batch files of a job go to a
+    // single task. A task only stages the tracks sliced to its group.
+    if (params.region_groups) {
+        igv_batch.transpose()
+            .map { job, batch -> tuple(job, batch.baseName - 'snapshots_', batch) }
+            .combine(group_tracks, by: [0, 1])
+            .set { batch_groups }
+    } else {
+        if (params.igv_shards || params.max_snapshots_per_shard || params.plan_resources) {
+            igv_batch.transpose().set { batches }
+        } else {
+            igv_batch.set { batches }
+        }
+        batches.combine(group_tracks, by: 0)
+            .map { job, batch, group, files -> tuple(job, group, batch, files) }
+            .set { batch_groups }
+    }
+
+    if (params.backend == 'native') {
+        tracks.map{ entry ->
+            return tuple(entry[0], entry[2] + ":" + entry[3..-1]*.name.join(":"))
+        }
+        .unique()
+        .groupTuple()
+        .set { local_labeled_files }
+
+        RENDER_SNAPSHOTS (
+            file(params.fasta),
+            fai,
+            batch_groups.combine(local_labeled_files, by: 0)
+        )
+        captures = RENDER_SNAPSHOTS.out.captures
+        versions = RENDER_SNAPSHOTS.out.versions
+    } else {
+        IGV_SNAPSHOTS (
+            file(params.fasta),
+            batch_groups
+                .combine(igv_session, by: 0)
+                // The track keys, and the downsampling of the alignments, identify the staged data in the snapshots cache
+                .combine(jobs.map { job ->
+                    tuple(job.name, job.preferences, job.tracks*.key + (params.max_read_depth ? ["max_read_depth=${params.max_read_depth}"] : []))
+                }, by: 0)
+                .combine(plan, by: 0)
+        )
+        captures = IGV_SNAPSHOTS.out.captures
+        versions = IGV_SNAPSHOTS.out.versions
+    }
+
+    // The snapshots of every render task are packed into archives, published instead of the loose images,
+    // and the indexes of the tasks of a job are merged into one
+    if (params.pack_snapshots) {
+        PACK_SNAPSHOTS (
+            captures.combine(regions.map { job, prefix, file -> tuple(job, prefix) }.groupTuple(), by: 0)
+        )
+        PACK_SNAPSHOTS.out.index
+            .collectFile(keepHeader: true, skip: 1, sort: true, storeDir: "${params.outdir}/pack") { job, index ->
+                [ "${job}.snapshots_index.csv", index ]
+            }
+            .set { snapshots_index }
+        versions = versions.mix(PACK_SNAPSHOTS.out.versions)
+    } else {
+        snapshots_index = Channel.empty()
     }
-    .collect()
-    .set {final_tracks}
-
-    IGV_SNAPSHOTS (
-        file(params.fasta),
-        final_tracks,
-        igv_session,
-        igv_batch,
-        igv_preferences
-    )
 
     emit:
-    snapshots = IGV_SNAPSHOTS.out.captures
-    versions = IGV_SNAPSHOTS.out.versions
+    snapshots = captures.map { job, images -> images }.collect()
+    snapshots_index = snapshots_index   // file: <job>.snapshots_index.csv, with params.pack_snapshots
+    versions = versions
 }
@@ -0,0 +1,68 @@
+"""
+Compare the columnar region table with the former per-row path of build-batch.
+
+Usage: python test/benchmark/benchmark_region_table.py [--regions 1000000] [--slops 50 500 1000 5000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'bin'))
+
+from intervals import clamp  # noqa: E402
+from intervals import read_bed  # noqa: E402
+from region_table import RegionTable  # noqa: E402
+
+
+def write_regions(path, regions):
+    random.seed(0)
+    with open(path, 'w') as bed_file:
+        bed_file.write("track name=benchmark\n")
+        for _ in range(regions):
+            start = random.randrange(0, 200000000)
+            bed_file.write(f"chr{random.randint(1, 22)}\t{start}\t{start + random.randint(1, 1000)}\n")
+
+
+def per_row(path, slops, output):
+    with open(output, 'w', buffering=1024 * 1024) as batch_file:
+        for contig, start, end in read_bed(path):
+            for value in slops:
+                window_start, window_end = clamp(contig, start - value, end + value)
+                batch_file.write(f'goto {contig}:{window_start}-{window_end}\n'
+                                 f'snapshot A_{contig}_{start}_{end}_slop{value}.png\n')
+
+
+def columnar(path, slops, output):
+    with open(output, 'w', buffering=1024 * 1024) as batch_file:
+        for table in RegionTable.read_bed(path, 'A_', {}, {}):
+            batch_file.write(table.batch_commands(slops))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--regions", type=int, default=1000000)
+    parser.add_argument("--slops", type=int, nargs='+', default=[50, 500, 1000, 5000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        bed = os.path.join(temp_dir, "regions.bed")
+        write_regions(bed, args.regions)
+
+        timings = {}
+        for name, function in (("per-row", per_row), ("columnar", columnar)):
+            started = time.perf_counter()
+            function(bed, args.slops, os.path.join(temp_dir, f"{name}.txt"))
+            timings[name] = time.perf_counter() - started
+            print(f"{name:>9}: {timings[name]:.2f}s ({args.regions / timings[name]:.0f} regions/sec)")
+
+        with open(os.path.join(temp_dir, "per-row.txt")) as expected, \
+                open(os.path.join(temp_dir, "columnar.txt")) as actual:
+            assert expected.read() == actual.read(), "Batch commands differ"
+        print(f"  speedup: {timings['per-row'] / timings['columnar']:.1f}x, identical output")
+
+
+if __name__ == "__main__":
+    main()
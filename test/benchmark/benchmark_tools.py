@@ -0,0 +1,214 @@
+"""
+Time the bin/ tools on synthetic workloads and record their peak memory, writing the results as JSON.
+
+Usage: python test/benchmark/benchmark_tools.py --output results.json [--compare baseline.json]
+
+Every case runs `--repeat` times for timing, then once more under tracemalloc for the peak of Python (and NumPy)
+allocations, so tracing does not distort the timings. Comparing with the JSON of another commit prints the ratio
+of every case present in both.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextlib import redirect_stdout
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'bin')
+sys.path.insert(0, BIN_DIR)
+
+from igv_with_reveal import IGVSessionBuilder  # noqa: E402
+from igv_with_reveal import SnapshotsCommandBuilder  # noqa: E402
+from input_parser import InputParser  # noqa: E402
+
+CONTIGS = [(f"chr{number}", 250000000 - number * 8000000) for number in range(1, 23)]
+TRACK_TYPES = (".bam", ".vcf.gz", ".bed")
+
+
+def write_regions(path, regions, seed):
+    """Write random regions of 1 bp to 10 kbp over human sized contigs."""
+    generator = random.Random(seed)
+    with open(path, 'w') as bed_file:
+        for _ in range(regions):
+            contig, length = generator.choice(CONTIGS)
+            start = generator.randrange(0, length - 10000)
+            bed_file.write(f"{contig}\t{start}\t{start + generator.randint(1, 10000)}\n")
+
+
+def write_fai(path):
+    with open(path, 'w') as fai_file:
+        for contig, length in CONTIGS:
+            fai_file.write(f"{contig}\t{length}\t0\t60\t61\n")
+
+
+def make_tracks(directory, count):
+    """Create empty track files cycling through BAM, VCF and BED, returning them as label:path."""
+    tracks = []
+    for number in range(count):
+        path = os.path.join(directory, f"track_{number}{TRACK_TYPES[number % len(TRACK_TYPES)]}")
+        open(path, 'w').close()
+        tracks.append(f"Track {number}:{path}")
+    return tracks
+
+
+def write_samplesheet(path, tracks, regions, slops):
+    """Write a samplesheet in YAML (a JSON document being valid YAML)."""
+    samplesheet = {"reveal": {
+        "tracks": [{"name": track.split(':')[0], "path": track.split(':')[1]} for track in tracks],
+        "capture": {
+            "regions": [{"path": region, "prefix": f"P{number}_"} for number, region in enumerate(regions)],
+            "slops": slops,
+            "igvOptions": [{"option": "SAM.SHOW_SOFT_CLIPPED", "value": "true"}],
+        },
+    }}
+    with open(path, 'w') as samplesheet_file:
+        json.dump(samplesheet, samplesheet_file)
+
+
+@contextmanager
+def working_directory(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def measure(function, repeat):
+    """Return the timings of every run and the peak traced memory of one more run."""
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def snapshots_cases(work_dir, sizes, slops, prefixes):
+    fai = os.path.join(work_dir, "genome.fa.fai")
+    write_fai(fai)
+    for size in sizes:
+        regions = []
+        for number in range(prefixes):
+            path = os.path.join(work_dir, f"regions_{size}_{number}.bed")
+            write_regions(path, size // prefixes, seed=number)
+            regions.append(f"P{number}_:{path}")
+
+        for schedule in (False, True):
+            def build(regions=regions, schedule=schedule):
+                SnapshotsCommandBuilder(regions, slops, "captures", fai=fai, schedule=schedule).build()
+            yield "SnapshotsCommandBuilder.build", {"regions": size, "slops": len(slops), "prefixes": prefixes,
+                                                    "schedule": schedule}, build
+
+
+def session_cases(work_dir, track_counts):
+    for count in track_counts:
+        tracks = make_tracks(work_dir, count)
+
+        def build(tracks=tracks):
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                IGVSessionBuilder("genome.fa", tracks).build()
+        yield "IGVSessionBuilder.build", {"tracks": count}, build
+
+
+def input_parser_cases(work_dir, track_counts, slops, prefixes):
+    reference = os.path.join(work_dir, "genome.fa")
+    open(reference, 'w').close()
+    regions = []
+    for number in range(prefixes):
+        path = os.path.join(work_dir, f"samplesheet_regions_{number}.bed")
+        write_regions(path, 1000, seed=number)
+        regions.append(path)
+
+    for count in track_counts:
+        samplesheet = os.path.join(work_dir, f"samplesheet_{count}.yaml")
+        write_samplesheet(samplesheet, make_tracks(work_dir, count), regions, slops)
+
+        def build(samplesheet=samplesheet):
+            InputParser(samplesheet, reference).build()
+        yield "InputParser.build", {"tracks": count, "regions": prefixes}, build
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BIN_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result):
+    return result["benchmark"], json.dumps(result["parameters"], sort_keys=True)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = {case_key(result): result for result in json.load(baseline_file)["results"]}
+    print(f"\nCompared with {baseline_path} (time and memory ratios, below 1 is better)")
+    for result in results:
+        previous = baseline.get(case_key(result))
+        if previous:
+            print(f"{result['benchmark']} {result['parameters']}: "
+                  f"time x{result['seconds'] / previous['seconds']:.2f}, "
+                  f"memory x{result['peak_memory_bytes'] / max(1, previous['peak_memory_bytes']):.2f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file receiving the results")
+    parser.add_argument("--compare", help="JSON results of another commit to compare with")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help="Number of regions of the build-batch cases (up to 10000000)")
+    parser.add_argument("--track_counts", type=int, nargs='+', default=[10, 100, 500],
+                        help="Number of tracks of the session and samplesheet cases")
+    parser.add_argument("--slops", type=int, nargs='+', default=[50, 500, 1000, 5000])
+    parser.add_argument("--prefixes", type=int, default=4, help="Number of region files the regions are split into")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case, the fastest being reported")
+    parser.add_argument("--benchmarks", nargs='+', choices=("snapshots", "session", "input_parser"),
+                        default=["snapshots", "session", "input_parser"])
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output)
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir, working_directory(work_dir):
+        cases = []
+        if "snapshots" in args.benchmarks:
+            cases.append(snapshots_cases(work_dir, args.sizes, args.slops, args.prefixes))
+        if "session" in args.benchmarks:
+            cases.append(session_cases(work_dir, args.track_counts))
+        if "input_parser" in args.benchmarks:
+            cases.append(input_parser_cases(work_dir, args.track_counts, args.slops, args.prefixes))
+
+        for benchmark_cases in cases:
+            for benchmark, parameters, function in benchmark_cases:
+                seconds, peak = measure(function, args.repeat)
+                results.append({"benchmark": benchmark, "parameters": parameters, "seconds": min(seconds),
+                                "runs": seconds, "peak_memory_bytes": peak})
+                print(f"{benchmark} {parameters}: {min(seconds):.3f}s, peak {peak / 2 ** 20:.1f} MiB")
+
+    with open(output, 'w') as output_file:
+        json.dump({"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+                   "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "results": results}, output_file, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from bin.batch_io import parse_locus
+from bin.batch_io import read_snapshot_jobs
+
+
+class TestBatchIO(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+        (self.path / "batch.txt").write_text("snapshotDirectory captures\n"
+                                             "goto chr1:50-250\nsnapshot genes_slop50.png\n"
+                                             "load session_full.xml\n"
+                                             "goto HLA-A*01:01:01:01:0-1000\nsnapshot genes_slop100.png\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test__parse_locus__contig_with_colons(self):
+        self.assertEqual(parse_locus("HLA-A*01:01:01:01:0-1000"), ("HLA-A*01:01:01:01", 0, 1000))
+
+    def test__read_snapshot_jobs(self):
+        jobs = list(read_snapshot_jobs([self.path / "batch.txt"]))
+        self.assertEqual(jobs, [("chr1", 50, 250, "captures/genes_slop50.png"),
+                                ("HLA-A*01:01:01:01", 0, 1000, "captures/genes_slop100.png")])
+
+    def test__read_snapshot_jobs__with_sessions(self):
+        sessions = [job[4] for job in read_snapshot_jobs([self.path / "batch.txt"], sessions=True)]
+        self.assertEqual(sessions, [None, "session_full.xml"])
+
+    def test__read_snapshot_jobs__session_reset_by_batch(self):
+        (self.path / "next.txt").write_text("snapshotDirectory captures\ngoto chr1:0-10\nsnapshot next.png\n")
+        jobs = list(read_snapshot_jobs([self.path / "batch.txt", self.path / "next.txt"], sessions=True))
+        self.assertEqual([job[4] for job in jobs], [None, "session_full.xml", None])
@@ -0,0 +1,78 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+import pysam
+
+from bin.coverage import CoverageBuilder
+from bin.coverage import WindowCoverage
+from bin.coverage import runs
+
+header = {'HD': {'VN': '1.6', 'SO': 'coordinate'}, 'SQ': [{'SN': 'chr1', 'LN': 10000}]}
+
+# (name, start, cigar)
+reads = [
+    ("left", 100, "100M"),
+    ("deletion", 150, "50M20D50M"),
+    ("spanning", 280, "40M"),
+    ("duplicate", 300, "50M"),
+]
+
+
+class TestWindowCoverage(TestCase):
+
+    def test__depths__match_per_base_count(self):
+        generator = np.random.default_rng(1)
+        windows = [(100, 300), (300, 350), (1000, 1500)]
+        block_starts = generator.integers(0, 1600, 500)
+        block_ends = block_starts + generator.integers(1, 200, 500)
+
+        coverage = WindowCoverage(windows)
+        coverage.add(block_starts[:200], block_ends[:200])
+        coverage.add(block_starts[200:], block_ends[200:])
+
+        for (start, depth), (window_start, window_end) in zip(coverage.depths(), windows):
+            positions = np.arange(window_start, window_end)[:, None]
+            expected = ((block_starts <= positions) & (positions < block_ends)).sum(axis=1)
+            self.assertEqual(start, window_start)
+            np.testing.assert_array_equal(depth, expected)
+
+    def test__runs__binned(self):
+        self.assertEqual(list(runs(100, np.array([0, 0, 2, 4, 4]), bin_size=2)), [(102, 104, 3.0), (104, 105, 4.0)])
+
+
+class TestCoverageBuilder(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+        with pysam.AlignmentFile(str(self.path / "sample.bam"), 'wb', header=header) as bam:
+            for name, start, cigar in reads:
+                read = pysam.AlignedSegment(bam.header)
+                read.query_name = name
+                read.reference_id = 0
+                read.reference_start = start
+                read.cigarstring = cigar
+                read.query_sequence = 'A' * read.query_alignment_length
+                read.is_duplicate = name == "duplicate"
+                bam.write(read)
+        pysam.index(str(self.path / "sample.bam"))
+        (self.path / "regions.bed").write_text("chr1\t90\t300\nchr1\t310\t400\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test__build__indexed_bedgraph(self):
+        path = CoverageBuilder(str(self.path / "sample.bam"), str(self.path / "regions.bed"),
+                               str(self.path / "sample.coverage")).build()
+
+        self.assertEqual(path, str(self.path / "sample.coverage.bedgraph.gz"))
+        with pysam.TabixFile(path) as bedgraph:
+            self.assertEqual(list(bedgraph.fetch("chr1", 0, 10000)), [
+                "chr1\t100\t150\t1",
+                "chr1\t150\t200\t2",
+                "chr1\t220\t270\t1",
+                "chr1\t280\t300\t1",
+                "chr1\t310\t320\t1",
+            ])
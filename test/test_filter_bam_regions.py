@@ -0,0 +1,126 @@
+import gzip
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import pysam
+
+from bin.filter_bam_regions import BamRegionsExtractor
+from bin.filter_bam_regions import ReadSampler
+from bin.filter_bam_regions import find_index
+
+header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+          'SQ': [{'SN': 'chr1', 'LN': 10000}, {'SN': 'chr2', 'LN': 10000}]}
+
+# (name, contig, start), reads are 100 bp long
+reads = [
+    ("before", "chr1", 100),
+    ("spanning", "chr1", 950),
+    ("inside", "chr1", 1200),
+    ("between", "chr1", 2050),
+    ("other_contig", "chr2", 500),
+    ("after", "chr2", 5000),
+]
+
+
+def write_bam(path, records, mates=None):
+    with pysam.AlignmentFile(path, 'wb', header=header) as bam:
+        for name, contig, start in records:
+            read = pysam.AlignedSegment(bam.header)
+            read.query_name = name
+            read.reference_name = contig
+            read.reference_start = start
+            if mates:
+                read.is_paired = True
+                read.next_reference_id = read.reference_id
+                read.next_reference_start = mates[name, start]
+            read.cigarstring = '100M'
+            read.query_sequence = 'A' * 100
+            read.query_qualities = pysam.qualitystring_to_array('I' * 100)
+            read.mapping_quality = 60
+            bam.write(read)
+
+
+class TestBamRegionsExtractor(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+        write_bam(str(self.path / "sample.bam"), reads)
+        (self.path / "regions.bed").write_text("chr1\t900\t1000\nchr1\t1020\t2000\nchr2\t400\t600\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _extract(self, threads=1):
+        output = str(self.path / "sample.filtered.bam")
+        index = BamRegionsExtractor(str(self.path / "sample.bam"), str(self.path / "regions.bed"),
+                                    output, threads=threads).build()
+        with pysam.AlignmentFile(output, 'rb', index_filename=index) as bam:
+            return index, [read.query_name for read in bam.fetch()]
+
+    def test__build__indexes_missing_input_index(self):
+        self.assertIsNone(find_index(str(self.path / "sample.bam")))
+        self._extract()
+        self.assertEqual(find_index(str(self.path / "sample.bam")), str(self.path / "sample.bam.bai"))
+
+    def test__build__reads_in_windows_once_and_sorted(self):
+        index, names = self._extract(threads=2)
+        self.assertEqual(index, str(self.path / "sample.filtered.bam.bai"))
+        self.assertEqual(names, ["spanning", "inside", "other_contig"])
+
+    def test__build__downsamples_pairs_deterministically(self):
+        # 2000 pairs piled up on chr1:1000-1300, mates 200 bp apart
+        pairs = [(f"pair_{number}", 1000 + number % 10) for number in range(2000)]
+        records = sorted([(name, "chr1", start) for name, start in pairs] +
+                         [(name, "chr1", start + 200) for name, start in pairs], key=lambda record: record[2])
+        mates = {}
+        for name, start in pairs:
+            mates[name, start], mates[name, start + 200] = start + 200, start
+        write_bam(str(self.path / "deep.bam"), records, mates)
+        pysam.index(str(self.path / "deep.bam"))
+        (self.path / "deep.bed").write_text("chr1\t900\t1400\n")
+
+        kept = []
+        for run in range(2):
+            output = str(self.path / f"deep_{run}.filtered.bam")
+            BamRegionsExtractor(str(self.path / "deep.bam"), str(self.path / "deep.bed"), output,
+                                max_depth=20).build()
+            with pysam.AlignmentFile(output, 'rb') as bam:
+                kept.append([(read.query_name, read.reference_start) for read in bam.fetch()])
+
+        self.assertEqual(kept[0], kept[1])
+        self.assertLess(len(kept[0]), 200)
+        names = [name for name, _ in kept[0]]
+        self.assertTrue(all(names.count(name) == 2 for name in names))
+        self.assertEqual([start for _, start in kept[0]], sorted(start for _, start in kept[0]))
+
+        with gzip.open(self.path / "deep_0.filtered.coverage.bedgraph.gz", 'rt') as bedgraph:
+            coverage = bedgraph.read().splitlines()
+        self.assertTrue((self.path / "deep_0.filtered.coverage.bedgraph.gz.tbi").exists())
+        self.assertEqual(max(int(line.split("\t")[3]) for line in coverage), 2000)
+
+    def test__read_sampler__keeps_mates_of_one_bucket_together(self):
+        # 20 pairs with both mates in the 50 bp bucket at chr1:1000, 100 bp reads giving a capacity of 2 reads
+        records = sorted([(f"pair_{number}", 1000 + number) for number in range(20)] +
+                         [(f"pair_{number}", 1020 + number) for number in range(20)], key=lambda record: record[1])
+        bam_header = pysam.AlignmentHeader.from_dict(header)
+        sampler = ReadSampler(max_depth=4)
+        kept = []
+        for name, start in records:
+            read = pysam.AlignedSegment(bam_header)
+            read.query_name = name
+            read.reference_id = 0
+            read.reference_start = start
+            read.cigarstring = '100M'
+            read.is_paired = True
+            read.next_reference_id = 0
+            read.next_reference_start = start + 20 if start < 1020 else start - 20
+            kept += sampler.add(read)
+        kept += sampler.flush()
+
+        self.assertEqual(sampler.capacity, 2)
+        self.assertEqual(len(kept), 2)
+        self.assertEqual(kept[0].query_name, kept[1].query_name)
+        self.assertEqual(sampler.dropped, 38)
+        self.assertEqual(sampler.decisions, {})
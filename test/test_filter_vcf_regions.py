@@ -0,0 +1,55 @@
+import gzip
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import pysam
+
+from bin.filter_vcf_regions import VcfRegionsFilter
+from bin.filter_vcf_regions import record_span
+
+sample_vcf = """##fileformat=VCFv4.2
+##contig=<ID=chr1,length=10000>
+##contig=<ID=chr2,length=10000>
+##INFO=<ID=END,Number=1,Type=Integer,Description="End position">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+chr1\t100\tbefore\tA\tG\t.\tPASS\t.
+chr1\t950\tdeletion\tACGT\tA\t.\tPASS\t.
+chr1\t1500\tsv\tN\t<DEL>\t.\tPASS\tEND=3000
+chr1\t2500\tinside_sv\tA\tT\t.\tPASS\t.
+chr2\t450\tother_contig\tA\tT\t.\tPASS\t.
+"""
+
+
+class TestVcfRegionsFilter(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+        (self.path / "calls.vcf").write_text(sample_vcf)
+        (self.path / "regions.bed").write_text("chr1\t900\t1000\nchr1\t2000\t2100\nchr2\t400\t600\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _filter(self, vcf_name, regions_name="regions.bed"):
+        output = str(self.path / "calls.filtered.vcf.gz")
+        records = VcfRegionsFilter(str(self.path / vcf_name), str(self.path / regions_name), output).build()
+        self.assertTrue(Path(f"{output}.tbi").exists())
+        with gzip.open(output, 'rt') as filtered:
+            return records, [line.split('\t')[2] for line in filtered if not line.startswith('#')]
+
+    def test__record_span(self):
+        self.assertEqual(record_span("chr1 950 deletion ACGT A . PASS .".split()), (949, 953))
+        self.assertEqual(record_span("chr1 1500 sv N <DEL> . PASS END=3000".split()), (1499, 3000))
+
+    def test__build__streams_plain_vcf(self):
+        self.assertEqual(self._filter("calls.vcf"), (3, ["deletion", "sv", "other_contig"]))
+
+    def test__build__fetches_indexed_vcf(self):
+        pysam.tabix_index(str(self.path / "calls.vcf"), preset='vcf')
+        self.assertEqual(self._filter("calls.vcf.gz"), (3, ["deletion", "sv", "other_contig"]))
+
+    def test__build__keeps_first_record_when_nothing_overlaps(self):
+        (self.path / "none.bed").write_text("chr3\t1\t5\n")
+        self.assertEqual(self._filter("calls.vcf", "none.bed"), (0, ["before"]))
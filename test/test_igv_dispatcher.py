@@ -0,0 +1,111 @@
+import asyncio
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from bin.igv_dispatcher import SnapshotDispatcher
+
+
+class FakeIGV:
+    """Answer IGV batch commands on a local port, writing an empty file for every snapshot."""
+
+    def __init__(self, crash_on=(), hang_on=()):
+        self.crash_on = set(crash_on)
+        self.hang_on = set(hang_on)
+        self.commands = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        snapshots_dir = None
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command, _, argument = line.decode().strip().partition(' ')
+            self.commands.append(command)
+            if argument in self.crash_on:
+                # Only crash once, as a restarted IGV would not
+                self.crash_on.discard(argument)
+                break
+            if argument in self.hang_on:
+                await asyncio.sleep(3600)
+            if command == 'snapshotDirectory':
+                snapshots_dir = Path(argument)
+            elif command == 'snapshot':
+                (snapshots_dir / argument).touch()
+            writer.write(b"OK\n")
+            await writer.drain()
+        writer.close()
+
+
+class TestSnapshotDispatcher(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+        commands = [f"snapshotDirectory {self.path / 'captures'}"]
+        for start in range(0, 1000, 100):
+            commands += [f"goto chr1:{start}-{start + 50}", f"snapshot region_{start}.png"]
+        (self.path / "batch.txt").write_text("\n".join(commands) + "\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _dispatch(self, servers, **options):
+        async def run():
+            ports = [await server.start() for server in servers]
+            try:
+                dispatcher = SnapshotDispatcher("session.xml", [self.path / "batch.txt"], ports, **options)
+                await dispatcher.run()
+                return dispatcher
+            finally:
+                for server in servers:
+                    await server.stop()
+        return asyncio.run(run())
+
+    def test__run__spreads_snapshots_over_workers(self):
+        servers = [FakeIGV(), FakeIGV()]
+        dispatcher = self._dispatch(servers, queue_size=1)
+
+        self.assertEqual(dispatcher.rendered, 10)
+        self.assertEqual(len(list((self.path / "captures").glob("*.png"))), 10)
+        for server in servers:
+            # The session is loaded once per worker
+            self.assertEqual(server.commands.count('load'), 1)
+            self.assertGreater(server.commands.count('snapshot'), 0)
+
+    def test__run__loads_sessions_of_the_batch(self):
+        commands = (self.path / "batch.txt").read_text().splitlines()
+        commands.insert(11, "load session.coverage.xml")
+        (self.path / "batch.txt").write_text("\n".join(commands) + "\n")
+        server = FakeIGV()
+        dispatcher = self._dispatch([server])
+
+        self.assertEqual(dispatcher.rendered, 10)
+        # The session of the batch is loaded after the first five snapshots
+        self.assertEqual(server.commands.count('load'), 2)
+        self.assertEqual(server.commands.index('load', 1), server.commands.index('goto', 0) + 10)
+
+    def test__run__retries_on_crashed_worker(self):
+        server = FakeIGV(crash_on=["region_300.png"])
+        dispatcher = self._dispatch([server])
+
+        self.assertEqual(dispatcher.rendered, 10)
+        self.assertEqual(dispatcher.failed, [])
+        self.assertEqual(server.commands.count('load'), 2)
+        self.assertTrue((self.path / "captures" / "region_300.png").exists())
+
+    def test__run__gives_up_after_timeouts(self):
+        server = FakeIGV(hang_on=["chr1:500-550"])
+        dispatcher = self._dispatch([server], command_timeout=0.1, retries=1)
+
+        self.assertEqual(dispatcher.rendered, 9)
+        self.assertEqual(dispatcher.failed, [str(self.path / "captures" / "region_500.png")])
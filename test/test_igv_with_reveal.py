@@ -0,0 +1,453 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from unittest import TestCase
+from unittest import mock
+
+import pysam
+
+from bin.batch_io import read_snapshot_jobs
+from bin.igv_with_reveal import CachedBatchFilter
+from bin.igv_with_reveal import IGVSessionBuilder
+from bin.igv_with_reveal import RegionDelta
+from bin.igv_with_reveal import ResourcePlanner
+from bin.igv_with_reveal import SnapshotCache
+from bin.igv_with_reveal import SnapshotsCommandBuilder
+from bin.igv_with_reveal import Track
+from bin.igv_with_reveal import estimate_reloads
+from bin.igv_with_reveal import generate_all
+from bin.igv_with_reveal import main
+
+regions_a = "chr2\t100\t200\nchr1\t500\t600\nchr1\t50\t80\n"
+regions_b = "chr1\t300\t400\nchr3\t1\t10\n"
+
+
+class TestIGVSessionBuilder(TestCase):
+
+    def test__build__track_types(self):
+        output = StringIO()
+        with redirect_stdout(output):
+            IGVSessionBuilder("genome.fa", ["Reads:reads.filtered.bam", "Calls:calls.filtered.vcf.gz",
+                                            "Genes:genes.bed"]).build()
+        session = output.getvalue()
+
+        self.assertIn('<Resource path="calls.filtered.vcf.gz"/>', session)
+        self.assertIn('clazz="org.broad.igv.variant.VariantTrack"', session)
+        self.assertIn('id="reads.filtered.bam_coverage"', session)
+        self.assertIn('clazz="org.broad.igv.track.FeatureTrack" colorScale="ContinuousColorScale;0.0;0.0;'
+                      '255,255,255;0,0,178" fontSize="10" groupByStrand="false" id="genes.bed"', session)
+        self.assertIn('<PanelLayout dividerFractions="0.0,0.1935483870967742,0.8387096774193549,1.0"/>', session)
+
+    def test__build__explicit_indexes(self):
+        output = StringIO()
+        with redirect_stdout(output):
+            IGVSessionBuilder("genome.fa", ["Reads:reads.filtered.bam:reads.filtered.bam.csi",
+                                            "Genes:genes.bed"]).build()
+        session = output.getvalue()
+
+        self.assertIn('<Resource path="reads.filtered.bam" index="reads.filtered.bam.csi"/>', session)
+        self.assertIn('<Resource path="genes.bed"/>', session)
+
+    def test__build__coverage_track(self):
+        output = StringIO()
+        with redirect_stdout(output):
+            IGVSessionBuilder("genome.fa", ["Reads:reads.filtered.bam",
+                                            "Reads_full_depth:reads.filtered.coverage.bedgraph"]).build()
+
+        self.assertIn('clazz="org.broad.igv.track.DataSourceTrack" color="175,175,175" fontSize="10" '
+                      'id="reads.filtered.coverage.bedgraph"', output.getvalue())
+
+    def test__build__precomputed_alignment_coverage(self):
+        output = StringIO()
+        with redirect_stdout(output):
+            IGVSessionBuilder("genome.fa", ["Reads:reads.filtered.bam",
+                                            "Reads:reads.coverage.bedgraph.gz:reads.coverage.bedgraph.gz.tbi"]).build()
+        session = output.getvalue()
+
+        self.assertNotIn('org.broad.igv.sam.CoverageTrack', session)
+        self.assertIn('<Resource path="reads.coverage.bedgraph.gz" index="reads.coverage.bedgraph.gz.tbi"/>', session)
+        self.assertIn('clazz="org.broad.igv.track.DataSourceTrack" color="175,175,175" fontSize="10" '
+                      'id="reads.coverage.bedgraph.gz" name="Reads Coverage"', session)
+        # The coverage is drawn in the panel of its alignments, not with the features
+        self.assertEqual(session.count('<Panel '), 3)
+
+    def test__build__rendering_profiles(self):
+        tracks = ["Reads:reads.filtered.bam", "Reads:reads.coverage.bedgraph.gz", "Contigs:contigs.bam"]
+        squished = StringIO()
+        IGVSessionBuilder("genome.fa", tracks, IGVSessionBuilder.SQUISHED).write(squished)
+        coverage = StringIO()
+        IGVSessionBuilder("genome.fa", tracks, IGVSessionBuilder.COVERAGE).write(coverage)
+
+        self.assertEqual(squished.getvalue().count('displayMode="SQUISHED"'), 2)
+        # Alignments with a precomputed coverage are not loaded, the other ones are hidden
+        self.assertNotIn('reads.filtered.bam', coverage.getvalue())
+        self.assertIn('id="reads.coverage.bedgraph.gz" name="Reads Coverage"', coverage.getvalue())
+        self.assertIn('id="contigs.bam" name="Contigs" visible="false"', coverage.getvalue())
+        self.assertIn('id="contigs.bam_coverage"', coverage.getvalue())
+        self.assertEqual(IGVSessionBuilder.variant_name("igv.session.xml", IGVSessionBuilder.COVERAGE),
+                         "igv.session.coverage.xml")
+
+
+class TestSnapshotsCommandBuilder(TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        Path("a.bed").write_text(regions_a)
+        Path("b.bed").write_text(regions_b)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+
+    def _read_manifest(self):
+        with open(SnapshotsCommandBuilder.SHARDS_MANIFEST) as manifest:
+            return list(csv.DictReader(manifest))
+
+    def test__build__one_batch_per_prefix(self):
+        SnapshotsCommandBuilder(["A_:a.bed", "B_:b.bed"], [50], "captures").build()
+
+        self.assertEqual(Path("snapshots_B_.txt").read_text(),
+                         "snapshotDirectory captures\n"
+                         "goto chr1:250-450\n"
+                         "snapshot B_chr1_300_400_slop50.png\n"
+                         "goto chr3:0-60\n"
+                         "snapshot B_chr3_1_10_slop50.png\n")
+
+    def test__build__unprefixed_batch_named_after_content(self):
+        Path("c.bed").write_text(regions_b)
+        batches = SnapshotsCommandBuilder([":b.bed", ":c.bed"], [50], "captures").build()
+
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(batches[0], batches[1])
+        self.assertEqual(batches[0], f"./snapshots_{SnapshotsCommandBuilder.batch_label('b.bed')}.txt")
+        self.assertEqual(SnapshotsCommandBuilder.batch_label("b.bed"), SnapshotsCommandBuilder.batch_label("c.bed"))
+
+    def test__generate_all__session_batch_and_preferences(self):
+        os.mkdir("igv_files")
+        paths = generate_all("genome.fa", ["Reads:reads.bam"], ["A_:a.bed", "B_:b.bed"], [50], "captures",
+                             output_dir="igv_files", igv_options=[{"SAM.SHOW_SOFT_CLIPPED": "true"}], shards=2)
+
+        self.assertEqual(paths["session"], "igv_files/igv.session.xml")
+        self.assertEqual(paths["batches"], ["igv_files/snapshots_shard_1.txt", "igv_files/snapshots_shard_2.txt"])
+        self.assertTrue(Path("igv_files/shards_manifest.csv").is_file())
+        self.assertEqual(Path("igv_files/prefs.properties").read_text(), "SAM.SHOW_SOFT_CLIPPED=true\n")
+
+        session = StringIO()
+        IGVSessionBuilder("genome.fa", ["Reads:reads.bam"]).write(session)
+        self.assertEqual(Path("igv_files/igv.session.xml").read_text(), session.getvalue())
+
+    def test__build__zoom_profiles(self):
+        paths = generate_all("genome.fa", ["Reads:reads.bam"], ["A_:a.bed"], [50, 500, 5000], "captures",
+                             zoom_windows={"squished": 1000, "coverage": 5500}, schedule=True)
+
+        self.assertEqual(paths["sessions"], {"full": "./igv.session.xml", "squished": "./igv.session.squished.xml",
+                                             "coverage": "./igv.session.coverage.xml"})
+        commands = [line for line in Path(SnapshotsCommandBuilder.SCHEDULED_BATCH).read_text().splitlines()
+                    if not line.startswith("goto ")]
+        # Snapshots are grouped by profile, each group loading its session once
+        self.assertEqual(commands, ["snapshotDirectory captures",
+                                    "snapshot A_chr1_50_80_slop500.png", "snapshot A_chr1_50_80_slop50.png",
+                                    "snapshot A_chr1_500_600_slop50.png", "snapshot A_chr2_100_200_slop500.png",
+                                    "snapshot A_chr2_100_200_slop50.png",
+                                    "load igv.session.squished.xml",
+                                    "snapshot A_chr1_50_80_slop5000.png", "snapshot A_chr1_500_600_slop500.png",
+                                    "snapshot A_chr2_100_200_slop5000.png",
+                                    "load igv.session.coverage.xml",
+                                    "snapshot A_chr1_500_600_slop5000.png",
+                                    "load igv.session.xml"])
+
+    def test__build__zoom_profiles_zero_width_window(self):
+        Path("point.bed").write_text("chr1\t1000\t1000\n")
+        generate_all("genome.fa", ["Reads:reads.bam"], ["P_:point.bed"], [0, 10], "captures",
+                     zoom_windows={"coverage": 1000})
+
+        snapshots = [line for line in Path("snapshots_P_.txt").read_text().splitlines() if line.startswith("snapshot ")]
+        self.assertEqual(sorted(snapshots), ["snapshot P_chr1_1000_1000_slop0.png",
+                                             "snapshot P_chr1_1000_1000_slop10.png"])
+
+    def test__build__zoom_profiles_concatenated_batches(self):
+        generate_all("genome.fa", ["Reads:reads.bam"], ["A_:a.bed", "B_:b.bed"], [10, 5000], "captures",
+                     zoom_windows={"coverage": 1000})
+        # As IGV_SNAPSHOTS runs them, every batch after the load of the full session
+        Path("snapshots.txt").write_text("load igv.session.xml\n" + Path("snapshots_A_.txt").read_text() +
+                                         Path("snapshots_B_.txt").read_text())
+
+        sessions = {Path(job[3]).name: job[4] for job in read_snapshot_jobs(["snapshots.txt"], sessions=True)}
+        self.assertEqual(len(sessions), 10)
+        for snapshot, session in sessions.items():
+            expected = "igv.session.coverage.xml" if snapshot.endswith("slop5000.png") else "igv.session.xml"
+            self.assertEqual(session, expected, snapshot)
+
+    def test__build__one_batch_per_group(self):
+        Path("group_1.bed").write_text("chr1\t0\t130\t.\nchr1\t250\t450\t.\n")
+        Path("group_2.bed").write_text("chr1\t450\t650\t.\nchr2\t50\t250\t.\nchr3\t0\t60\t.\n")
+        SnapshotsCommandBuilder(["A_:a.bed", "B_:b.bed"], [50], "captures",
+                                groups=["group_1.bed", "group_2.bed"]).build()
+
+        manifest = self._read_manifest()
+        self.assertEqual([row['shard'] for row in manifest], ["group_1", "group_2"])
+        self.assertEqual([row['first_region'] for row in manifest], ["chr1:50-80", "chr1:500-600"])
+        self.assertEqual(Path("snapshots_group_1.txt").read_text(),
+                         "snapshotDirectory captures/group_1\n"
+                         "goto chr1:0-130\n"
+                         "snapshot A_chr1_50_80_slop50.png\n"
+                         "goto chr1:250-450\n"
+                         "snapshot B_chr1_300_400_slop50.png\n")
+
+    def test__build__shards_are_balanced_and_sorted(self):
+        SnapshotsCommandBuilder(["A_:a.bed", "B_:b.bed"], [50, 100], "captures", shards=2).build()
+
+        manifest = self._read_manifest()
+        self.assertEqual([row['shard'] for row in manifest], ["shard_1", "shard_2"])
+        self.assertEqual([int(row['snapshots']) for row in manifest], [6, 4])
+        self.assertEqual(manifest[0]['first_region'], "chr1:50-80")
+        self.assertEqual(manifest[0]['last_region'], "chr1:500-600")
+
+        batch = Path("snapshots_shard_2.txt").read_text().splitlines()
+        self.assertEqual(batch[0], "snapshotDirectory captures/shard_2")
+        self.assertEqual(batch[2], "snapshot A_chr2_100_200_slop50.png")
+
+    def test__build__max_snapshots_per_shard(self):
+        SnapshotsCommandBuilder(["A_:a.bed", "B_:b.bed"], [50, 100], "captures", max_snapshots_per_shard=4).build()
+
+        manifest = self._read_manifest()
+        self.assertEqual(len(manifest), 3)
+        self.assertTrue(all(int(row['snapshots']) <= 4 for row in manifest))
+        self.assertEqual(sum(int(row['regions']) for row in manifest), 5)
+
+    def test__build__schedule_largest_slop_first_across_prefixes(self):
+        with self.assertLogs(level='INFO') as logs:
+            SnapshotsCommandBuilder(["A_:a.bed", "B_:b.bed"], [50, 500], "captures", schedule=True).build()
+
+        snapshots = [line.split()[1] for line in Path(SnapshotsCommandBuilder.SCHEDULED_BATCH).read_text().splitlines()
+                     if line.startswith("snapshot ")]
+        self.assertEqual(snapshots[:4], ["A_chr1_50_80_slop500.png", "A_chr1_50_80_slop50.png",
+                                         "B_chr1_300_400_slop500.png", "B_chr1_300_400_slop50.png"])
+        self.assertEqual(len(snapshots), 10)
+        self.assertIn("Estimated IGV window reloads: 6 in input order, 5 scheduled", logs.output[-1])
+
+
+class TestRegionDelta(TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        Path("a.bed").write_text(regions_a)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+
+    def _snapshots(self, batch):
+        return [line.split()[1] for line in Path(batch).read_text().splitlines() if line.startswith("snapshot ")]
+
+    def test__build__only_appended_regions(self):
+        delta = RegionDelta()
+        SnapshotsCommandBuilder(["A_:a.bed"], [50], "captures", delta=delta).build()
+        delta.save("state.json")
+        self.assertEqual(len(self._snapshots("snapshots_A_.txt")), 3)
+
+        # The unfinished last row is left for the next run
+        with open("a.bed", 'a') as bed_file:
+            bed_file.write("chr3\t10\t20\nchr3\t30")
+        delta = RegionDelta("state.json")
+        SnapshotsCommandBuilder(["A_:a.bed"], [50], "captures", delta=delta).build()
+        delta.save("state.json")
+        self.assertEqual(self._snapshots("snapshots_A_.txt"), ["A_chr3_10_20_slop50.png"])
+
+        with open("a.bed", 'a') as bed_file:
+            bed_file.write("\t40\n")
+        SnapshotsCommandBuilder(["A_:a.bed"], [50], "captures", delta=RegionDelta("state.json")).build()
+        self.assertEqual(self._snapshots("snapshots_A_.txt"), ["A_chr3_30_40_slop50.png"])
+
+    def test__build__rewritten_file_read_again(self):
+        delta = RegionDelta()
+        SnapshotsCommandBuilder(["A_:a.bed"], [50], "captures", delta=delta).build()
+        delta.save("state.json")
+        Path("a.bed").write_text(regions_b + regions_b)
+
+        with self.assertLogs(level='WARNING'):
+            SnapshotsCommandBuilder(["A_:a.bed"], [50], "captures", delta=RegionDelta("state.json")).build()
+        self.assertEqual(len(self._snapshots("snapshots_A_.txt")), 4)
+
+    def test__build__unprefixed_batch_named_without_reading_file(self):
+        delta = RegionDelta()
+        with mock.patch.object(SnapshotsCommandBuilder, "batch_label", side_effect=AssertionError):
+            batches = SnapshotsCommandBuilder([":a.bed"], [50], "captures", delta=delta).build()
+        delta.save("state.json")
+        self.assertEqual(len(self._snapshots(batches[0])), 3)
+
+        # Every run has its own batch, named after the rows processed before it
+        with open("a.bed", 'a') as bed_file:
+            bed_file.write("chr3\t10\t20\n")
+        next_batches = SnapshotsCommandBuilder([":a.bed"], [50], "captures", delta=RegionDelta("state.json")).build()
+        self.assertNotEqual(next_batches, batches)
+        self.assertEqual(self._snapshots(next_batches[0]), ["chr3_10_20_slop50.png"])
+
+    def test__main__delta(self):
+        main(["delta", "--regions_with_prefixes", "A_:a.bed", "--state", "state.json"])
+        with open("a.bed", 'a') as bed_file:
+            bed_file.write("# appended\nchr3\t10\t20\n")
+        main(["delta", "--regions_with_prefixes", "A_:a.bed", "--state", "state.json", "--output_dir", "next"])
+
+        self.assertEqual(Path("delta/a.bed").read_text(), regions_a)
+        self.assertEqual(Path("next/a.bed").read_text(), "chr3\t10\t20\n")
+        self.assertEqual(json.loads(Path("state.json").read_text())["A_:a.bed"]["offset"],
+                         len(regions_a) + len("# appended\nchr3\t10\t20\n"))
+
+
+class TestEstimateReloads(TestCase):
+
+    def test__estimate_reloads(self):
+        windows = [("chr1", 0, 500), ("chr1", 100, 200), ("chr1", 400, 600), ("chr2", 400, 600), ("chr2", 450, 500)]
+        self.assertEqual(estimate_reloads(windows), 3)
+
+
+class TestSnapshotCache(TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        Path("a.bed").write_text(regions_a)
+        Path("igv.session.xml").write_text("<Session/>")
+        SnapshotsCommandBuilder(["A_:a.bed"], [50], "captures").build()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+
+    def _filter(self, igv_version="2.12.2"):
+        cache = SnapshotCache("cache", ["igv.session.xml"], igv_version)
+        return CachedBatchFilter(["snapshots_A_.txt"], cache, "pending.txt", "fingerprints.tsv").build()
+
+    def _render_pending(self):
+        with open("fingerprints.tsv") as fingerprints:
+            for target, _ in csv.reader(fingerprints, delimiter='\t'):
+                Path(target).parent.mkdir(parents=True, exist_ok=True)
+                Path(target).write_bytes(b"PNG")
+
+    def test__fingerprint__depends_on_context(self):
+        cache = SnapshotCache("cache", ["igv.session.xml"], "2.12.2")
+        other_version = SnapshotCache("cache", ["igv.session.xml"], "2.16.0")
+        self.assertEqual(cache.fingerprint("chr1:0-130"), cache.fingerprint("chr1:0-130"))
+        self.assertNotEqual(cache.fingerprint("chr1:0-130"), cache.fingerprint("chr1:0-131"))
+        self.assertNotEqual(cache.fingerprint("chr1:0-130"), other_version.fingerprint("chr1:0-130"))
+
+    def test__fingerprint__depends_on_track_data(self):
+        Path("genome.fa").write_text(">chr1\nACGT\n")
+        Path("genome.fa.fai").write_text("chr1\t4\t6\t4\t5\n")
+        fingerprint = SnapshotCache("cache", ["igv.session.xml"], "2.12.2", ["key_1"], ["genome.fa"]) \
+            .fingerprint("chr1:0-130")
+
+        self.assertNotEqual(SnapshotCache("cache", ["igv.session.xml"], "2.12.2", ["key_2"], ["genome.fa"])
+                            .fingerprint("chr1:0-130"), fingerprint)
+        # Same staged names, other content
+        Path("genome.fa.fai").write_text("chr1\t4\t6\t4\t5\nchr2\t4\t16\t4\t5\n")
+        self.assertNotEqual(SnapshotCache("cache", ["igv.session.xml"], "2.12.2", ["key_1"], ["genome.fa"])
+                            .fingerprint("chr1:0-130"), fingerprint)
+
+    def test__filter__misses_cache_when_track_changes(self):
+        Path("reads.bam").write_bytes(b"reads")
+        cache = SnapshotCache("cache", ["igv.session.xml"], "2.12.2", data_files=["reads.bam"])
+        CachedBatchFilter(["snapshots_A_.txt"], cache, "pending.txt", "fingerprints.tsv").build()
+        self._render_pending()
+        main(["store-cache", "--cache_dir", "cache", "--fingerprints", "fingerprints.tsv"])
+        shutil.rmtree("captures")
+        self.assertEqual(CachedBatchFilter(["snapshots_A_.txt"], cache, "pending.txt", "fingerprints.tsv").build(), 0)
+        shutil.rmtree("captures")
+
+        Path("reads.bam").write_bytes(b"other reads")
+        cache = SnapshotCache("cache", ["igv.session.xml"], "2.12.2", data_files=["reads.bam"])
+        self.assertEqual(CachedBatchFilter(["snapshots_A_.txt"], cache, "pending.txt", "fingerprints.tsv").build(), 3)
+
+    def test__filter__renders_everything_on_empty_cache(self):
+        self.assertEqual(self._filter(), 3)
+        self.assertEqual(Path("pending.txt").read_text(), Path("snapshots_A_.txt").read_text())
+
+    def test__filter__resumes_partial_run(self):
+        Path("captures").mkdir()
+        Path("captures/A_chr2_100_200_slop50.png").write_bytes(b"PNG")
+
+        self.assertEqual(self._filter(), 2)
+        self.assertNotIn("A_chr2_100_200_slop50.png", Path("pending.txt").read_text())
+
+    def test__filter__restores_cached_snapshots(self):
+        self._filter()
+        self._render_pending()
+        cache = SnapshotCache("cache", [], "")
+        with open("fingerprints.tsv") as fingerprints:
+            for target, fingerprint in csv.reader(fingerprints, delimiter='\t'):
+                self.assertTrue(cache.store(fingerprint, target))
+        shutil.rmtree("captures")
+
+        self.assertEqual(self._filter(), 0)
+        self.assertEqual(Path("pending.txt").read_text(), "snapshotDirectory captures\n")
+        self.assertEqual(Path("captures/A_chr1_50_80_slop50.png").read_bytes(), b"PNG")
+
+        shutil.rmtree("captures")
+        self.assertEqual(self._filter(igv_version="2.16.0"), 3)
+
+
+class TestResourcePlanner(TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        header = {'HD': {'VN': '1.6', 'SO': 'coordinate'}, 'SQ': [{'SN': 'chr1', 'LN': 10000}]}
+        with pysam.AlignmentFile("reads.bam", 'wb', header=header) as bam:
+            # 1000 reads over 10 kbp of chr1, 0.1 reads per bp
+            for number in range(1000):
+                read = pysam.AlignedSegment(bam.header)
+                read.query_name = f"read_{number}"
+                read.reference_id = 0
+                read.reference_start = number * 10
+                read.cigarstring = '10M'
+                read.query_sequence = 'A' * 10
+                bam.write(read)
+        pysam.index("reads.bam")
+        Path("genes.bed").write_text("chr1\t0\t10\nchr1\t5000\t5010\n")
+        Path("genome.fa.fai").write_text("chr1\t10000\t0\t60\t61\n")
+        Path("a.bed").write_text("chr1\t1000\t2000\nchr1\t9900\t9950\n")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+
+    def test__plan__estimates_from_index_statistics(self):
+        planner = ResourcePlanner(["Reads:reads.bam:reads.bam.bai", "Genes:genes.bed"], ["A_:a.bed"], [0, 500],
+                                  fai="genome.fa.fai", task_seconds=1)
+        plan = planner.build()
+
+        self.assertEqual(plan["snapshots"], 4)
+        # The widest window is 1000 bp plus twice the slop
+        self.assertAlmostEqual(plan["reads_per_snapshot"]["max"], 200)
+        self.assertAlmostEqual(plan["features_per_snapshot"]["max"], 0.4)
+        self.assertEqual(plan["heap_mb"] % ResourcePlanner.HEAP_STEP_MB, 0)
+        self.assertEqual(plan["memory_mb"], plan["heap_mb"] + ResourcePlanner.JVM_OVERHEAD_MB)
+        self.assertEqual(plan["shards"], 2)
+        with open(ResourcePlanner.PLAN) as plan_file:
+            self.assertEqual(json.load(plan_file), plan)
+
+    def test__feature_density__from_variant_index(self):
+        Path("variants.vcf").write_text("##fileformat=VCFv4.2\n##contig=<ID=chr1,length=1000>\n##contig=<ID=chr2>\n"
+                                        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+                                        "chr1\t10\t.\tA\tC\t.\t.\t.\nchr1\t20\t.\tA\tC\t.\t.\t.\n"
+                                        "chr2\t30\t.\tA\tC\t.\t.\t.\n")
+        scanned = ResourcePlanner._feature_density(Track("Variants", "variants.vcf"), {"chr2": 100})
+        pysam.tabix_index("variants.vcf", preset="vcf")
+
+        # The records are counted by the index, not read
+        with mock.patch("pysam.VariantFile", side_effect=AssertionError):
+            indexed = ResourcePlanner._feature_density(Track("Variants", "variants.vcf.gz"), {"chr2": 100})
+        self.assertEqual(indexed, {"chr1": 0.002, "chr2": 0.01})
+        self.assertEqual(indexed, scanned)
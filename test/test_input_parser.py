@@ -1,4 +1,6 @@
+import csv
 import json
+import os
 import tempfile
 from copy import deepcopy
 from io import StringIO
@@ -9,6 +11,7 @@ from unittest.mock import Mock
 import yaml
 
 from bin.input_parser import InputParser
+from bin.input_parser import load_validator
 from bin.input_parser import validate_schema
 
 simple_json = '{"foo": {"bar": "value"}}'
@@ -62,7 +65,7 @@ class Test(TestCase):
         result, message = validate_schema(json_input, json_schema)
         self.assertFalse(result)
         self.assertEqual(message, "BED-3 file for capture regions must be provided, "
-                                  "cannot contain spaces and must have extension '.bed'")
+                                  "cannot contain spaces and must have extension '.bed' or '.bed.gz'")
 
     def test__validate_schema__invalid_missing_tracks(self):
         yaml_stream = StringIO(deepcopy(sample_input))
@@ -119,4 +122,87 @@ class Test(TestCase):
         with self.assertRaises(AssertionError) as contex:
             InputParser._check_tracks(parser)
         self.assertEqual(str(contex.exception), 'The input file has an unrecognized extension: /path/track1.fa. '
-                                                'It should be one of: .bed, .vcf, .bam')
+                                                'It should be one of: .bed, .vcf, .vcf.gz, .bam')
+
+    def test__validate_schema__reports_all_errors(self):
+        string_data = deepcopy(sample_input).replace("/path3/regions.bed", "wrong_extension.ext")
+        json_input = yaml.safe_load(StringIO(string_data))
+        json_input['reveal']['tracks'].pop()
+
+        validator = load_validator(str(self.schema_path))
+        result, message = validate_schema(json_input, validator.schema, validator)
+        self.assertFalse(result)
+        self.assertEqual(len(message.splitlines()), 2)
+        self.assertIs(load_validator(str(self.schema_path)), validator)
+
+    def test__build__reports_all_file_errors(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            samplesheet = Path(temp_dir) / "samplesheet.yml"
+            samplesheet.write_text(sample_input.replace("/path1/sample1.bam", f"{temp_dir}/missing.bam"))
+            with self.assertRaises(AssertionError) as contex:
+                InputParser(str(samplesheet), f"{temp_dir}/genome.fa").build()
+
+        self.assertEqual(str(contex.exception).splitlines(), [
+            f"The input file doesn't exist: {temp_dir}/genome.fa",
+            "The input file doesn't exist: /path3/regions.bed",
+            f"The input file doesn't exist: {temp_dir}/missing.bam",
+        ])
+
+    def test__build__points_to_current_indexes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name in ("genome.fa", "regions.bed", "fresh.bam", "fresh.bam.bai", "stale.vcf.gz",
+                         "stale.vcf.gz.tbi"):
+                (Path(temp_dir) / name).touch()
+            # An index older than its track is ignored
+            os.utime(Path(temp_dir) / "stale.vcf.gz.tbi", (0, 0))
+            samplesheet = Path(temp_dir) / "samplesheet.yml"
+            samplesheet.write_text(sample_input
+                                   .replace("/path1/sample1.bam", f"{temp_dir}/fresh.bam\n"
+                                            f"        - name: \"Calls\"\n          path: {temp_dir}/stale.vcf.gz")
+                                   .replace("/path3/regions.bed", f"{temp_dir}/regions.bed"))
+            paths = InputParser(str(samplesheet), f"{temp_dir}/genome.fa", output_dir=temp_dir).build()
+
+            with open(paths["params"]) as params:
+                rows = list(csv.DictReader(params))
+
+        tracks = [row for row in rows if row['type'] == 'track']
+        self.assertEqual([track['index'] for track in tracks], [f"{temp_dir}/fresh.bam.bai", ""])
+
+    def test__build__shares_track_filters_between_jobs(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for name in ("genome.fa", "reads.bam", "reads.bam.bai"):
+                (Path(temp_dir) / name).touch()
+            (Path(temp_dir) / "panel.bed").write_text("chr1\t100\t200\nchr1\t250\t300\n")
+            # The same windows once expanded and merged, from another file
+            (Path(temp_dir) / "panel_copy.bed").write_text("chr1\t70\t330\n")
+            (Path(temp_dir) / "other.bed").write_text("chr2\t100\t200\n")
+            samplesheet = Path(temp_dir) / "samplesheet.yml"
+            samplesheet.write_text(yaml.safe_dump({"reveal": [
+                {"name": name, "tracks": [{"name": label, "path": f"{temp_dir}/reads.bam"}],
+                 "capture": {"regions": [{"path": f"{temp_dir}/{regions}", "prefix": f"{name}_"}], "slops": slops}}
+                for name, label, regions, slops in (("panel", "Reads", "panel.bed", [10, 40]),
+                                                    ("copy", "Sample reads", "panel_copy.bed", [10]),
+                                                    ("other", "Reads", "other.bed", [40]))
+            ]}))
+
+            paths = InputParser(str(samplesheet), f"{temp_dir}/genome.fa", output_dir=temp_dir).build()
+
+            with open(paths["params"]) as params:
+                tracks = [row for row in csv.DictReader(params) if row['type'] == 'track']
+            with open(paths["work_graph"]) as work_graph:
+                nodes = list(csv.DictReader(work_graph))
+            slops = Path(paths["jobs"]["copy"]["slops"]).read_text()
+
+        self.assertEqual([track['job'] for track in tracks], ["panel", "copy", "other"])
+        self.assertEqual(tracks[0]['key'], tracks[1]['key'])
+        self.assertNotEqual(tracks[0]['key'], tracks[2]['key'])
+        self.assertEqual([node['jobs'] for node in nodes], ["panel copy", "other"])
+        self.assertEqual(nodes[0]['index'], f"{temp_dir}/reads.bam.bai")
+        self.assertEqual(slops, "10\n")
+
+    def test__load_data__unique_job_names(self):
+        job = yaml.safe_load(sample_input)['reveal']
+        parser = InputParser("samplesheet.yml", "genome.fa")
+        with self.assertRaises(AssertionError) as contex:
+            parser._load_data({"reveal": [dict(job, name="panel"), dict(job, name="panel")]})
+        self.assertEqual(str(contex.exception), "Job names must be unique: panel")
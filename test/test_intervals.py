@@ -0,0 +1,67 @@
+import gzip
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import TestCase
+
+from bin.intervals import IntervalSet
+from bin.intervals import clamp
+from bin.intervals import partition
+from bin.intervals import read_bed
+from bin.intervals import write_bed
+
+regions_a = "track name=regions\nchr2\t100\t200\tsv1\nchr1\t500\t600\nchr1\t50\t80\n"
+regions_b = "# comment\nchr1\t300\t400\nchr3\t1\t10\n"
+
+
+class TestIntervals(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.bed_a = Path(self.temp_dir.name) / "a.bed"
+        self.bed_a.write_text(regions_a)
+        self.bed_b = Path(self.temp_dir.name) / "b.bed.gz"
+        with gzip.open(self.bed_b, 'wt') as bed_b:
+            bed_b.write(regions_b)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test__read_bed__skips_headers_and_extra_columns(self):
+        self.assertEqual(list(read_bed(self.bed_a)), [("chr2", 100, 200), ("chr1", 500, 600), ("chr1", 50, 80)])
+        self.assertEqual(list(read_bed(self.bed_b)), [("chr1", 300, 400), ("chr3", 1, 10)])
+
+    def test__clamp(self):
+        self.assertEqual(clamp("chr1", -50, 100), (0, 100))
+        self.assertEqual(clamp("chr1", 900, 1100, {"chr1": 1000}), (900, 1000))
+        self.assertEqual(clamp("chrUn", 900, 1100, {"chr1": 1000}), (900, 1100))
+
+    def test__merged__keeps_provenance(self):
+        regions = IntervalSet().add_bed(self.bed_a, "A_").add_bed(self.bed_b, "B_")
+        self.assertEqual(len(regions), 5)
+
+        merged = list(regions.expand(100, {"chr1": 650, "chr2": 250}).merged())
+        self.assertEqual(merged, [
+            ("chr1", 0, 180, ["A_"]),
+            ("chr1", 200, 650, ["A_", "B_"]),
+            ("chr2", 0, 250, ["A_"]),
+            ("chr3", 0, 110, ["B_"]),
+        ])
+
+    def test__merged__bookended_intervals(self):
+        regions = IntervalSet()
+        regions.add("chr1", 10, 20)
+        regions.add("chr1", 20, 30)
+        regions.add("chr1", 31, 40)
+        self.assertEqual([interval[:3] for interval in regions.merged()], [("chr1", 10, 30), ("chr1", 31, 40)])
+
+    def test__write_bed(self):
+        output = StringIO()
+        written = write_bed([("chr1", 0, 10, ["", "B_"]), ("chr2", 5, 10, [""])], output)
+        self.assertEqual(written, 2)
+        self.assertEqual(output.getvalue(), "chr1\t0\t10\tB_\nchr2\t5\t10\t.\n")
+
+    def test__partition__contiguous_groups_of_similar_size(self):
+        windows = [("chr1", 0, 100, []), ("chr1", 200, 250, []), ("chr1", 300, 350, []), ("chr2", 0, 100, [])]
+        self.assertEqual(partition(windows, 2), [windows[:2], windows[2:]])
+        self.assertEqual(partition(windows[:1], 3), [windows[:1]])
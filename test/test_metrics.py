@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from bin import igv_with_reveal
+from bin.metrics import Metrics
+from bin.metrics import parse_igv_batch_log
+from bin.metrics import summarize_latencies
+
+igv_log = """INFO [2022-11-14T10:25:30,000] [Main.java:100] [main] Startup  IGV Version 2.12.2
+INFO [2022-11-14T10:25:31,000] [BatchRunner.java:47] [main] Executing Command: load igv_session.xml
+INFO [2022-11-14T10:25:35,000] [BatchRunner.java:47] [main] Executing Command: snapshotDirectory captures
+INFO [2022-11-14T10:25:35,100] [BatchRunner.java:47] [main] Executing Command: goto chr1:100-200
+INFO [2022-11-14T10:25:35,600] [BatchRunner.java:47] [main] Executing Command: snapshot A_chr1_150_160_slop50.png
+INFO [2022-11-14T10:25:36,100] [BatchRunner.java:47] [main] Executing Command: goto chr2:100-5000
+  at org.broad.igv.sam.AlignmentTileLoader.loadTile(AlignmentTileLoader.java:200)
+INFO [2022-11-14T10:25:39,100] [BatchRunner.java:47] [main] Executing Command: snapshot A_chr2_150_160_slop2000.png
+INFO [2022-11-14T10:25:39,600] [BatchRunner.java:47] [main] Executing Command: exit
+"""
+
+
+class TestMetrics(TestCase):
+
+    def test__stage__records_counts_in_start_order(self):
+        metrics = Metrics("tool")
+        with metrics.stage("outer", files=2):
+            with metrics.stage("inner") as counts:
+                counts["regions"] = 10
+
+        stages = metrics.to_dict()["stages"]
+        self.assertEqual([stage["name"] for stage in stages], ["outer", "inner"])
+        self.assertEqual(stages[0]["counts"], {"files": 2})
+        self.assertEqual(stages[1]["counts"], {"regions": 10})
+        self.assertGreaterEqual(stages[0]["wall_seconds"], stages[1]["wall_seconds"])
+        self.assertGreater(stages[1]["peak_rss_bytes"], 0)
+
+    def test__parse_igv_batch_log(self):
+        latencies = list(parse_igv_batch_log(igv_log.splitlines()))
+
+        self.assertEqual([latency["locus"] for latency in latencies], ["chr1:100-200", "chr2:100-5000"])
+        self.assertAlmostEqual(latencies[0]["goto_seconds"], 0.5)
+        self.assertAlmostEqual(latencies[0]["total_seconds"], 1.0)
+        self.assertAlmostEqual(latencies[1]["total_seconds"], 3.5)
+        self.assertEqual(summarize_latencies(latencies)["max_seconds"], 3.5)
+
+    def test__main__metrics_out(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.chdir(temp_dir)
+            try:
+                Path("a.bed").write_text("chr1\t100\t200\nchr1\t500\t600\n")
+                igv_with_reveal.main(["--metrics-out", "metrics.json", "build-batch", "--regions_with_prefixes",
+                                      "A_:a.bed", "--slops", "50", "500", "--snapshots_dir", "captures"])
+                metrics = json.loads(Path("metrics.json").read_text())
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual(metrics["tool"], "igv_with_reveal.py build-batch")
+        self.assertEqual(metrics["stages"][0]["name"], "bed a.bed")
+        self.assertEqual(metrics["stages"][0]["counts"], {"regions": 2, "snapshots": 4})
@@ -0,0 +1,80 @@
+import gzip
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+
+from bin.region_table import RegionTable
+
+
+class TestRegionTable(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _read(self, content, name="regions.bed", label="A_", contigs=None, labels=None, chunk_size=100):
+        path = self.path / name
+        if name.endswith(".gz"):
+            with gzip.open(path, 'wt') as bed_file:
+                bed_file.write(content)
+        else:
+            path.write_text(content)
+        contigs = {} if contigs is None else contigs
+        labels = {} if labels is None else labels
+        return RegionTable.concatenate(RegionTable.read_bed(path, label, contigs, labels, chunk_size),
+                                       contigs, labels)
+
+    def test__read_bed__uniform_columns(self):
+        table = self._read("chr2\t100\t200\tname\nchr1\t5\t10\tname\n", chunk_size=1)
+        self.assertEqual(list(table.contigs), ["chr2", "chr1"])
+        np.testing.assert_array_equal(table.starts, [100, 5])
+        np.testing.assert_array_equal(table.ends, [200, 10])
+
+    def test__read_bed__mixed_columns(self):
+        table = self._read("chr1\t1\t2\tname\t0\nchr1\t3\t4\nchr1\t5\t6\tname\n")
+        np.testing.assert_array_equal(table.starts, [1, 3, 5])
+        np.testing.assert_array_equal(table.ends, [2, 4, 6])
+
+    def test__read_bed__skips_headers_blank_lines_and_extra_columns(self):
+        table = self._read("track name=x\n#comment\nchr1\t1\t2\n\nchr1\t3\t4\tname\t0\nchr2\t5\t6", "r.bed.gz")
+        self.assertEqual([table.region(row) for row in range(len(table))],
+                         [("chr1", 1, 2), ("chr1", 3, 4), ("chr2", 5, 6)])
+
+    def test__sorted(self):
+        contigs, labels = {}, {}
+        a = self._read("chr2\t1\t2\nchr10\t5\t6\n", "a.bed", "A_", contigs, labels)
+        b = self._read("chr10\t5\t6\nchr10\t1\t9\n", "b.bed", "B_", contigs, labels)
+        table = RegionTable.concatenate([b, a], contigs, labels).sorted()
+        self.assertEqual([table.region(row) for row in range(len(table))],
+                         [("chr10", 1, 9), ("chr10", 5, 6), ("chr10", 5, 6), ("chr2", 1, 2)])
+        np.testing.assert_array_equal(table.label_ids, [1, 0, 1, 0])
+
+    def test__windows__clamped(self):
+        table = self._read("chr1\t10\t90\nchr2\t10\t90\n")
+        window_starts, window_ends = table.windows([5, 50], {"chr1": 100})
+        np.testing.assert_array_equal(window_starts, [[5, 0], [5, 0]])
+        np.testing.assert_array_equal(window_ends, [[95, 100], [95, 140]])
+
+    def test__batch_commands(self):
+        table = self._read("chr1\t10\t90\n")
+        self.assertEqual(table.batch_commands([5, 50]),
+                         "goto chr1:5-95\nsnapshot A_chr1_10_90_slop5.png\n"
+                         "goto chr1:0-140\nsnapshot A_chr1_10_90_slop50.png\n")
+
+    def test__batch_commands__scheduled(self):
+        contigs, labels = {}, {}
+        a = self._read("chr1\t10\t90\n", "a.bed", "A_", contigs, labels)
+        b = self._read("chr1\t10\t90\n", "b.bed", "B_", contigs, labels)
+        commands = RegionTable.concatenate([a, b], contigs, labels).sorted().batch_commands([5, 50], scheduled=True)
+        self.assertEqual([line for line in commands.splitlines() if line.startswith("snapshot")],
+                         ["snapshot A_chr1_10_90_slop50.png", "snapshot B_chr1_10_90_slop50.png",
+                          "snapshot A_chr1_10_90_slop5.png", "snapshot B_chr1_10_90_slop5.png"])
+
+    def test__chunks__keep_repeated_regions_together(self):
+        table = self._read("chr1\t1\t2\nchr1\t1\t2\nchr1\t1\t2\nchr1\t3\t4\n")
+        self.assertEqual([len(chunk) for chunk in table.chunks(2)], [3, 1])
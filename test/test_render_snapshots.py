@@ -0,0 +1,96 @@
+import struct
+import tempfile
+import zlib
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+import pysam
+
+from bin.render_snapshots import BACKGROUND
+from bin.render_snapshots import BatchRenderer
+from bin.render_snapshots import COVERAGE
+from bin.render_snapshots import FEATURE
+from bin.render_snapshots import SnapshotRenderer
+from bin.render_snapshots import write_png
+
+
+def read_png(path):
+    """Decode the unfiltered RGB PNGs written by write_png."""
+    data = Path(path).read_bytes()
+    width, height = struct.unpack('>II', data[16:24])
+    idat_length = struct.unpack('>I', data[33:37])[0]
+    rows = np.frombuffer(zlib.decompress(data[41:41 + idat_length]), dtype=np.uint8).reshape(height, width * 3 + 1)
+    return rows[:, 1:].reshape(height, width, 3)
+
+
+class TestRenderSnapshots(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+        (self.path / "genome.fa").write_text(">chr1\n" + "ACGT" * 250 + "\n")
+        (self.path / "genes.bed").write_text("chr1\t100\t200\n")
+        (self.path / "batch.txt").write_text(f"snapshotDirectory {self.path / 'captures'}\n"
+                                             "goto chr1:50-250\nsnapshot genes_slop50.png\n"
+                                             "goto chr1:0-1000\nsnapshot genes_slop100.png\n")
+
+        header = {'HD': {'VN': '1.6', 'SO': 'coordinate'}, 'SQ': [{'SN': 'chr1', 'LN': 1000}]}
+        for name, is_duplicate in (("reads.bam", False), ("duplicates.bam", True)):
+            with pysam.AlignmentFile(str(self.path / name), 'wb', header=header) as bam:
+                for start in range(0, 900, 25):
+                    read = pysam.AlignedSegment(bam.header)
+                    read.query_name = f"read{start}"
+                    read.reference_id = 0
+                    read.reference_start = start
+                    read.cigarstring = '100M'
+                    read.query_sequence = 'A' * 100
+                    read.is_duplicate = is_duplicate
+                    bam.write(read)
+            pysam.index(str(self.path / name))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test__write_png(self):
+        pixels = np.zeros((4, 3, 3), dtype=np.uint8)
+        pixels[1, 2] = (10, 20, 30)
+        write_png(self.path / "image.png", pixels)
+        np.testing.assert_array_equal(read_png(self.path / "image.png"), pixels)
+
+    def test__build__renders_every_snapshot(self):
+        tracks = [f"Reads:{self.path / 'reads.bam'}", f"Genes:{self.path / 'genes.bed'}"]
+        rendered = BatchRenderer(str(self.path / "genome.fa"), tracks, [self.path / "batch.txt"],
+                                 width=200, height=100, processes=2).build()
+        self.assertEqual(rendered, 2)
+
+        pixels = read_png(self.path / "captures" / "genes_slop50.png")
+        self.assertEqual(pixels.shape, (100, 200, 3))
+        # The feature spans the middle half of the 200 bp window, in the bottom panel
+        np.testing.assert_array_equal(pixels[-5, 60], FEATURE)
+        np.testing.assert_array_equal(pixels[-5, 20], (255, 255, 255))
+
+    def test__render__skips_contig_missing_from_reference(self):
+        tracks = [f"Reads:{self.path / 'reads.bam'}", f"Genes:{self.path / 'genes.bed'}"]
+        with SnapshotRenderer(str(self.path / "genome.fa"), tracks, 200, 100) as renderer:
+            pixels = renderer.render("chrUn", 0, 200)
+        self.assertTrue((pixels == BACKGROUND).all(axis=2).sum() > 0.9 * 200 * 100)
+
+    def test__render__draws_coverage_values(self):
+        (self.path / "depth.bedgraph").write_text("track type=bedGraph\nchr1\t0\t100\t5\nchr1\t100\t200\t20\n")
+        tracks = [f"Depth:{self.path / 'depth.bedgraph'}"]
+        with SnapshotRenderer(str(self.path / "genome.fa"), tracks, 200, 100) as renderer:
+            pixels = renderer.render("chr1", 0, 200)
+        # Drawn as bars in the feature panel, not as a feature spanning the window
+        np.testing.assert_array_equal(pixels[-3, 50], COVERAGE)
+        np.testing.assert_array_equal(pixels[-3, 150], COVERAGE)
+        bars = (pixels == COVERAGE).all(axis=2).sum(axis=0)
+        self.assertGreater(bars[150], 3 * bars[50])
+
+    def test__render__does_not_count_duplicates(self):
+        panels = []
+        for name in ("reads.bam", "duplicates.bam"):
+            with SnapshotRenderer(str(self.path / "genome.fa"), [f"Reads:{self.path / name}"], 200, 100) as renderer:
+                panels.append(renderer.render("chr1", 0, 200))
+        self.assertTrue((panels[0] == COVERAGE).all(axis=2).any())
+        self.assertFalse((panels[1] == COVERAGE).all(axis=2).any())
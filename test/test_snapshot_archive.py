@@ -0,0 +1,97 @@
+import csv
+import os
+import struct
+import tarfile
+import tempfile
+import zlib
+from pathlib import Path
+from unittest import TestCase
+
+from bin import snapshot_archive
+from bin.snapshot_archive import SnapshotArchive
+from bin.snapshot_archive import SnapshotPacker
+from bin.snapshot_archive import png_chunks
+from bin.snapshot_archive import recompress_png
+from bin.snapshot_archive import split_snapshot_name
+
+
+def chunk(chunk_type, payload):
+    return struct.pack('>I', len(payload)) + chunk_type + payload + struct.pack('>I', zlib.crc32(chunk_type + payload))
+
+
+def make_png(width, height, seed):
+    """Return a grayscale PNG deflated at the fastest level, its pixel data split in two IDAT chunks."""
+    rows = b''.join(b'\x00' + bytes((seed + row * column) % 7 * 30 for column in range(width))
+                    for row in range(height))
+    pixels = zlib.compress(rows, 1)
+    header = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', pixels[:10]) + \
+        chunk(b'IDAT', pixels[10:]) + chunk(b'IEND', b'')
+
+
+def pixels(png):
+    return zlib.decompress(b''.join(payload for chunk_type, payload in png_chunks(png) if chunk_type == b'IDAT'))
+
+
+class TestSnapshotArchive(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+        self.images = {
+            "shard_1/P1_chr1_100_200_slop50.png": make_png(200, 100, 1),
+            "shard_1/P1_chr1_100_200_slop500.png": make_png(200, 100, 2),
+            "shard_2/P1_2_chr_un_1_300_400_slop50.png": make_png(200, 100, 3),
+        }
+        for name, image in self.images.items():
+            (self.path / "captures" / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.path / "captures" / name).write_bytes(image)
+        self.cwd = os.getcwd()
+        os.chdir(self.path)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+
+    def test__recompress_png__smaller_and_lossless(self):
+        image = make_png(200, 100, 1)
+        recompressed = recompress_png(image)
+
+        self.assertLess(len(recompressed), len(image))
+        self.assertEqual(pixels(recompressed), pixels(image))
+        self.assertEqual([chunk_type for chunk_type, _ in png_chunks(recompressed)], [b'IHDR', b'IDAT', b'IEND'])
+
+    def test__split_snapshot_name__longest_prefix(self):
+        self.assertEqual(split_snapshot_name("P1_2_chr_un_1_300_400_slop50.png", ["P1_", "P1_2_"]),
+                         ("P1_2_", "chr_un_1:300-400", 50))
+        self.assertIsNone(split_snapshot_name("igv_session.png"))
+
+    def test__build__chunked_archives_read_back(self):
+        SnapshotPacker("captures", prefixes=["P1_", "P1_2_"], chunk_bytes=1).build()
+
+        with open(SnapshotPacker.INDEX, newline='') as index_file:
+            entries = list(csv.DictReader(index_file))
+        self.assertEqual([entry["name"] for entry in entries], list(self.images))
+        self.assertEqual([entry["archive"] for entry in entries],
+                         ["snapshots_0001.tar", "snapshots_0002.tar", "snapshots_0003.tar"])
+
+        with SnapshotArchive(SnapshotPacker.INDEX) as archive:
+            for name, image in self.images.items():
+                self.assertEqual(pixels(archive.read(name)), pixels(image))
+            self.assertEqual(archive.find("P1_2_", "chr_un_1:300-400", 50), "shard_2/P1_2_chr_un_1_300_400_slop50.png")
+            self.assertEqual(archive.read("P1_chr1_100_200_slop500.png"),
+                             archive.read("shard_1/P1_chr1_100_200_slop500.png"))
+            with self.assertRaises(KeyError):
+                archive.read("P1_chr1_100_200_slop5.png")
+
+        # The archives are plain tar files
+        with tarfile.open("snapshots_0002.tar") as tar:
+            self.assertEqual(pixels(tar.extractfile("shard_1/P1_chr1_100_200_slop500.png").read()),
+                             pixels(self.images["shard_1/P1_chr1_100_200_slop500.png"]))
+
+    def test__main__extract(self):
+        snapshot_archive.main(["pack", "--captures", "captures", "--prefixes", "P1_"])
+        snapshot_archive.main(["extract", "--names", "P1_chr1_100_200_slop50.png", "--output_dir", "extracted"])
+
+        self.assertEqual([path.relative_to("extracted").as_posix() for path in Path("extracted").rglob("*.png")],
+                         ["shard_1/P1_chr1_100_200_slop50.png"])
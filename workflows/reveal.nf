@@ -17,6 +17,10 @@ for (param in checkPathParamList) { if (param) { file(param, checkIfExists: true
 // Check mandatory parameters
 if (params.input) { ch_input = file(params.input) } else { exit 1, 'Input samplesheet not specified!' }
 
+// FASTA index used to keep regions inside the contigs, when available next to the reference
+def fasta_index = file("${params.fasta}.fai")
+ch_fai = fasta_index.exists() ? fasta_index : []
+
 /*
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     IMPORT LOCAL MODULES/SUBWORKFLOWS
@@ -27,7 +31,9 @@ if (params.input) { ch_input = file(params.input) } else { exit 1, 'Input sample
 // SUBWORKFLOW: Consisting of a mix of local and nf-core/modules
 //
 include { INPUT_CHECK } from '../subworkflows/local/input_check'
+include { DELTA_JOBS } from '../subworkflows/local/input_check'
 include { PREPARE_TRACKS } from '../subworkflows/local/prepare_regions'
+include { PLAN_RESOURCES } from '../subworkflows/local/reveal_igv'
 include { PREPARE_IGV_FILES } from '../subworkflows/local/reveal_igv'
 include { SNAPSHOTS } from '../subworkflows/local/reveal_igv'
 
@@ -41,6 +47,11 @@ include { SNAPSHOTS } from '../subworkflows/local/reveal_igv'
 //
 include { CUSTOM_DUMPSOFTWAREVERSIONS } from '../modules/nf-core/modules/custom/dumpsoftwareversions/main'
 
+//
+// MODULE: Local to the pipeline
+//
+include { SAVE_DELTA_STATE } from '../modules/local/delta_regions'
+
 /*
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     RUN MAIN WORKFLOW
@@ -63,18 +74,39 @@ workflow REVEAL {
 
     ch_versions = ch_versions.mix(INPUT_CHECK.out.versions)
 
+    //
+    // SUBWORKFLOW: Only keep the regions appended since the last run
+    //
+    ch_jobs = INPUT_CHECK.out.jobs
+    if (params.delta_state) {
+        DELTA_JOBS (
+            INPUT_CHECK.out.jobs
+        )
+        ch_jobs = DELTA_JOBS.out.jobs
+        ch_versions = ch_versions.mix(DELTA_JOBS.out.versions)
+    }
+
     PREPARE_TRACKS (
-        INPUT_CHECK.out.reveal.tracks,
-        INPUT_CHECK.out.reveal.regions,
-        INPUT_CHECK.out.reveal.slops
+        ch_jobs,
+        ch_fai
     )
 
     ch_versions = ch_versions.mix(PREPARE_TRACKS.out.versions)
 
+    PLAN_RESOURCES (
+        ch_jobs,
+        ch_fai
+    )
+
+    ch_versions = ch_versions.mix(PLAN_RESOURCES.out.versions)
+
     PREPARE_IGV_FILES (
         PREPARE_TRACKS.out.tracks,
         PREPARE_TRACKS.out.prefixed_regions,
-        INPUT_CHECK.out.reveal.slops
+        ch_jobs,
+        ch_fai,
+        PLAN_RESOURCES.out.plan,
+        PREPARE_TRACKS.out.groups
     )
 
     ch_versions = ch_versions.mix(PREPARE_IGV_FILES.out.versions)
@@ -83,9 +115,19 @@ workflow REVEAL {
         PREPARE_TRACKS.out.tracks,
         PREPARE_IGV_FILES.out.session,
         PREPARE_IGV_FILES.out.batch,
-        INPUT_CHECK.out.reveal.preferences
+        ch_jobs,
+        ch_fai,
+        PLAN_RESOURCES.out.plan,
+        PREPARE_TRACKS.out.prefixed_regions
     )
 
+    if (params.delta_state) {
+        SAVE_DELTA_STATE (
+            DELTA_JOBS.out.state,
+            SNAPSHOTS.out.snapshots
+        )
+    }
+
     CUSTOM_DUMPSOFTWAREVERSIONS (
         ch_versions.unique().collectFile(name: 'collated_versions.yml')
     )